@@ -0,0 +1,128 @@
+# benchmarks/chat_concurrency_benchmark.py
+"""/chat の同時実行スループットを計測するベンチマーク
+
+Lambda検索とBedrock LLMをローカルの疑似実装に差し替え、
+N件の同時リクエストを送信したときのスループットを推論プールの上限ごとに計測する。
+
+実行例:
+    python benchmarks/chat_concurrency_benchmark.py --llm-latency 0.5 --concurrency 1 2 4 8 16
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from pathlib import Path
+
+# fastapi_app は起動時（最初のリクエスト時）にAWSクライアントを初期化するため、ダミーの環境変数を設定しておく
+os.environ.setdefault("AWS_REGION", "ap-northeast-1")
+os.environ.setdefault("BEDROCK_ID", "anthropic.claude-3-5-sonnet-20241022-v2:0")
+os.environ.setdefault("BEDROCK_PROVIDER", "anthropic")
+os.environ.setdefault("BEDROCK_KB_SEARCH_LAMBDA_FUNCTION_NAME", "fake-bedrock-kb-search")
+# 同じ質問を繰り返し送信するため、回答キャッシュと同一質問の集約を無効化して毎回推論プールで回答を生成させる
+os.environ.setdefault("ANSWER_CACHE_ENABLED", "false")
+os.environ.setdefault("REQUEST_COALESCING_ENABLED", "false")
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "fastapi"))
+
+import httpx  # noqa: E402
+from langchain_core.messages import AIMessage  # noqa: E402
+
+import fastapi_app  # noqa: E402
+from admission_control import AdmissionController  # noqa: E402
+from aws_io import IOExecutor  # noqa: E402
+
+
+class FakeLLM:
+    """ChatBedrockの代わりに一定時間ブロックしてから回答を返す疑似LLM"""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    def invoke(self, messages):
+        # botocoreの同期呼び出しを模倣するため、スレッドをブロックする
+        time.sleep(self.latency)
+        return AIMessage(content="給与の支給日は原則として毎月25日です。")
+
+
+def make_fake_lambda(latency: float):
+    """Lambda検索の代わりに固定の関連ドキュメントを返す疑似関数を作成する"""
+
+    async def fake_call_lambda_function(function_name: str, payload: dict):
+        await asyncio.sleep(latency)
+        return {
+            "related_documents": [
+                {"content": "給与の支給日は毎月25日とする。", "metadata": {"title": "給与計算規則"}}
+            ]
+        }
+
+    return fake_call_lambda_function
+
+
+def configure_inference_pool(max_concurrency: int, max_requests: int):
+    """推論プールと流量制御の同時実行上限を差し替える
+
+    流量制御の上限が推論プールと異なると、推論プールではなく流量制御の待機・拒否を計測してしまうため同じ値にする。
+    ベンチマークの全リクエストが拒否されずに待機できるよう、待機キューの長さは同時リクエスト数の最大値とする。
+    """
+    fastapi_app.llm_executor.shutdown(wait=True)
+    fastapi_app.LLM_MAX_CONCURRENCY = max_concurrency
+    fastapi_app.llm_executor = IOExecutor(max_workers=max_concurrency, name="llm-inference")
+    fastapi_app.llm_semaphore = asyncio.Semaphore(max_concurrency)
+    if fastapi_app.admission_controller is not None:
+        fastapi_app.admission_controller = AdmissionController(
+            max_concurrency=max_concurrency, max_queue=max_requests, queue_timeout_seconds=None
+        )
+
+
+async def run_level(client: httpx.AsyncClient, concurrency: int, requests_per_worker: int) -> dict:
+    """指定した同時実行数でリクエストを送信し、スループットを計測する"""
+    latencies = []
+
+    async def worker():
+        for _ in range(requests_per_worker):
+            start = time.perf_counter()
+            response = await client.post("/chat", json={"message": "給与の支給日はいつですか？"})
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "elapsed": elapsed,
+        "throughput": len(latencies) / elapsed,
+        "p50": latencies[len(latencies) // 2],
+    }
+
+
+async def main(args):
+    fastapi_app.bedrock_llm = FakeLLM(args.llm_latency)
+    fastapi_app.call_lambda_function = make_fake_lambda(args.lambda_latency)
+
+    transport = httpx.ASGITransport(app=fastapi_app.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+        for max_concurrency in args.pool_sizes:
+            configure_inference_pool(max_concurrency, max(args.concurrency))
+            print(f"\n推論プール上限: {max_concurrency}")
+            print(f"{'同時実行数':>10} {'件数':>6} {'所要時間(s)':>12} {'req/s':>8} {'p50(s)':>8}")
+            for concurrency in args.concurrency:
+                result = await run_level(client, concurrency, args.requests_per_worker)
+                print(
+                    f"{result['concurrency']:>10} {result['requests']:>6} {result['elapsed']:>12.2f} "
+                    f"{result['throughput']:>8.2f} {result['p50']:>8.2f}"
+                )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="/chat の同時実行スループットを計測する")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="疑似LLMの生成時間（秒）")
+    parser.add_argument("--lambda-latency", type=float, default=0.05, help="疑似Lambda検索の応答時間（秒）")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16], help="同時リクエスト数")
+    parser.add_argument("--pool-sizes", type=int, nargs="+", default=[1, 8], help="推論プールの同時実行上限")
+    parser.add_argument("--requests-per-worker", type=int, default=4, help="1ワーカーあたりのリクエスト数")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,291 @@
+# benchmarks/chat_load_benchmark.py
+"""/chat の負荷試験ベンチマーク（Bedrockの費用をかけずにスループットとテールレイテンシを計測）
+
+lambda_client.invoke と ChatBedrock を応答時間を指定できる疑似実装に差し替えて fastapi_app をuvicornで起動し、
+固定の同時実行数ごとに以下を計測する。
+- レイテンシのp50/p95/p99、スループット（req/s）
+- イベントループの遅延（一定間隔のsleepが予定より遅れた時間）
+- /chat/stream の場合は最初のトークンまでの時間（TTFT）
+
+結果はJSONのベースラインとして保存でき、--baseline を指定すると保存済みのベースラインと比較して
+劣化が許容範囲を超えた場合は終了コード1で終了する。
+
+実行例:
+    python benchmarks/chat_load_benchmark.py --concurrency 1 4 16 --output benchmarks/baseline.json
+    python benchmarks/chat_load_benchmark.py --concurrency 1 4 16 --baseline benchmarks/baseline.json
+"""
+import argparse
+import asyncio
+import io
+import json
+import logging
+import os
+import platform
+import sys
+import time
+from pathlib import Path
+
+# fastapi_app は起動時（最初のリクエスト時）にAWSクライアントを初期化するため、ダミーの環境変数を設定しておく
+os.environ.setdefault("AWS_REGION", "ap-northeast-1")
+os.environ.setdefault("BEDROCK_ID", "anthropic.claude-3-5-sonnet-20241022-v2:0")
+os.environ.setdefault("BEDROCK_PROVIDER", "anthropic")
+os.environ.setdefault("BEDROCK_KB_SEARCH_LAMBDA_FUNCTION_NAME", "fake-bedrock-kb-search")
+os.environ.setdefault("RETRIEVAL_BACKEND", "lambda")
+# 毎回検索と回答生成を行う経路を計測するため、回答キャッシュと同一質問の集約は無効化する
+os.environ.setdefault("ANSWER_CACHE_ENABLED", "false")
+os.environ.setdefault("REQUEST_COALESCING_ENABLED", "false")
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "fastapi"))
+
+import httpx  # noqa: E402
+import uvicorn  # noqa: E402
+from langchain_core.messages import AIMessage, AIMessageChunk  # noqa: E402
+
+import fastapi_app  # noqa: E402
+
+QUESTIONS = [
+    "給与の支給日はいつですか？",
+    "有給休暇の申請方法を教えてください。",
+    "残業時間の上限はどのくらいですか？",
+    "会社の設立年を教えてください。",
+]
+ANSWER = "給与の支給日は原則として毎月25日です。25日が休日の場合は前営業日に支給されます。"
+
+
+class FakeLambdaClient:
+    """lambda_client の代わりに一定時間ブロックしてから検索結果を返す疑似クライアント"""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    def invoke(self, FunctionName, InvocationType, Payload):
+        # boto3の同期呼び出しを模倣するため、スレッドをブロックする
+        time.sleep(self.latency)
+        body = {
+            "related_documents": [
+                {"content": "給与の支給日は毎月25日とする。25日が休日の場合は前営業日に支給する。", "metadata": {"title": "給与計算規則"}},
+                {"content": "時間外労働は月45時間を上限とする。", "metadata": {"title": "勤怠管理マニュアル"}},
+            ]
+        }
+        payload = json.dumps({"statusCode": 200, "body": json.dumps(body, ensure_ascii=False)}).encode("utf-8")
+        return {"StatusCode": 200, "Payload": io.BytesIO(payload)}
+
+
+class FakeChatBedrock:
+    """ChatBedrock の代わりに一定時間ブロックしてから回答を返す疑似LLM（ストリーミングはチャンクごとに分割して待機）"""
+
+    def __init__(self, latency: float, first_token_latency: float, chunks: int = 8):
+        self.latency = latency
+        self.first_token_latency = first_token_latency
+        self.chunks = chunks
+
+    def invoke(self, messages):
+        time.sleep(self.latency)
+        return AIMessage(content=ANSWER)
+
+    def stream(self, messages):
+        time.sleep(self.first_token_latency)
+        size = -(-len(ANSWER) // self.chunks)
+        interval = max(0.0, self.latency - self.first_token_latency) / self.chunks
+        for i in range(0, len(ANSWER), size):
+            yield AIMessageChunk(content=ANSWER[i:i + size])
+            time.sleep(interval)
+
+
+class EventLoopLagMonitor:
+    """一定間隔でsleepし、予定より遅れた時間をイベントループの遅延として記録する"""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.lags = []
+        self._task = None
+
+    async def _run(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(0.0, time.perf_counter() - start - self.interval))
+
+    def start(self):
+        self.lags = []
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+
+def percentile(values: list[float], q: float) -> float:
+    """最近傍法によるパーセンタイル（値がない場合は0）"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered) + 0.5)) - 1))]
+
+
+async def send_request(client: httpx.AsyncClient, endpoint: str, question: str) -> tuple[float, float]:
+    """1件のリクエストを送信し、(レイテンシ, 最初のトークンまでの時間) を返す"""
+    start = time.perf_counter()
+    if endpoint == "/chat":
+        response = await client.post("/chat", json={"message": question})
+        response.raise_for_status()
+        elapsed = time.perf_counter() - start
+        return elapsed, elapsed
+
+    first_token = None
+    async with client.stream("POST", "/chat/stream", json={"message": question}) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if first_token is None and line == "event: token":
+                first_token = time.perf_counter() - start
+    elapsed = time.perf_counter() - start
+    return elapsed, first_token if first_token is not None else elapsed
+
+
+async def run_level(client: httpx.AsyncClient, endpoint: str, concurrency: int, total_requests: int) -> dict:
+    """指定した同時実行数で合計 total_requests 件を送信し、レイテンシとスループットを計測する"""
+    latencies, ttfts, errors = [], [], 0
+    remaining = iter(range(total_requests))
+
+    async def worker():
+        nonlocal errors
+        for i in remaining:
+            try:
+                latency, ttft = await send_request(client, endpoint, QUESTIONS[i % len(QUESTIONS)])
+            except httpx.HTTPError:
+                errors += 1
+                continue
+            latencies.append(latency)
+            ttfts.append(ttft)
+
+    monitor = EventLoopLagMonitor()
+    monitor.start()
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    await monitor.stop()
+
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": errors,
+        "elapsed": elapsed,
+        "throughput": len(latencies) / elapsed if elapsed else 0.0,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        "ttft_p50": percentile(ttfts, 50),
+        "ttft_p95": percentile(ttfts, 95),
+        "loop_lag_p99": percentile(monitor.lags, 99),
+        "loop_lag_max": max(monitor.lags, default=0.0),
+    }
+
+
+def compare_with_baseline(results: list[dict], baseline: dict, tolerance: float) -> list[str]:
+    """ベースラインと比較し、許容範囲を超えて劣化した項目の説明のリストを返す"""
+    baseline_levels = {level["concurrency"]: level for level in baseline["results"]}
+    regressions = []
+    for result in results:
+        previous = baseline_levels.get(result["concurrency"])
+        if previous is None:
+            continue
+        # スループットは低下、レイテンシは増加を劣化とみなす
+        if result["throughput"] < previous["throughput"] * (1 - tolerance):
+            regressions.append(
+                f"同時実行数{result['concurrency']}: req/s {previous['throughput']:.2f} -> {result['throughput']:.2f}"
+            )
+        for key in ("p95", "p99"):
+            if result[key] > previous[key] * (1 + tolerance):
+                regressions.append(
+                    f"同時実行数{result['concurrency']}: {key} {previous[key]:.3f}s -> {result[key]:.3f}s"
+                )
+    return regressions
+
+
+async def main(args) -> int:
+    fastapi_app.lambda_client = FakeLambdaClient(args.lambda_latency)
+    fastapi_app.bedrock_llm = FakeChatBedrock(args.llm_latency, args.first_token_latency)
+    # リクエストごとのログ出力が計測結果に影響しないよう抑制する
+    for name in ("httpx", "fastapi_app", "retrieval_backends"):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+    # ストリーミングの最初のトークンまでの時間を計測するため、ASGITransportではなく実際のHTTPサーバーを起動する
+    # 負荷をかけるクライアントも同じイベントループで動作するため、ループ遅延にはクライアント側の処理も含まれる
+    server = uvicorn.Server(uvicorn.Config(fastapi_app.app, host="127.0.0.1", port=args.port, log_level="warning"))
+    server_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+
+    results = []
+    limits = httpx.Limits(max_connections=max(args.concurrency), max_keepalive_connections=max(args.concurrency))
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}", timeout=None, limits=limits) as client:
+        # 初回のみ発生する初期化の影響を除くためのウォームアップ
+        for i in range(args.warmup):
+            await send_request(client, args.endpoint, QUESTIONS[i % len(QUESTIONS)])
+
+        print(f"エンドポイント: {args.endpoint}、LLM: {args.llm_latency}s、Lambda: {args.lambda_latency}s")
+        print(
+            f"{'同時実行数':>10} {'件数':>6} {'req/s':>8} {'p50(s)':>8} {'p95(s)':>8} {'p99(s)':>8} "
+            f"{'TTFT p50':>9} {'ループ遅延p99(ms)':>18} {'最大(ms)':>9}"
+        )
+        for concurrency in args.concurrency:
+            result = await run_level(client, args.endpoint, concurrency, args.requests)
+            results.append(result)
+            print(
+                f"{result['concurrency']:>10} {result['requests']:>6} {result['throughput']:>8.2f} "
+                f"{result['p50']:>8.3f} {result['p95']:>8.3f} {result['p99']:>8.3f} {result['ttft_p50']:>9.3f} "
+                f"{result['loop_lag_p99'] * 1000:>18.1f} {result['loop_lag_max'] * 1000:>9.1f}"
+            )
+
+    server.should_exit = True
+    await server_task
+
+    report = {
+        "benchmark": "chat_load",
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "environment": {"python": platform.python_version(), "platform": platform.platform(), "cpu_count": os.cpu_count()},
+        "config": {
+            "endpoint": args.endpoint,
+            "requests": args.requests,
+            "llm_latency": args.llm_latency,
+            "first_token_latency": args.first_token_latency,
+            "lambda_latency": args.lambda_latency,
+            "llm_max_concurrency": fastapi_app.LLM_MAX_CONCURRENCY,
+        },
+        "results": results,
+    }
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"\n結果を保存しました: {args.output}")
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+        if baseline.get("config") != report["config"]:
+            print("\n警告: ベースラインと計測条件が異なります")
+        regressions = compare_with_baseline(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\nベースラインからの劣化を検出しました（許容範囲: {args.tolerance:.0%}）")
+            for regression in regressions:
+                print(f"  - {regression}")
+            return 1
+        print(f"\nベースラインからの劣化はありません（許容範囲: {args.tolerance:.0%}）")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="/chat の負荷試験を行う")
+    parser.add_argument("--endpoint", choices=["/chat", "/chat/stream"], default="/chat", help="計測するエンドポイント")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 32], help="同時実行数")
+    parser.add_argument("--requests", type=int, default=200, help="同時実行数ごとのリクエスト数")
+    parser.add_argument("--warmup", type=int, default=5, help="ウォームアップのリクエスト数")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="疑似LLMの生成時間（秒）")
+    parser.add_argument("--first-token-latency", type=float, default=0.1, help="疑似LLMの最初のトークンまでの時間（秒）")
+    parser.add_argument("--lambda-latency", type=float, default=0.05, help="疑似Lambda検索の応答時間（秒）")
+    parser.add_argument("--port", type=int, default=8765, help="ベンチマーク用に起動するサーバーのポート")
+    parser.add_argument("--output", help="結果を保存するJSONファイルのパス")
+    parser.add_argument("--baseline", help="比較するベースラインのJSONファイルのパス")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="劣化とみなすベースラインからの変化率")
+    sys.exit(asyncio.run(main(parser.parse_args())))
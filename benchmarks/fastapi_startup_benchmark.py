@@ -0,0 +1,161 @@
+# benchmarks/fastapi_startup_benchmark.py
+"""FastAPIサーバーの起動時間（モジュールの読み込み・準備完了まで）を計測するベンチマーク
+
+- モジュールの読み込み: 新しいPythonプロセスで fastapi_app をimportするまでの時間
+- 準備完了: uvicornのプロセスを起動してから /ready が200を返すまでの時間（内訳は /ready の timings_ms）
+
+既定ではAWSに接続しないよう起動時のウォームアップを無効化する（--warmup で有効化）。
+結果はJSONのベースラインとして保存でき、--baseline を指定すると保存済みのベースラインと比較して
+劣化が許容範囲を超えた場合は終了コード1で終了する。
+
+実行例:
+    python benchmarks/fastapi_startup_benchmark.py --runs 5 --output benchmarks/startup_baseline.json
+    python benchmarks/fastapi_startup_benchmark.py --runs 5 --baseline benchmarks/startup_baseline.json
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+FASTAPI_DIR = Path(__file__).resolve().parent.parent / "fastapi"
+
+# 起動に必要なダミーの環境変数（実際のAWSには接続しない）
+STARTUP_ENV = {
+    "AWS_REGION": "ap-northeast-1",
+    "AWS_ACCESS_KEY_ID": "benchmark",
+    "AWS_SECRET_ACCESS_KEY": "benchmark",
+    "BEDROCK_ID": "anthropic.claude-3-5-sonnet-20241022-v2:0",
+    "BEDROCK_PROVIDER": "anthropic",
+    "BEDROCK_KB_SEARCH_LAMBDA_FUNCTION_NAME": "fake-bedrock-kb-search",
+    "RETRIEVAL_BACKEND": "lambda",
+}
+
+IMPORT_SCRIPT = f"""
+import sys, time
+start = time.perf_counter()
+sys.path.insert(0, {str(FASTAPI_DIR)!r})
+import fastapi_app
+print(time.perf_counter() - start)
+"""
+
+
+def measure_import(runs: int, env: dict) -> list[float]:
+    """新しいプロセスで fastapi_app の読み込み時間を計測する"""
+    timings = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", IMPORT_SCRIPT],
+            env=env, cwd=FASTAPI_DIR, capture_output=True, text=True, check=True
+        )
+        timings.append(float(output.stdout.strip().splitlines()[-1]))
+    return timings
+
+
+def measure_ready(runs: int, env: dict, port: int, timeout: float) -> tuple[list[float], list[dict]]:
+    """uvicornを起動してから /ready が200を返すまでの時間と、/ready の起動時間の内訳を計測する"""
+    timings = []
+    breakdowns = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "fastapi_app:app", "--port", str(port), "--log-level", "warning"],
+            env=env, cwd=FASTAPI_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        try:
+            while True:
+                if time.perf_counter() - start > timeout:
+                    raise TimeoutError(f"{timeout}秒以内に準備完了になりませんでした")
+                try:
+                    with urllib.request.urlopen(f"http://127.0.0.1:{port}/ready", timeout=1) as response:
+                        body = json.loads(response.read())
+                        break
+                except (urllib.error.URLError, ConnectionError):
+                    # 起動中（接続拒否）・ウォームアップ中（503）は待機する
+                    time.sleep(0.01)
+            timings.append(time.perf_counter() - start)
+            breakdowns.append(body)
+        finally:
+            server.terminate()
+            server.wait()
+    return timings, breakdowns
+
+
+def summarize(label: str, timings: list[float]) -> dict:
+    """計測結果の統計値を表示して返す"""
+    ordered = sorted(timings)
+    result = {
+        "runs": len(timings),
+        "mean": statistics.mean(timings),
+        "p50": statistics.median(timings),
+        "max": ordered[-1],
+    }
+    print(
+        f"{label}: 回数={result['runs']} 平均={result['mean'] * 1000:.1f}ms "
+        f"p50={result['p50'] * 1000:.1f}ms 最大={result['max'] * 1000:.1f}ms"
+    )
+    return result
+
+
+def compare_with_baseline(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """ベースラインと比較し、許容範囲を超えて劣化した項目の説明のリストを返す"""
+    regressions = []
+    for key, result in results.items():
+        previous = baseline["results"].get(key)
+        if previous is not None and result["p50"] > previous["p50"] * (1 + tolerance):
+            regressions.append(f"{key}: p50 {previous['p50'] * 1000:.1f}ms -> {result['p50'] * 1000:.1f}ms")
+    return regressions
+
+
+def main(args) -> int:
+    env = {**os.environ, **STARTUP_ENV, "WARMUP_ENABLED": "true" if args.warmup else "false"}
+
+    results = {"import": summarize("モジュールの読み込み", measure_import(args.runs, env))}
+    ready_timings, breakdowns = measure_ready(args.runs, env, args.port, args.timeout)
+    results["ready"] = summarize("準備完了（/ready）", ready_timings)
+    for stage_name in breakdowns[-1]["timings_ms"]:
+        values = [breakdown["timings_ms"][stage_name] for breakdown in breakdowns if stage_name in breakdown["timings_ms"]]
+        print(f"  - {stage_name}: p50={statistics.median(values):.1f}ms")
+
+    report = {
+        "benchmark": "fastapi_startup",
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "environment": {"python": platform.python_version(), "platform": platform.platform(), "cpu_count": os.cpu_count()},
+        "config": {"runs": args.runs, "warmup": args.warmup},
+        "results": results,
+        "last_ready_breakdown": breakdowns[-1],
+    }
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"\n結果を保存しました: {args.output}")
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+        if baseline.get("config") != report["config"]:
+            print("\n警告: ベースラインと計測条件が異なります")
+        regressions = compare_with_baseline(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\nベースラインからの劣化を検出しました（許容範囲: {args.tolerance:.0%}）")
+            for regression in regressions:
+                print(f"  - {regression}")
+            return 1
+        print(f"\nベースラインからの劣化はありません（許容範囲: {args.tolerance:.0%}）")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="FastAPIサーバーの起動時間を計測する")
+    parser.add_argument("--runs", type=int, default=5, help="計測回数")
+    parser.add_argument("--warmup", action="store_true", help="起動時のウォームアップを有効にする（AWSに接続する）")
+    parser.add_argument("--port", type=int, default=8766, help="ベンチマーク用に起動するサーバーのポート")
+    parser.add_argument("--timeout", type=float, default=60.0, help="準備完了を待つ最大時間（秒）")
+    parser.add_argument("--output", help="結果を保存するJSONファイルのパス")
+    parser.add_argument("--baseline", help="比較するベースラインのJSONファイルのパス")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="劣化とみなすベースラインからの変化率")
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,110 @@
+# benchmarks/lambda_startup_benchmark.py
+"""検索Lambdaのコールドスタート初期化時間とウォーム起動時間を計測するベンチマーク
+
+AWSへの通信はbotocoreのStubberで差し替えるため、認証情報やネットワーク接続は不要。
+- コールドスタート: 新しいPythonプロセスでLambdaモジュールをimportするまでの時間
+- ウォーム起動: 初期化済みのモジュールで lambda_handler を繰り返し呼び出したときの時間
+
+実行例:
+    python benchmarks/lambda_startup_benchmark.py --cold-runs 5 --warm-runs 200
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+LAMBDA_DIR = Path(__file__).resolve().parent.parent / "lambda_functions" / "document_search"
+
+# Lambda実行環境を模したダミーの環境変数
+LAMBDA_ENV = {
+    "AWS_REGION": "ap-northeast-1",
+    "AWS_ACCESS_KEY_ID": "benchmark",
+    "AWS_SECRET_ACCESS_KEY": "benchmark",
+    "BEDROCK_KB_ID": "BENCHMARKKB",
+    "POWERTOOLS_SERVICE_NAME": "bedrock-kb-search",
+    "POWERTOOLS_LOG_LEVEL": "WARNING",
+    # 検索結果キャッシュを無効化し、毎回retrieveを呼び出す経路を計測する
+    "RETRIEVAL_CACHE_ENABLED": "false",
+}
+
+COLD_START_SCRIPT = f"""
+import sys, time
+start = time.perf_counter()
+sys.path.insert(0, {str(LAMBDA_DIR)!r})
+import bedrock_kb_search_function
+print(time.perf_counter() - start)
+"""
+
+RETRIEVE_RESPONSE = {
+    "retrievalResults": [
+        {
+            "content": {"text": "給与の支給日は原則として毎月25日とする。"},
+            "metadata": {"title": "給与計算規則"},
+            "score": 0.82,
+        }
+    ]
+}
+
+
+class LambdaContext:
+    """lambda_handler に渡すダミーのコンテキスト"""
+
+    function_name = "bedrock-kb-search"
+    memory_limit_in_mb = 128
+    invoked_function_arn = "arn:aws:lambda:ap-northeast-1:000000000000:function:bedrock-kb-search"
+    aws_request_id = "benchmark"
+
+
+def measure_cold_start(runs: int) -> list[float]:
+    """新しいプロセスでモジュールの初期化時間を計測する"""
+    env = {**os.environ, **LAMBDA_ENV}
+    timings = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", COLD_START_SCRIPT],
+            env=env, capture_output=True, text=True, check=True
+        )
+        timings.append(float(output.stdout.strip().splitlines()[-1]))
+    return timings
+
+
+def measure_warm_invoke(runs: int) -> list[float]:
+    """初期化済みのモジュールで lambda_handler の実行時間を計測する"""
+    os.environ.update(LAMBDA_ENV)
+    sys.path.insert(0, str(LAMBDA_DIR))
+    from botocore.stub import Stubber
+    import bedrock_kb_search_function
+
+    timings = []
+    context = LambdaContext()
+    with Stubber(bedrock_kb_search_function.bedrock_kb_client) as stubber:
+        for i in range(runs):
+            stubber.add_response("retrieve", RETRIEVE_RESPONSE)
+            start = time.perf_counter()
+            result = bedrock_kb_search_function.lambda_handler({"query_text": f"給与の支給日はいつですか？{i}"}, context)
+            timings.append(time.perf_counter() - start)
+            assert result["statusCode"] == 200, result
+    return timings
+
+
+def summarize(label: str, timings: list[float]):
+    """計測結果の統計値を表示する"""
+    ordered = sorted(timings)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    print(
+        f"{label}: 回数={len(timings)} 平均={statistics.mean(timings) * 1000:.2f}ms "
+        f"p50={statistics.median(timings) * 1000:.2f}ms p95={p95 * 1000:.2f}ms"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="検索Lambdaの起動時間を計測する")
+    parser.add_argument("--cold-runs", type=int, default=5, help="コールドスタートの計測回数")
+    parser.add_argument("--warm-runs", type=int, default=200, help="ウォーム起動の計測回数")
+    args = parser.parse_args()
+
+    summarize("コールドスタート初期化", measure_cold_start(args.cold_runs))
+    summarize("ウォーム起動", measure_warm_invoke(args.warm_runs))
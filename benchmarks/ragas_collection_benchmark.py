@@ -0,0 +1,177 @@
+# benchmarks/ragas_collection_benchmark.py
+"""Ragas評価の回答収集・メトリクス計算の方式の所要時間を比較するベンチマーク
+
+Bedrockのスロットリングを模倣する疑似RAGシステム（一定時間あたりの処理数を超えると429を返す）に対して、
+- 従来方式: 質問ごとに30〜40秒待機する逐次の回答収集と、逐次のメトリクス計算（RunConfigのmax_workers=1）
+- 新方式: 共有のレート制限（AIMD）の下での並列の回答収集・メトリクス計算
+の所要時間とスロットリング回数を比較する。
+従来方式の待機時間は --sleep-scale で縮小して実行し、縮小前の想定所要時間も表示する。
+待機時間の縮小で実際より短い間隔の送信にならないよう、従来方式の回答収集では疑似システムの判定の時間幅も同じ率で縮小する。
+
+実行例:
+    python benchmarks/ragas_collection_benchmark.py --questions 21 --capacity-rps 1.0 --latency 2.0
+"""
+import argparse
+import random
+import sys
+import threading
+import time
+from collections import deque
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "evaluations" / "metrics"))
+
+from rate_limiter import AdaptiveRateLimiter, ThrottledError, run_rate_limited  # noqa: E402
+
+
+class FakeThrottlingRAGSystem:
+    """直近のウィンドウ内の受付数が処理上限を超えるとスロットリングする疑似RAGシステム"""
+
+    def __init__(self, capacity_rps: float, latency: float, time_scale: float = 1.0):
+        self.capacity_rps = capacity_rps
+        self.latency = latency
+        # 判定の時間幅の縮小率（送信間隔を縮小して実行する場合に、同じ率で縮小する）
+        self.time_scale = time_scale
+        self._accepted = deque()
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.throttles = 0
+
+    def query(self, question: str) -> tuple[str, list[str]]:
+        self._accept(question)
+        time.sleep(self.latency)
+        return f"{question}への回答", [f"{question}に関連するドキュメント"]
+
+    def score(self, item: tuple[str, int], latency: float) -> float:
+        """メトリクス計算のLLM・埋め込みの呼び出し1件を模倣する（回答収集と同じ処理上限を共有する）"""
+        self._accept(f"{item[0]}:{item[1]}")
+        time.sleep(latency)
+        return 1.0
+
+    def _accept(self, request: str):
+        with self._lock:
+            self.requests += 1
+            now = time.monotonic()
+            # 直近のウィンドウ内に受け付けたリクエスト数で判定する（1件以上は常に受け付ける）
+            base_window = max(1.0, 1.0 / self.capacity_rps)
+            window = base_window * self.time_scale
+            while self._accepted and now - self._accepted[0] > window:
+                self._accepted.popleft()
+            if len(self._accepted) >= max(1, int(self.capacity_rps * base_window)):
+                self.throttles += 1
+                raise ThrottledError(request)
+            self._accepted.append(now)
+
+
+def scoring_items(questions: list[str], metric_calls: int) -> list[tuple[str, int]]:
+    """メトリクス計算で発生する呼び出しの一覧（質問ごとに metric_calls 件）"""
+    return [(question, i) for question in questions for i in range(metric_calls)]
+
+
+def run_fixed_sleep(system: FakeThrottlingRAGSystem, questions: list[str], sleep_scale: float,
+                    metric_calls: int, scoring_latency: float) -> dict:
+    """従来方式: 質問ごとに30〜40秒（縮小後）待機して逐次送信し、メトリクスも逐次計算する"""
+    slept = 0.0
+    failures = 0
+    start = time.perf_counter()
+    for i, question in enumerate(questions):
+        if i > 0:
+            wait_time = 30 + random.uniform(0, 10)
+            slept += wait_time
+            time.sleep(wait_time * sleep_scale)
+        try:
+            system.query(question)
+        except ThrottledError:
+            failures += 1
+    collection = time.perf_counter() - start
+
+    # メトリクス計算は待機時間を縮小しないため、判定の時間幅も元に戻す
+    system.time_scale = 1.0
+    # メトリクス計算は1件ずつ実行する（スロットリング時はbotocoreの再試行と同様に待機して再試行する）
+    scoring_start = time.perf_counter()
+    for item in scoring_items(questions, metric_calls):
+        while True:
+            try:
+                system.score(item, scoring_latency)
+                break
+            except ThrottledError:
+                time.sleep(1.0)
+    scoring = time.perf_counter() - scoring_start
+
+    elapsed = collection + scoring
+    # 待機時間を縮小せずに実行した場合の想定所要時間
+    projected = elapsed - slept * sleep_scale + slept
+    return {"collection": collection, "scoring": scoring, "elapsed": elapsed, "projected": projected, "failures": failures}
+
+
+def run_adaptive(system: FakeThrottlingRAGSystem, questions: list[str], workers: int, initial_rate: float, max_rate: float,
+                 metric_calls: int, scoring_latency: float) -> dict:
+    """新方式: 共有のレート制限の下で並列に送信し、メトリクスも同じレート制限の下で並列に計算する"""
+    limiter = AdaptiveRateLimiter(initial_rate=initial_rate, max_rate=max_rate)
+    failures = []
+    start = time.perf_counter()
+    run_rate_limited(
+        questions,
+        system.query,
+        limiter,
+        max_workers=workers,
+        on_failure=lambda question, error: failures.append(question)
+    )
+    collection = time.perf_counter() - start
+
+    scoring_start = time.perf_counter()
+    run_rate_limited(
+        scoring_items(questions, metric_calls),
+        lambda item: system.score(item, scoring_latency),
+        limiter,
+        max_workers=workers,
+        max_retries=100
+    )
+    scoring = time.perf_counter() - scoring_start
+
+    elapsed = collection + scoring
+    return {
+        "collection": collection, "scoring": scoring, "elapsed": elapsed, "projected": elapsed,
+        "failures": len(failures), "limiter": limiter.stats()
+    }
+
+
+def main(args):
+    questions = [f"質問{i + 1}" for i in range(args.questions)]
+
+    print(
+        f"質問数: {args.questions}、疑似システムの処理上限: {args.capacity_rps} req/s、応答時間: {args.latency}秒、"
+        f"メトリクス計算: 質問あたり{args.metric_calls}件 × {args.scoring_latency}秒"
+    )
+    header = f"{'方式':<14} {'回答収集(s)':>12} {'メトリクス(s)':>14} {'所要時間(s)':>12} {'想定所要時間(s)':>16} {'スロットリング':>14} {'失敗':>6}"
+    print(header)
+
+    def print_row(name, result, system):
+        print(
+            f"{name:<14} {result['collection']:>12.2f} {result['scoring']:>14.2f} {result['elapsed']:>12.2f} "
+            f"{result['projected']:>16.2f} {system.throttles:>14} {result['failures']:>6}"
+        )
+
+    system = FakeThrottlingRAGSystem(args.capacity_rps, args.latency, time_scale=args.sleep_scale)
+    print_row("fixed_sleep", run_fixed_sleep(system, questions, args.sleep_scale, args.metric_calls, args.scoring_latency), system)
+
+    system = FakeThrottlingRAGSystem(args.capacity_rps, args.latency)
+    result = run_adaptive(
+        system, questions, args.workers, args.initial_rate, args.max_rate, args.metric_calls, args.scoring_latency
+    )
+    print_row("adaptive", result, system)
+    print(f"\nレート制限の最終状態: {result['limiter']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ragas評価の回答収集方式の所要時間を比較する")
+    parser.add_argument("--questions", type=int, default=21, help="質問数（ragas_evaluation.py のテストデータと同数）")
+    parser.add_argument("--capacity-rps", type=float, default=1.0, help="疑似システムが受け付ける最大リクエスト数（req/s）")
+    parser.add_argument("--latency", type=float, default=2.0, help="疑似システムの応答時間（秒）")
+    parser.add_argument("--workers", type=int, default=4, help="新方式の並列数")
+    parser.add_argument("--initial-rate", type=float, default=0.5, help="新方式のレート制限の初期値（req/s）")
+    parser.add_argument("--max-rate", type=float, default=2.0, help="新方式のレート制限の上限（req/s）")
+    parser.add_argument("--sleep-scale", type=float, default=0.01, help="従来方式の待機時間（と疑似システムの判定の時間幅）の縮小率")
+    parser.add_argument("--metric-calls", type=int, default=3, help="質問あたりのメトリクス計算の呼び出し数")
+    parser.add_argument("--scoring-latency", type=float, default=1.0, help="メトリクス計算の呼び出し1件の応答時間（秒）")
+    main(parser.parse_args())
@@ -0,0 +1,149 @@
+# evaluations/metrics/cassette.py
+import hashlib
+import io
+import json
+import os
+import threading
+from collections import defaultdict
+
+from botocore.awsrequest import AWSResponse
+from botocore.response import StreamingBody
+
+# 記録・再生の対象外（off）、記録（record）、再生のみ（replay）
+CASSETTE_MODES = ("off", "record", "replay")
+
+
+class CassetteMissError(Exception):
+    """再生モードでカセットに記録のないリクエストが発生したことを示す例外"""
+
+
+class Cassette:
+    """評価中の /chat の応答とBedrock呼び出しの応答をリクエストのハッシュをキーとしてディスクに記録・再生する
+
+    記録は1件ごとにJSONLへ追記するため、中断した評価を再実行すると記録済みのリクエストは再利用される。
+    同一内容のリクエストが複数回発生する場合（同じプロンプトの複数回生成など）は、記録した順に応答を返す。
+    """
+
+    def __init__(self, path: str, mode: str = "off"):
+        if mode not in CASSETTE_MODES:
+            raise ValueError(f"カセットのモードが不正です: {mode}（{', '.join(CASSETTE_MODES)}）")
+        self.path = path
+        self.mode = mode
+        # リクエストのハッシュ -> 記録順の応答のリスト
+        self._entries = defaultdict(list)
+        # リクエストのハッシュ -> 今回の実行で参照した回数
+        self._lookups = defaultdict(int)
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "recorded": 0, "misses": 0}
+        if mode != "off" and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self._entries[entry["key"]].append(entry["response"])
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != "off"
+
+    def contains(self, request: dict) -> bool:
+        """リクエストの応答が記録済みかを返す"""
+        with self._lock:
+            return _request_hash(request) in self._entries
+
+    def lookup(self, request: dict):
+        """記録済みの応答を返す（記録がない場合、再生モードでは CassetteMissError を送出し、それ以外はNone）
+
+        同じリクエストのn回目の参照にはn件目の記録を返す。再生モードで記録数を超えた場合は先頭から繰り返す。
+        """
+        request_hash = _request_hash(request)
+        with self._lock:
+            responses = self._entries.get(request_hash, [])
+            index = self._lookups[request_hash]
+            self._lookups[request_hash] += 1
+            if index < len(responses) or (self.mode == "replay" and responses):
+                self._counters["hits"] += 1
+                return responses[index % len(responses)]
+            self._counters["misses"] += 1
+        if self.mode == "replay":
+            raise CassetteMissError(f"カセットに記録がありません: {request_hash}")
+        return None
+
+    def record(self, request: dict, kind: str, response):
+        """応答を記録してJSONLに追記する（記録モード以外では何もしない）"""
+        if self.mode != "record":
+            return
+        request_hash = _request_hash(request)
+        line = json.dumps({"key": request_hash, "kind": kind, "response": response}, ensure_ascii=False, default=str)
+        with self._lock:
+            self._entries[request_hash].append(response)
+            self._counters["recorded"] += 1
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+    def attach(self, client):
+        """boto3クライアントの全API呼び出しを記録・再生の対象にする（レート制限より先に判定するため先頭に登録）"""
+        if not self.enabled:
+            return
+        service_id = client.meta.service_model.service_id.hyphenize()
+
+        def before_call(model=None, params=None, context=None, **kwargs):
+            request = {
+                "operation": f"{service_id}.{model.name}",
+                "url_path": params.get("url_path"),
+                "query_string": params.get("query_string"),
+                "body": _decode_body(params.get("body")),
+            }
+            context["cassette_request"] = request
+            recorded = self.lookup(request)
+            if recorded is None:
+                return None
+            # 記録済みの応答を返し、実際の通信を行わない
+            context["cassette_replayed"] = True
+            return AWSResponse(None, 200, {}, None), _restore_parsed(recorded)
+
+        def after_call(http_response=None, parsed=None, model=None, context=None, **kwargs):
+            if context.get("cassette_replayed") or "cassette_request" not in context:
+                return
+            if http_response is None or http_response.status_code >= 300:
+                return
+            self.record(context["cassette_request"], f"{service_id}.{model.name}", _serialize_parsed(parsed))
+
+        client.meta.events.register_first(f"before-call.{service_id}", before_call)
+        client.meta.events.register_first(f"after-call.{service_id}", after_call)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"mode": self.mode, "entries": len(self._entries), **self._counters}
+
+
+def _request_hash(request: dict) -> str:
+    return hashlib.sha256(json.dumps(request, ensure_ascii=False, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def _decode_body(body):
+    if isinstance(body, bytes):
+        return body.decode("utf-8", errors="replace")
+    return body
+
+
+def _serialize_parsed(parsed: dict) -> dict:
+    """応答をJSONで保存できる形式に変換する（InvokeModelのストリームは読み出して差し替える）"""
+    serialized = dict(parsed)
+    body = parsed.get("body")
+    if isinstance(body, StreamingBody):
+        data = body.read()
+        # 呼び出し元が読み出せるよう、読み出したストリームを新しいものに差し替える
+        parsed["body"] = StreamingBody(io.BytesIO(data), len(data))
+        serialized["body"] = {"__streaming_body__": data.decode("utf-8")}
+    return serialized
+
+
+def _restore_parsed(recorded: dict) -> dict:
+    parsed = dict(recorded)
+    body = recorded.get("body")
+    if isinstance(body, dict) and "__streaming_body__" in body:
+        data = body["__streaming_body__"].encode("utf-8")
+        parsed["body"] = StreamingBody(io.BytesIO(data), len(data))
+    return parsed
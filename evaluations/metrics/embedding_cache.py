@@ -0,0 +1,107 @@
+# evaluations/metrics/embedding_cache.py
+import hashlib
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+
+class CachedEmbeddings(Embeddings):
+    """テキストの内容のハッシュをキーとして埋め込みベクトルをSQLiteに保存する埋め込みのラッパー
+
+    評価のたびに同じ質問・生成された質問を埋め込み直さないよう、実行をまたいでベクトルを再利用する。
+    キャッシュにないテキストは重複を除いて batch_size 件ずつ embed_documents でまとめて送信し、
+    複数のバッチは max_workers の並列で実行する（1件ずつしか受け付けないモデルでも並列で処理される）。
+    namespace（モデルIDなど）が異なるベクトルは別のキーとして扱う。
+    """
+
+    def __init__(self, embeddings: Embeddings, path: str, namespace: str, batch_size: int = 16, max_workers: int = 4):
+        self.embeddings = embeddings
+        self.path = path
+        self.namespace = namespace
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # ragasはメトリクス計算を複数スレッドで実行するため、接続を共有してロックで保護する
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+        self._conn.commit()
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "batches": 0}
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        keys = [self._key(text) for text in texts]
+        vectors = self._load(set(keys))
+
+        # キャッシュにないテキストのみを（重複を除いて）埋め込む
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors:
+                missing.setdefault(key, text)
+        with self._lock:
+            self._counters["hits"] += len(keys) - sum(1 for key in keys if key in missing)
+            self._counters["misses"] += len(missing)
+        if missing:
+            vectors.update(self._embed_missing(missing))
+
+        return [vectors[key] for key in keys]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embed_documents([text])[0]
+
+    def stats(self) -> dict:
+        """キャッシュのヒット数・ミス数と、埋め込みモデルに送信したバッチ数を返す"""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            return {**self._counters, "entries": entries}
+
+    def _embed_missing(self, missing: dict) -> dict:
+        items = list(missing.items())
+        batches = [items[i:i + self.batch_size] for i in range(0, len(items), self.batch_size)]
+
+        def embed_batch(batch):
+            return self.embeddings.embed_documents([text for _, text in batch])
+
+        if len(batches) == 1:
+            results = [embed_batch(batches[0])]
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(batches))) as executor:
+                results = list(executor.map(embed_batch, batches))
+
+        vectors = {}
+        for batch, batch_vectors in zip(batches, results):
+            for (key, _), vector in zip(batch, batch_vectors):
+                vectors[key] = list(vector)
+        self._store(vectors)
+        with self._lock:
+            self._counters["batches"] += len(batches)
+        return vectors
+
+    def _load(self, keys: set) -> dict:
+        vectors = {}
+        keys = list(keys)
+        with self._lock:
+            # SQLiteのパラメータ数の上限を超えないよう分割して取得する
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                for key, blob in rows:
+                    vectors[key] = np.frombuffer(blob, dtype="<f8").tolist()
+        return vectors
+
+    def _store(self, vectors: dict):
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [(key, np.asarray(vector, dtype="<f8").tobytes()) for key, vector in vectors.items()]
+            )
+            self._conn.commit()
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.namespace}\0{text}".encode("utf-8")).hexdigest()
@@ -19,6 +19,15 @@ import requests
 import time
 import random
 from ragas.llms import LangchainLLMWrapper
+from cassette import Cassette
+from embedding_cache import CachedEmbeddings
+from rate_limiter import (
+    THROTTLING_STATUS_CODES,
+    AdaptiveRateLimiter,
+    ThrottledError,
+    attach_rate_limiter,
+    run_rate_limited,
+)
 
 # 仮想環境内のNLTKデータパスを追加
 venv_nltk_data = os.path.join(os.environ.get('VIRTUAL_ENV', ''), 'nltk_data')
@@ -30,6 +39,36 @@ BEDROCK_MODEL_ID = os.environ.get("EMBEDDING_MODEL_ID", "amazon.titan-embed-text
 BEDROCK_ID = os.environ.get("BEDROCK_ID")
 BEDROCK_PROVIDER = os.environ.get("BEDROCK_PROVIDER")
 
+# 評価の並列実行設定
+RAG_API_ENDPOINT = os.environ.get("RAG_API_ENDPOINT", "http://localhost:8000/chat")
+EVAL_WORKERS = int(os.environ.get("RAGAS_EVAL_WORKERS", "4"))
+# 回答収集の方式: adaptive（レート制限付き並列）/ fixed_sleep（従来の固定待機による逐次実行）
+COLLECTION_MODE = os.environ.get("RAGAS_COLLECTION_MODE", "adaptive")
+
+# 評価の記録・再生設定
+# record: /chat とBedrockの応答を記録（記録済みのリクエストは再利用するため、中断した評価を再開できる）
+# replay: 記録済みの応答のみでメトリクスを再計算（通信を行わない）
+CASSETTE_MODE = os.environ.get("RAGAS_CASSETTE_MODE", "off")
+CASSETTE_PATH = os.environ.get(
+    "RAGAS_CASSETTE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "cassettes", "ragas_cassette.jsonl")
+)
+
+# 埋め込みのキャッシュ設定
+# AnswerRelevancyが埋め込む質問・生成された質問のベクトルをテキストのハッシュをキーにSQLiteへ保存し、実行をまたいで再利用する
+EMBEDDING_CACHE_ENABLED = os.environ.get("RAGAS_EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+EMBEDDING_CACHE_PATH = os.environ.get(
+    "RAGAS_EMBEDDING_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "cassettes", "embedding_cache.sqlite3")
+)
+# カセットの記録・再生時は、共有の埋め込みキャッシュではなくカセットと対になる埋め込みキャッシュ
+# （<カセットのパス>.embeddings.sqlite3）を使用する。共有の埋め込みキャッシュにヒットした埋め込みは
+# Bedrockを呼び出さないためカセットに記録されず、別の環境（キャッシュなし）で再生できなくなるため。
+# 対になるキャッシュの埋め込みは全てカセットにも記録されるため、再生時にこのファイルがなくてもよい
+if CASSETTE_MODE != "off":
+    EMBEDDING_CACHE_PATH = f"{CASSETTE_PATH}.embeddings.sqlite3"
+EMBEDDING_BATCH_SIZE = int(os.environ.get("RAGAS_EMBEDDING_BATCH_SIZE", "16"))
+
 # テスト用データの準備 - 質問と模範回答のソースとして使用
 test_data = [
     # 会社概要に関する質問
@@ -154,6 +193,21 @@ bedrock_runtime_client = boto3.client(
     config=config
 )
 
+# 回答収集・メトリクス計算で共有するレート制限
+# Bedrockのスロットリングを検知するとレートを下げ、成功が続くと徐々に上げる
+rate_limiter = AdaptiveRateLimiter(
+    initial_rate=float(os.environ.get("RATE_LIMIT_INITIAL_RPS", "0.5")),
+    min_rate=float(os.environ.get("RATE_LIMIT_MIN_RPS", "0.05")),
+    max_rate=float(os.environ.get("RATE_LIMIT_MAX_RPS", "2.0"))
+)
+attach_rate_limiter(bedrock_client, rate_limiter)
+attach_rate_limiter(bedrock_runtime_client, rate_limiter)
+
+# 記録済みの応答はレート制限の待機を行わずに返す
+cassette = Cassette(CASSETTE_PATH, CASSETTE_MODE)
+cassette.attach(bedrock_client)
+cassette.attach(bedrock_runtime_client)
+
 # Bedrock LLMの初期化
 bedrock_llm = ChatBedrock(
     model_id=BEDROCK_ID,
@@ -169,16 +223,30 @@ bedrock_llm = ChatBedrock(
 )
 
 # Bedrockエンベディングの設定
-embeddings = BedrockEmbeddings(
+bedrock_embeddings = BedrockEmbeddings(
     model_id=BEDROCK_MODEL_ID,
     region_name=AWS_REGION,
     client=bedrock_client
 )
+# カセットを新規に記録する場合、以前のカセットの埋め込みキャッシュは使用しない（全ての埋め込みをカセットに記録する）
+if EMBEDDING_CACHE_ENABLED and CASSETTE_MODE == "record" and not os.path.exists(CASSETTE_PATH):
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(EMBEDDING_CACHE_PATH + suffix):
+            os.remove(EMBEDDING_CACHE_PATH + suffix)
+
+# キャッシュにないテキストのみをまとめてBedrockに送信する
+embeddings = CachedEmbeddings(
+    bedrock_embeddings,
+    EMBEDDING_CACHE_PATH,
+    namespace=BEDROCK_MODEL_ID,
+    batch_size=EMBEDDING_BATCH_SIZE,
+    max_workers=EVAL_WORKERS
+) if EMBEDDING_CACHE_ENABLED else bedrock_embeddings
 
-# 実行設定：安定性重視
+# 実行設定：スロットリングは共有のレート制限で回避し、メトリクス計算は並列実行
 run_config = RunConfig(
     timeout=900,  # タイムアウト
-    max_workers=1  # スロットリング回避
+    max_workers=EVAL_WORKERS
 )
 
 def evaluate_model_answers():
@@ -188,56 +256,12 @@ def evaluate_model_answers():
     test_questions = [item["question"] for item in test_data]
     
     # 2. 実際のRAGシステムに質問を送信して回答を取得
-    actual_answers = []
-    contexts_list = []
-    
-    for i, question in enumerate(test_questions):
-        print(f"\n質問 {i+1}/{len(test_questions)}: {question}")
-        
-        # スロットリング回避のため、最初の質問以外は30秒待機
-        if i > 0:
-            # 時間間隔を長くしてThrottling対策
-            wait_time = 30 + random.uniform(0, 10)  # 30〜40秒のランダムな待機時間
-            time.sleep(wait_time)
-        
-        try:
-            response = requests.post(
-                "http://localhost:8000/chat",
-                json={"message": question},
-                headers={"Content-Type": "application/json"},
-                timeout=200
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                answer = result.get("response", "").strip()
-                
-                if answer:
-                    actual_answers.append(answer)
-                    print(f"✓ 回答取得成功: {answer[:50]}...")
-                    
-                    # コンテキスト抽出
-                    contexts = extract_contexts(result)
-                    
-                    # 空のコンテキストの場合はフォールバック
-                    if not contexts:
-                        contexts = [f"関連する質問内容: {question}"]
-                    
-                    contexts_list.append(contexts)
-                    print(f"  最終コンテキスト数: {len(contexts)}")
-                else:
-                    print("✗ 空の回答のため除外")
-                    actual_answers.append("無効な回答")
-                    contexts_list.append(["無効なコンテキスト"])
-            else:
-                print(f"✗ HTTPエラー: {response.status_code}")
-                actual_answers.append("HTTPエラー")
-                contexts_list.append(["HTTPエラー"])
-                
-        except Exception as e:
-            print(f"✗ 例外エラー: {e}")
-            actual_answers.append("例外エラー")
-            contexts_list.append(["例外エラー"])
+    start_time = time.perf_counter()
+    if COLLECTION_MODE == "fixed_sleep":
+        actual_answers, contexts_list = collect_answers_fixed_sleep(test_questions)
+    else:
+        actual_answers, contexts_list = collect_answers(test_questions)
+    print(f"\n回答収集の所要時間: {time.perf_counter() - start_time:.1f}秒（{COLLECTION_MODE}）")
     
     # 3. 評価データセットを作成
     dataset_items = []
@@ -273,9 +297,14 @@ def evaluate_model_answers():
     
     # 5. データセットを作成
     eval_dataset = Dataset.from_list(valid_items)
+
+    # AnswerRelevancyが行ごとに埋め込む質問は、キャッシュにないものを評価の前にまとめて埋め込んでおく
+    if EMBEDDING_CACHE_ENABLED:
+        embeddings.embed_documents([item["user_input"] for item in valid_items])
     
     # 6. 評価実行
     try:
+        metric_start_time = time.perf_counter()
         # Faithfulness専用の設定
         llm_wrapper = LangchainLLMWrapper(bedrock_llm)
         
@@ -297,7 +326,12 @@ def evaluate_model_answers():
             run_config=run_config
         )
         
-        print("✓ 評価完了")
+        print(f"✓ 評価完了（メトリクス計算の所要時間: {time.perf_counter() - metric_start_time:.1f}秒）")
+        print(f"  レート制限: {rate_limiter.stats()}")
+        if cassette.enabled:
+            print(f"  カセット: {cassette.stats()}")
+        if EMBEDDING_CACHE_ENABLED:
+            print(f"  埋め込みキャッシュ: {embeddings.stats()}")
         
         # 結果の抽出
         serializable_results = {
@@ -337,6 +371,98 @@ def evaluate_model_answers():
             "valid_responses": len(valid_items)
         }
 
+def chat_request(question):
+    """カセットのキーとなる /chat のリクエスト内容"""
+    return {"endpoint": RAG_API_ENDPOINT, "message": question}
+
+
+def query_rag_system(question):
+    """RAGシステムに質問を送信し、(回答, コンテキスト) を返す。スロットリング時は ThrottledError を送出する"""
+    result = cassette.lookup(chat_request(question)) if cassette.enabled else None
+    if result is None:
+        try:
+            response = requests.post(
+                RAG_API_ENDPOINT,
+                json={"message": question},
+                headers={"Content-Type": "application/json"},
+                timeout=200
+            )
+        except Exception as e:
+            print(f"✗ 例外エラー: {e}")
+            return "例外エラー", ["例外エラー"]
+
+        if response.status_code in THROTTLING_STATUS_CODES:
+            print(f"  スロットリング検知 (HTTP {response.status_code}): {question[:30]}")
+            raise ThrottledError(question)
+
+        if response.status_code != 200:
+            print(f"✗ HTTPエラー: {response.status_code}")
+            return "HTTPエラー", ["HTTPエラー"]
+
+        result = response.json()
+        cassette.record(chat_request(question), "chat", result)
+
+    answer = result.get("response", "").strip()
+    if not answer:
+        print("✗ 空の回答のため除外")
+        return "無効な回答", ["無効なコンテキスト"]
+
+    print(f"✓ 回答取得成功: {answer[:50]}...")
+
+    # コンテキスト抽出
+    contexts = extract_contexts(result)
+
+    # 空のコンテキストの場合はフォールバック
+    if not contexts:
+        contexts = [f"関連する質問内容: {question}"]
+    print(f"  最終コンテキスト数: {len(contexts)}")
+    return answer, contexts
+
+
+def collect_answers(test_questions):
+    """共有のレート制限の下で質問を並列に送信し、入力順に回答とコンテキストを返す"""
+    # カセットに記録済みの質問は送信せずに再利用する
+    recorded = {question for question in test_questions if cassette.enabled and cassette.contains(chat_request(question))}
+    results = {question: query_rag_system(question) for question in test_questions if question in recorded}
+    pending = [question for question in test_questions if question not in recorded]
+
+    print(f"\n{len(pending)}件の質問を並列数{EVAL_WORKERS}で送信します（記録済み: {len(recorded)}件）")
+    pending_results = run_rate_limited(
+        pending,
+        query_rag_system,
+        rate_limiter,
+        max_workers=EVAL_WORKERS,
+        on_failure=lambda question, error: ("スロットリング", ["スロットリング"])
+    )
+    results.update(zip(pending, pending_results))
+    actual_answers = [results[question][0] for question in test_questions]
+    contexts_list = [results[question][1] for question in test_questions]
+    return actual_answers, contexts_list
+
+
+def collect_answers_fixed_sleep(test_questions):
+    """質問ごとに30〜40秒待機しながら逐次送信する（従来の方式、比較用）"""
+    actual_answers = []
+    contexts_list = []
+    
+    for i, question in enumerate(test_questions):
+        print(f"\n質問 {i+1}/{len(test_questions)}: {question}")
+        
+        # スロットリング回避のため、最初の質問以外は30秒待機（記録済みの質問は待機しない）
+        if i > 0 and not (cassette.enabled and cassette.contains(chat_request(question))):
+            # 時間間隔を長くしてThrottling対策
+            wait_time = 30 + random.uniform(0, 10)  # 30〜40秒のランダムな待機時間
+            time.sleep(wait_time)
+        
+        try:
+            answer, contexts = query_rag_system(question)
+        except ThrottledError:
+            answer, contexts = "スロットリング", ["スロットリング"]
+        actual_answers.append(answer)
+        contexts_list.append(contexts)
+    
+    return actual_answers, contexts_list
+
 # 安全にfloat値に変換する関数
 def safe_float_conversion(value):
     """安全にfloat値に変換する関数"""
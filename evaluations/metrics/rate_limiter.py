@@ -0,0 +1,135 @@
+# evaluations/metrics/rate_limiter.py
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Bedrockのスロットリングとみなすエラーコード
+THROTTLING_ERROR_CODES = {
+    "ThrottlingException",
+    "TooManyRequestsException",
+    "ServiceUnavailableException",
+    "ServiceQuotaExceededException",
+}
+# /chat のスロットリングとみなすHTTPステータス
+THROTTLING_STATUS_CODES = {429, 503}
+
+
+class AdaptiveRateLimiter:
+    """トークンバケット方式のレート制限（AIMDでレートを自動調整）
+
+    成功するたびにレートを加算的に増やし、スロットリングを検知するとレートを乗算的に減らす。
+    複数スレッド・非同期タスクから共有して使用する。
+    """
+
+    def __init__(self, initial_rate: float = 1.0, min_rate: float = 0.05, max_rate: float = 10.0,
+                 increase_step: float = 0.05, decrease_factor: float = 0.5, burst: float = 1.0, cooldown_seconds: float = 2.0):
+        self.rate = initial_rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase_step = increase_step
+        self.decrease_factor = decrease_factor
+        self.burst = burst
+        # 同じ時期のスロットリングで何度もレートを下げないための待機時間
+        self.cooldown_seconds = cooldown_seconds
+        self._tokens = burst
+        self._updated_at = time.monotonic()
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+        self._counters = {"acquired": 0, "successes": 0, "throttles": 0, "waited_seconds": 0.0}
+
+    def _reserve(self) -> float:
+        """トークンを1つ取得し、取得できるまでの待機時間（秒）を返す"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            # 先にトークンを消費し、不足分は待機時間として返す（後続のリクエストはさらに後ろに並ぶ）
+            self._tokens -= 1.0
+            wait = max(0.0, -self._tokens / self.rate)
+            self._counters["acquired"] += 1
+            self._counters["waited_seconds"] += wait
+            return wait
+
+    def acquire(self):
+        """トークンを取得するまで待機する（スレッド用）"""
+        wait = self._reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    async def aacquire(self):
+        """トークンを取得するまで待機する（非同期タスク用）"""
+        wait = self._reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def on_success(self):
+        """成功時にレートを加算的に増やす"""
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase_step)
+            self._counters["successes"] += 1
+
+    def on_throttle(self):
+        """スロットリング検知時にレートを乗算的に減らす"""
+        with self._lock:
+            self._counters["throttles"] += 1
+            now = time.monotonic()
+            if now - self._last_decrease < self.cooldown_seconds:
+                return
+            self._last_decrease = now
+            self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"rate": self.rate, **self._counters}
+
+
+def attach_rate_limiter(client, limiter: AdaptiveRateLimiter):
+    """boto3クライアントの全API呼び出しにレート制限を適用し、スロットリングをレートに反映する"""
+    service_id = client.meta.service_model.service_id.hyphenize()
+
+    def before_call(**kwargs):
+        limiter.acquire()
+
+    def after_call(http_response=None, **kwargs):
+        if http_response is not None and http_response.status_code < 300:
+            limiter.on_success()
+
+    def needs_retry(response=None, **kwargs):
+        # リトライ判定には影響させず、スロットリングの検知のみ行う（Noneを返す）
+        if response is not None and response[1].get("Error", {}).get("Code") in THROTTLING_ERROR_CODES:
+            limiter.on_throttle()
+
+    client.meta.events.register(f"before-call.{service_id}", before_call)
+    client.meta.events.register(f"after-call.{service_id}", after_call)
+    client.meta.events.register(f"needs-retry.{service_id}", needs_retry)
+
+
+def run_rate_limited(items: list, func, limiter: AdaptiveRateLimiter, max_workers: int = 4, max_retries: int = 5, on_failure=None) -> list:
+    """レート制限の下で items の各要素に func を並列適用し、入力順に結果を返す
+
+    func はスロットリングを検知した場合に ThrottledError を送出する。
+    リトライ回数を超えた場合は on_failure(item, error) の戻り値を結果とする（未指定の場合は例外を送出）。
+    """
+
+    def run_item(item):
+        for attempt in range(max_retries + 1):
+            limiter.acquire()
+            try:
+                result = func(item)
+            except ThrottledError as e:
+                limiter.on_throttle()
+                if attempt < max_retries:
+                    continue
+                if on_failure is None:
+                    raise
+                return on_failure(item, e)
+            limiter.on_success()
+            return result
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="rate-limited") as executor:
+        return list(executor.map(run_item, items))
+
+
+class ThrottledError(Exception):
+    """スロットリングによりリクエストが拒否されたことを示す例外"""
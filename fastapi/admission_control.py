@@ -0,0 +1,210 @@
+# fastapi/admission_control.py
+import asyncio
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+# Bedrock・Lambdaのスロットリングとみなすエラーコード
+THROTTLING_ERROR_CODES = (
+    "ThrottlingException",
+    "TooManyRequestsException",
+    "ServiceQuotaExceededException",
+    "ServiceUnavailableException",
+)
+
+
+class AdmissionRejected(Exception):
+    """混雑のためリクエストを受け付けなかったことを表す例外（retry_after は再試行までの推奨秒数）"""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(f"リクエストを受け付けられませんでした: {reason}")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def is_throttling_error(error: BaseException) -> bool:
+    """例外（原因の例外を含む）がスロットリングによるものかを返す
+
+    langchain_aws はbotocoreのClientErrorをValueErrorに包むため、エラーコードとメッセージの両方を確認する。
+    """
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        response = getattr(error, "response", None)
+        code = response.get("Error", {}).get("Code") if isinstance(response, dict) else None
+        if code in THROTTLING_ERROR_CODES or any(name in str(error) for name in THROTTLING_ERROR_CODES):
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
+
+class AdmissionSlot:
+    """取得した実行枠を1回だけ返却するガード（ストリーミングのように取得と返却の場所が異なる場合に使用する）
+
+    release() が呼ばれないまま破棄された場合（クライアントの切断でレスポンス本文の送信が始まらなかった場合など）は、
+    破棄時に実行枠を返却する。
+    """
+
+    def __init__(self, controller: "AdmissionController", started_at: float):
+        self._controller = controller
+        self._started_at = started_at
+        self._loop = asyncio.get_running_loop()
+        self._released = False
+
+    def release(self, error: BaseException = None):
+        """実行枠を返却する（2回目以降の呼び出しは何もしない）"""
+        if self._released:
+            return
+        self._released = True
+        self._controller.release(self._started_at, error)
+
+    def __del__(self):
+        if self._released:
+            return
+        self._released = True
+        # 破棄はイベントループ外のスレッドで起きる可能性があるため、返却はイベントループ上で行う
+        try:
+            self._loop.call_soon_threadsafe(self._controller.release, self._started_at, None)
+        except RuntimeError:
+            # イベントループの終了後は返却先がないため何もしない
+            pass
+
+
+class AdmissionController:
+    """同時実行数と待機キューの長さを制限し、上限を超えたリクエストをすぐに拒否する
+
+    同時実行数の上限に達している場合は最大 max_queue 件までキューで待機させ、
+    queue_timeout_seconds 以内に順番が来なければ拒否する（Noneの場合は待機時間を制限しない）。
+    同時実行数の上限はAIMDで自動調整する（成功するたびに加算的に増やし、スロットリングを検知すると乗算的に減らす）。
+    イベントループ上のみで使用する（スレッドセーフではない）。
+    """
+
+    def __init__(self, max_concurrency: int = 8, min_concurrency: int = 1, max_queue: int = 32,
+                 queue_timeout_seconds: float = 10.0, increase_step: float = 0.1, decrease_factor: float = 0.5,
+                 cooldown_seconds: float = 5.0, max_retry_after: int = 30):
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout_seconds = queue_timeout_seconds
+        self.increase_step = increase_step
+        self.decrease_factor = decrease_factor
+        # 同じ時期のスロットリングで何度も上限を下げないための待機時間
+        self.cooldown_seconds = cooldown_seconds
+        self.max_retry_after = max_retry_after
+        self._limit = float(max_concurrency)
+        self._in_flight = 0
+        self._waiters = deque()
+        self._last_decrease = 0.0
+        # 1件あたりの処理時間の指数移動平均（Retry-Afterの見積もりに使用）
+        self._avg_service_seconds = None
+        self._counters = {
+            "admitted": 0, "queued": 0, "rejected_queue_full": 0, "rejected_timeout": 0, "throttles": 0, "errors": 0
+        }
+
+    @property
+    def limit(self) -> int:
+        """現在の同時実行数の上限"""
+        return max(self.min_concurrency, int(self._limit))
+
+    async def acquire(self) -> float:
+        """実行枠を取得する（取得できない場合は AdmissionRejected）。release() に渡す開始時刻を返す"""
+        if self._in_flight < self.limit and not self._waiters:
+            self._in_flight += 1
+            self._counters["admitted"] += 1
+            return time.monotonic()
+
+        if len(self._waiters) >= self.max_queue:
+            self._counters["rejected_queue_full"] += 1
+            raise AdmissionRejected("queue_full", self.retry_after())
+
+        self._counters["queued"] += 1
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            # 順番が来ると release() が実行枠を引き継いで waiter を完了させる
+            await asyncio.wait_for(waiter, self.queue_timeout_seconds)
+        except asyncio.TimeoutError:
+            self._remove_waiter(waiter)
+            self._counters["rejected_timeout"] += 1
+            raise AdmissionRejected("queue_timeout", self.retry_after()) from None
+        except asyncio.CancelledError:
+            # 実行枠を引き継いだ直後にキャンセルされた場合は枠を返却する
+            if waiter.done() and not waiter.cancelled():
+                self._in_flight -= 1
+                self._wake_waiters()
+            self._remove_waiter(waiter)
+            raise
+        self._counters["admitted"] += 1
+        return time.monotonic()
+
+    async def acquire_slot(self) -> AdmissionSlot:
+        """実行枠を取得し、返却用のガードを返す（取得できない場合は AdmissionRejected）"""
+        return AdmissionSlot(self, await self.acquire())
+
+    def release(self, started_at: float, error: BaseException = None):
+        """実行枠を返却し、処理結果に応じて同時実行数の上限を調整する"""
+        elapsed = time.monotonic() - started_at
+        self._avg_service_seconds = elapsed if self._avg_service_seconds is None else (
+            0.8 * self._avg_service_seconds + 0.2 * elapsed
+        )
+        if error is None:
+            self._limit = min(float(self.max_concurrency), self._limit + self.increase_step)
+        elif is_throttling_error(error):
+            self.record_throttle()
+        else:
+            self._counters["errors"] += 1
+        self._in_flight -= 1
+        self._wake_waiters()
+
+    def record_throttle(self):
+        """スロットリング検知時に同時実行数の上限を乗算的に減らす"""
+        self._counters["throttles"] += 1
+        now = time.monotonic()
+        if now - self._last_decrease < self.cooldown_seconds:
+            return
+        self._last_decrease = now
+        self._limit = max(float(self.min_concurrency), self._limit * self.decrease_factor)
+
+    @asynccontextmanager
+    async def admit(self):
+        """with文のブロックを実行枠内で実行する"""
+        started_at = await self.acquire()
+        error = None
+        try:
+            yield
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self.release(started_at, error)
+
+    def retry_after(self) -> int:
+        """待機中のリクエストが捌けるまでの見積もり時間（秒）を返す"""
+        service_seconds = self._avg_service_seconds or 1.0
+        estimate = service_seconds * (len(self._waiters) + 1) / self.limit
+        return max(1, min(self.max_retry_after, math.ceil(estimate)))
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self._in_flight,
+            "queued_now": len(self._waiters),
+            "avg_service_ms": (self._avg_service_seconds or 0.0) * 1000,
+            **self._counters,
+        }
+
+    def _wake_waiters(self):
+        """上限に空きがある間、待機中のリクエストに実行枠を引き継ぐ"""
+        while self._waiters and self._in_flight < self.limit:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self._in_flight += 1
+                waiter.set_result(None)
+
+    def _remove_waiter(self, waiter):
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
@@ -0,0 +1,135 @@
+# fastapi/answer_cache.py
+import time
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+# 正規化時に除去する記号（句読点・疑問符など）
+_STRIP_CHARS = "?!.,、。・「」『』()[]{}\"'"
+
+
+def normalize_query(query: str) -> str:
+    """キャッシュキー用に質問文を正規化する（全角半角・大文字小文字・空白・記号の揺れを吸収）"""
+    text = unicodedata.normalize("NFKC", query).lower()
+    return "".join(ch for ch in text if not ch.isspace() and ch not in _STRIP_CHARS)
+
+
+def has_conversation_context(messages_history) -> bool:
+    """会話履歴に過去のやり取りが含まれるかを判定する（含まれる場合は回答が履歴に依存する）"""
+    if not messages_history:
+        return False
+    return any(message.get("role") == "assistant" for message in messages_history)
+
+
+class AnswerCache:
+    """正規化した質問文をキーとする回答キャッシュ（TTL/LRU、埋め込み類似度による近似一致に対応）"""
+
+    def __init__(self, ttl_seconds: float = 3600, max_entries: int = 1000, similarity_threshold: float | None = None):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        # Noneの場合は完全一致のみを使用する
+        self.similarity_threshold = similarity_threshold
+        self.knowledge_base_version = None
+        # invalidate() のたびに増える世代（破棄前に開始したリクエストの回答を破棄後に保存しないために使用）
+        self.generation = 0
+        # key -> (保存時刻, 回答, 正規化済み埋め込みベクトル)
+        self._entries = OrderedDict()
+        self._counters = {"hits": 0, "semantic_hits": 0, "misses": 0, "evictions": 0, "invalidations": 0, "stale_puts": 0}
+
+    @property
+    def semantic_enabled(self) -> bool:
+        return self.similarity_threshold is not None
+
+    def contains(self, query: str) -> bool:
+        """正規化した質問文が有効期限内のエントリとして存在するかを返す"""
+        self._expire()
+        return normalize_query(query) in self._entries
+
+    def get(self, query: str, query_embedding=None):
+        """キャッシュから回答を取得する。見つからない場合はNoneを返す"""
+        self._expire()
+        key = normalize_query(query)
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            self._counters["hits"] += 1
+            return entry[1]
+
+        # 完全一致しない場合は埋め込みの類似度で近似一致を探す
+        if self.semantic_enabled and query_embedding is not None and self._entries:
+            best_key = self._find_similar(query_embedding)
+            if best_key is not None:
+                self._entries.move_to_end(best_key)
+                self._counters["semantic_hits"] += 1
+                return self._entries[best_key][1]
+
+        self._counters["misses"] += 1
+        return None
+
+    def put(self, query: str, value: dict, query_embedding=None, generation: int | None = None):
+        """回答をキャッシュに保存する
+
+        generation には参照時の世代を指定する。参照後にキャッシュが破棄されていた場合、
+        破棄前の情報で生成した回答のため保存しない。
+        """
+        if generation is not None and generation != self.generation:
+            self._counters["stale_puts"] += 1
+            return
+        key = normalize_query(query)
+        vector = _normalize_vector(query_embedding) if query_embedding is not None else None
+        self._entries[key] = (time.monotonic(), value, vector)
+        self._entries.move_to_end(key)
+
+        # 上限を超えた場合は最も古く使われたエントリを削除
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._counters["evictions"] += 1
+
+    def invalidate(self, knowledge_base_version=None):
+        """キャッシュを全て破棄する（ナレッジベース再同期時に呼び出す）"""
+        self._entries.clear()
+        self.knowledge_base_version = knowledge_base_version
+        self.generation += 1
+        self._counters["invalidations"] += 1
+
+    def stats(self) -> dict:
+        """ヒット・ミスなどの統計情報を返す"""
+        lookups = self._counters["hits"] + self._counters["semantic_hits"] + self._counters["misses"]
+        hits = self._counters["hits"] + self._counters["semantic_hits"]
+        return {
+            **self._counters,
+            "entries": len(self._entries),
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "knowledge_base_version": self.knowledge_base_version,
+            "generation": self.generation,
+        }
+
+    def _expire(self):
+        """TTLを過ぎたエントリを削除する"""
+        now = time.monotonic()
+        expired = [key for key, (stored_at, _, _) in self._entries.items() if now - stored_at > self.ttl_seconds]
+        for key in expired:
+            del self._entries[key]
+
+    def _find_similar(self, query_embedding):
+        """コサイン類似度が閾値以上で最も近いエントリのキーを返す"""
+        candidates = [(key, vector) for key, (_, _, vector) in self._entries.items() if vector is not None]
+        if not candidates:
+            return None
+
+        keys = [key for key, _ in candidates]
+        matrix = np.stack([vector for _, vector in candidates])
+        scores = matrix @ _normalize_vector(query_embedding)
+        best_index = int(np.argmax(scores))
+        if scores[best_index] >= self.similarity_threshold:
+            return keys[best_index]
+        return None
+
+
+def _normalize_vector(vector) -> np.ndarray:
+    """L2ノルムで正規化したfloat32ベクトルを返す"""
+    array = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(array)
+    return array / norm if norm > 0 else array
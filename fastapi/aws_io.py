@@ -0,0 +1,51 @@
+# fastapi/aws_io.py
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from request_metrics import io_pool_wait
+
+
+class IOExecutor(ThreadPoolExecutor):
+    """ブロッキングするAWS呼び出し用の名前付きスレッドプール
+
+    タスクの投入から実行開始までの待機時間をプール名ごとに計測する（/metrics の aws_io_pool_wait_seconds）。
+    既定のスレッドプール（run_in_executor(None, ...)）と分けることで、他の処理と待ち行列を共有しない。
+    """
+
+    def __init__(self, max_workers: int, name: str):
+        super().__init__(max_workers=max_workers, thread_name_prefix=name)
+        self.name = name
+        self.max_workers = max_workers
+
+    def submit(self, fn, /, *args, **kwargs):
+        submitted_at = time.perf_counter()
+
+        def run():
+            io_pool_wait.observe(time.perf_counter() - submitted_at, pool=self.name)
+            return fn(*args, **kwargs)
+
+        return super().submit(run)
+
+    def stats(self) -> dict:
+        """プールのサイズと、実行待ちのタスク数を返す"""
+        return {"name": self.name, "max_workers": self.max_workers, "queued": self._work_queue.qsize()}
+
+
+def aws_client_config(max_pool_connections: int, connect_timeout: float = 60, read_timeout: float = 60,
+                      max_attempts: int = None):
+    """接続プールのサイズとキープアライブを明示したboto3クライアントの設定を返す
+
+    botocoreの既定の接続プールは10接続のため、同時に呼び出すスレッド数以上の接続数を指定する
+    （不足すると接続が使い捨てになり、呼び出しのたびにTLSハンドシェイクが発生する）。
+    max_attempts を指定した場合は、タイムアウトを含む再試行を合わせてその回数までに制限する（未指定の場合はbotocoreの既定）。
+    botocoreの読み込みに時間がかかるため、初回の呼び出し時に読み込む。
+    """
+    from botocore.config import Config
+
+    return Config(
+        max_pool_connections=max_pool_connections,
+        tcp_keepalive=True,
+        connect_timeout=connect_timeout,
+        read_timeout=read_timeout,
+        retries={"total_max_attempts": max_attempts, "mode": "standard"} if max_attempts else None
+    )
@@ -0,0 +1,109 @@
+# fastapi/build_faq_index.py
+"""クエリログの頻出質問からFAQインデックスを作成するオフラインジョブ
+
+クエリログ（QUERY_LOG_PATH）から頻出する質問を抽出し、既存のRAGパイプライン（ナレッジ検索 → プロンプト作成 → LLM）で
+回答と根拠ドキュメントを事前に生成してFAQインデックスに保存する。
+/chat は信頼度の高い一致があればナレッジ検索と回答生成を行わずにインデックスから回答する。
+
+--if-changed を指定すると、ドキュメントと対象の質問が前回の作成時から変わっていない場合は再作成しない。
+ドキュメントの同期後に実行し、POST /faq/reload でサーバーに読み込ませる。
+
+実行例:
+    python build_faq_index.py --query-log ../query_log.jsonl --output ../faq_index.json --if-changed
+"""
+import argparse
+import asyncio
+import json
+import os
+from pathlib import Path
+
+from answer_cache import normalize_query
+from faq_index import FAQIndex, documents_fingerprint, mine_frequent_questions
+from model_router import is_declined
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+
+
+def load_seed_questions(path: str) -> list[str]:
+    """評価データなどの代表的な質問を読み込む"""
+    if not path or not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        return [item["question"] for item in json.load(f)]
+
+
+def is_unchanged(output_path: str, fingerprint: str, questions: list[dict]) -> bool:
+    """既存のFAQインデックスがドキュメント・対象の質問ともに最新かを返す"""
+    if not os.path.exists(output_path):
+        return False
+    try:
+        existing = FAQIndex.load(output_path)
+    except (ValueError, KeyError, json.JSONDecodeError):
+        return False
+    existing_keys = set(existing.metadata.get("questions", []))
+    return existing.metadata.get("documents_fingerprint") == fingerprint and existing_keys == {
+        normalize_query(item["question"]) for item in questions
+    }
+
+
+async def precompute_answers(questions: list[dict], parallelism: int) -> list[dict]:
+    """既存のRAGパイプラインで各質問の回答と根拠ドキュメントを生成する"""
+    # fastapi_app の読み込みとAWSクライアントの作成は、回答生成が必要になってから行う
+    import fastapi_app
+
+    fastapi_app.initialize_clients()
+    semaphore = asyncio.Semaphore(parallelism)
+
+    async def precompute(item):
+        async with semaphore:
+            try:
+                result = await fastapi_app.generate_answer(item["question"])
+            except Exception as e:
+                print(f"✗ 回答生成に失敗しました: {item['question']} ({e})")
+                return None
+        # 根拠ドキュメントのない回答は事前生成の対象外
+        if not result["related_documents"] or is_declined(result["response"]):
+            print(f"- 根拠が見つからないため除外: {item['question']}")
+            return None
+        print(f"✓ {item['question']}（{item['count']}件）")
+        return {
+            "question": item["question"],
+            "normalized": normalize_query(item["question"]),
+            "count": item["count"],
+            "response": result["response"],
+            "related_documents": result["related_documents"],
+        }
+
+    results = await asyncio.gather(*(precompute(item) for item in questions))
+    return [entry for entry in results if entry is not None]
+
+
+def main(args) -> int:
+    fingerprint = documents_fingerprint(args.documents_dir)
+    questions = mine_frequent_questions(
+        args.query_log, args.min_count, args.max_questions, load_seed_questions(args.seed_questions)
+    )
+    print(f"対象の質問数: {len(questions)}")
+
+    if args.if_changed and is_unchanged(args.output, fingerprint, questions):
+        print("ドキュメントと対象の質問に変更がないため、FAQインデックスを再作成しません")
+        return 0
+
+    entries = asyncio.run(precompute_answers(questions, args.parallelism))
+    FAQIndex.write(args.output, entries, fingerprint, questions=[normalize_query(item["question"]) for item in questions])
+    print(f"FAQインデックスを作成しました: {args.output}（{len(entries)}件）")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="クエリログの頻出質問からFAQインデックスを作成する")
+    parser.add_argument("--query-log", default=os.environ.get("QUERY_LOG_PATH", str(ROOT_DIR / "query_log.jsonl")))
+    parser.add_argument("--seed-questions", default=str(ROOT_DIR / "evaluations" / "data" / "langsmith_test_questions.json"),
+                        help="件数に関わらず含める質問のJSONファイル")
+    parser.add_argument("--documents-dir", default=str(ROOT_DIR / "documents"))
+    parser.add_argument("--output", default=os.environ.get("FAQ_INDEX_PATH", str(ROOT_DIR / "faq_index.json")))
+    parser.add_argument("--min-count", type=int, default=3, help="FAQとみなす最小の質問回数")
+    parser.add_argument("--max-questions", type=int, default=100, help="FAQインデックスに含める最大の質問数")
+    parser.add_argument("--parallelism", type=int, default=4, help="回答生成の並列数")
+    parser.add_argument("--if-changed", action="store_true", help="ドキュメントと対象の質問に変更がない場合は再作成しない")
+    raise SystemExit(main(parser.parse_args()))
@@ -0,0 +1,116 @@
+# fastapi/context_packing.py
+import re
+
+# 文の区切り（句点・感嘆符・疑問符・改行）。区切り文字と直後の改行は文に含める
+_SENTENCE_PATTERN = re.compile(r"[^。！？!?\n]+(?:[。！？!?]+\n?|\n|$)")
+# ひらがなのみのバイグラム（助詞・語尾など）は関連度の判定に使わない
+_HIRAGANA_ONLY_PATTERN = re.compile(r"^[ぁ-ゟ]+$")
+
+
+class ContextPacker:
+    """検索結果のチャンクをプロンプト用に整理する
+
+    1. ほぼ同一のチャンクを除外（文字3-gramのJaccard係数）
+    2. 同じドキュメントでオーバーラップしている隣接チャンクを結合
+    3. 各チャンクを質問に関連する文（とその前後の文）に絞り込む
+    """
+
+    def __init__(self, duplicate_threshold: float = 0.8, min_overlap_chars: int = 10, trim_min_chars: int = 120, sentence_window: int = 1):
+        self.duplicate_threshold = duplicate_threshold
+        # 隣接チャンクとみなす最小のオーバーラップ文字数
+        self.min_overlap_chars = min_overlap_chars
+        # これより短いチャンクは絞り込まない
+        self.trim_min_chars = trim_min_chars
+        # 関連する文の前後に残す文の数
+        self.sentence_window = sentence_window
+
+    def pack(self, query: str, documents: list[dict]) -> list[str]:
+        """検索順位を保ったまま整理したコンテキストのリストを返す"""
+        chunks = [
+            {"title": doc.get("metadata", {}).get("title", ""), "content": doc.get("content", "").strip()}
+            for doc in documents
+        ]
+        chunks = [chunk for chunk in chunks if chunk["content"]]
+        chunks = self._remove_near_duplicates(chunks)
+        chunks = self._merge_adjacent(chunks)
+
+        query_bigrams = _content_bigrams(query)
+        return [self._trim(chunk["content"], query_bigrams) for chunk in chunks]
+
+    def _remove_near_duplicates(self, chunks: list[dict]) -> list[dict]:
+        """上位のチャンクとほぼ同一のチャンクを除外する"""
+        kept = []
+        kept_shingles = []
+        for chunk in chunks:
+            shingles = _shingles(chunk["content"])
+            if any(_jaccard(shingles, other) >= self.duplicate_threshold for other in kept_shingles):
+                continue
+            kept.append(chunk)
+            kept_shingles.append(shingles)
+        return kept
+
+    def _merge_adjacent(self, chunks: list[dict]) -> list[dict]:
+        """同じドキュメントで末尾と先頭が重なるチャンクを1つに結合する（上位のチャンクの位置に残す）"""
+        merged = [dict(chunk) for chunk in chunks]
+        changed = True
+        while changed:
+            changed = False
+            for i in range(len(merged)):
+                for j in range(len(merged)):
+                    if i == j or merged[i]["title"] != merged[j]["title"]:
+                        continue
+                    overlap = _overlap_length(merged[i]["content"], merged[j]["content"], self.min_overlap_chars)
+                    if overlap:
+                        # i の末尾と j の先頭が重なる場合、i + j を上位側の位置に残す
+                        combined = merged[i]["content"] + merged[j]["content"][overlap:]
+                        keep, drop = (i, j) if i < j else (j, i)
+                        merged[keep] = {"title": merged[i]["title"], "content": combined}
+                        del merged[drop]
+                        changed = True
+                        break
+                if changed:
+                    break
+        return merged
+
+    def _trim(self, content: str, query_bigrams: set) -> str:
+        """質問と関連する文とその前後の文のみを残す（関連する文がない場合はそのまま返す）"""
+        if len(content) < self.trim_min_chars or not query_bigrams:
+            return content
+
+        sentences = [sentence for sentence in _SENTENCE_PATTERN.findall(content) if sentence.strip()]
+        relevant = [i for i, sentence in enumerate(sentences) if _content_bigrams(sentence) & query_bigrams]
+        if not relevant:
+            return content
+
+        keep = set()
+        for i in relevant:
+            keep.update(range(max(0, i - self.sentence_window), min(len(sentences), i + self.sentence_window + 1)))
+
+        return "".join(sentences[i] for i in sorted(keep)).strip()
+
+
+def _shingles(text: str, size: int = 3) -> set:
+    compact = "".join(text.split())
+    return {compact[i:i + size] for i in range(max(1, len(compact) - size + 1))}
+
+
+def _jaccard(a: set, b: set) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def _content_bigrams(text: str) -> set:
+    """ひらがなのみのバイグラムを除いた文字バイグラムの集合を返す"""
+    compact = "".join(text.split())
+    bigrams = {compact[i:i + 2] for i in range(len(compact) - 1)}
+    return {bigram for bigram in bigrams if not _HIRAGANA_ONLY_PATTERN.match(bigram) and bigram.strip("？?。、！!")}
+
+
+def _overlap_length(left: str, right: str, min_overlap: int) -> int:
+    """left の末尾と right の先頭が一致する最長の文字数を返す（min_overlap未満の場合は0）"""
+    max_overlap = min(len(left), len(right)) - 1
+    for length in range(max_overlap, min_overlap - 1, -1):
+        if left.endswith(right[:length]):
+            return length
+    return 0
@@ -0,0 +1,186 @@
+# fastapi/conversation_store.py
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# メッセージ1件あたりの管理用オーバーヘッドの概算（バイト）
+_MESSAGE_OVERHEAD_BYTES = 64
+
+
+class InMemoryConversationStore:
+    """session_idをキーとしてメモリ上に会話履歴を保持するストア
+
+    一定時間アクセスのないセッションと、メモリ上限を超えた場合の最も古く使われたセッションを削除する。
+    """
+
+    # メモリ上の操作のみのため、イベントループ上で直接呼び出す
+    blocking_io = False
+
+    def __init__(self, idle_timeout_seconds: float = 1800, max_bytes: int = 64 * 1024 * 1024, max_messages: int = 60):
+        self.idle_timeout_seconds = idle_timeout_seconds
+        self.max_bytes = max_bytes
+        self.max_messages = max_messages
+        # session_id -> {"messages": [...], "last_access": 時刻, "bytes": サイズ}（最終アクセス順）
+        self._sessions = OrderedDict()
+        self._total_bytes = 0
+        self._evicted_sessions = 0
+
+    def get_history(self, session_id: str) -> list[dict]:
+        """セッションの会話履歴を返す（存在しない場合は空のリスト）"""
+        self._evict_idle()
+        session = self._sessions.get(session_id)
+        if session is None:
+            return []
+        self._touch(session_id, session)
+        return list(session["messages"])
+
+    def append(self, session_id: str, messages: list[dict]):
+        """セッションの会話履歴にメッセージを追加する"""
+        self._evict_idle()
+        session = self._sessions.setdefault(session_id, {"messages": [], "last_access": 0.0, "bytes": 0})
+        for message in messages:
+            session["messages"].append({"role": message["role"], "content": message["content"]})
+
+        # 1セッションあたりの保持件数を超えた古いメッセージは削除
+        if len(session["messages"]) > self.max_messages:
+            del session["messages"][:-self.max_messages]
+
+        self._total_bytes -= session["bytes"]
+        session["bytes"] = sum(_message_bytes(message) for message in session["messages"])
+        self._total_bytes += session["bytes"]
+        self._touch(session_id, session)
+
+        # メモリ上限を超えた場合は最も古く使われたセッションから削除（現在のセッションは残す）
+        while self._total_bytes > self.max_bytes and len(self._sessions) > 1:
+            self._pop_oldest()
+
+    def delete(self, session_id: str):
+        """セッションの会話履歴を削除する"""
+        session = self._sessions.pop(session_id, None)
+        if session is not None:
+            self._total_bytes -= session["bytes"]
+
+    def stats(self) -> dict:
+        """セッション数・使用メモリなどの統計情報を返す"""
+        self._evict_idle()
+        return {
+            "backend": "memory",
+            "sessions": len(self._sessions),
+            "bytes": self._total_bytes,
+            "max_bytes": self.max_bytes,
+            "evicted_sessions": self._evicted_sessions,
+        }
+
+    def _touch(self, session_id: str, session: dict):
+        session["last_access"] = time.monotonic()
+        self._sessions.move_to_end(session_id)
+
+    def _evict_idle(self):
+        """最終アクセスから一定時間経過したセッションを削除する（最終アクセス順のため先頭から確認）"""
+        deadline = time.monotonic() - self.idle_timeout_seconds
+        while self._sessions:
+            oldest = next(iter(self._sessions.values()))
+            if oldest["last_access"] >= deadline:
+                break
+            self._pop_oldest()
+
+    def _pop_oldest(self):
+        _, session = self._sessions.popitem(last=False)
+        self._total_bytes -= session["bytes"]
+        self._evicted_sessions += 1
+
+
+class SQLiteConversationStore:
+    """session_idをキーとしてSQLiteに会話履歴を保持するストア（プロセス再起動後も履歴を維持）"""
+
+    # ディスクへの読み書きでブロックするため、イベントループ外（スレッドプール）で呼び出す
+    blocking_io = True
+
+    def __init__(self, db_path: str, idle_timeout_seconds: float = 1800, max_messages: int = 60):
+        self.db_path = db_path
+        self.idle_timeout_seconds = idle_timeout_seconds
+        self.max_messages = max_messages
+        self._evicted_sessions = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(db_path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS sessions (session_id TEXT PRIMARY KEY, last_access REAL NOT NULL)"
+            )
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS messages ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT NOT NULL, role TEXT NOT NULL, content TEXT NOT NULL)"
+            )
+            self._connection.execute("CREATE INDEX IF NOT EXISTS idx_messages_session ON messages (session_id, id)")
+
+    def get_history(self, session_id: str) -> list[dict]:
+        """セッションの会話履歴を返す（存在しない場合は空のリスト）"""
+        with self._lock, self._connection:
+            self._evict_idle()
+            rows = self._connection.execute(
+                "SELECT role, content FROM messages WHERE session_id = ? ORDER BY id", (session_id,)
+            ).fetchall()
+            if rows:
+                self._touch(session_id)
+        return [{"role": role, "content": content} for role, content in rows]
+
+    def append(self, session_id: str, messages: list[dict]):
+        """セッションの会話履歴にメッセージを追加する"""
+        with self._lock, self._connection:
+            self._evict_idle()
+            self._connection.executemany(
+                "INSERT INTO messages (session_id, role, content) VALUES (?, ?, ?)",
+                [(session_id, message["role"], message["content"]) for message in messages]
+            )
+            # 1セッションあたりの保持件数を超えた古いメッセージは削除
+            self._connection.execute(
+                "DELETE FROM messages WHERE session_id = ? AND id NOT IN "
+                "(SELECT id FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT ?)",
+                (session_id, session_id, self.max_messages)
+            )
+            self._touch(session_id)
+
+    def delete(self, session_id: str):
+        """セッションの会話履歴を削除する"""
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            self._connection.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    def stats(self) -> dict:
+        """セッション数などの統計情報を返す"""
+        with self._lock, self._connection:
+            self._evict_idle()
+            sessions = self._connection.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+            messages = self._connection.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+        return {
+            "backend": "sqlite",
+            "sessions": sessions,
+            "messages": messages,
+            "evicted_sessions": self._evicted_sessions,
+        }
+
+    def _touch(self, session_id: str):
+        self._connection.execute(
+            "INSERT INTO sessions (session_id, last_access) VALUES (?, ?) "
+            "ON CONFLICT(session_id) DO UPDATE SET last_access = excluded.last_access",
+            (session_id, time.time())
+        )
+
+    def _evict_idle(self):
+        """最終アクセスから一定時間経過したセッションを削除する"""
+        deadline = time.time() - self.idle_timeout_seconds
+        idle_sessions = [
+            row[0] for row in self._connection.execute("SELECT session_id FROM sessions WHERE last_access < ?", (deadline,))
+        ]
+        if not idle_sessions:
+            return
+        self._connection.executemany("DELETE FROM messages WHERE session_id = ?", [(s,) for s in idle_sessions])
+        self._connection.executemany("DELETE FROM sessions WHERE session_id = ?", [(s,) for s in idle_sessions])
+        self._evicted_sessions += len(idle_sessions)
+
+
+def _message_bytes(message: dict) -> int:
+    """メッセージの使用メモリの概算（バイト）"""
+    return len(message["content"].encode("utf-8")) + _MESSAGE_OVERHEAD_BYTES
@@ -0,0 +1,162 @@
+# fastapi/faq_index.py
+import difflib
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+
+from answer_cache import normalize_query
+from local_vector_index import EMBEDDING_NAME, hashing_embedding
+
+FAQ_INDEX_VERSION = 1
+
+
+def documents_fingerprint(documents_dir: str) -> str:
+    """ドキュメントディレクトリ内のPDFの内容から指紋を作成する（ドキュメントの変更検知用）"""
+    digest = hashlib.sha256()
+    for pdf_path in sorted(Path(documents_dir).glob("*.pdf")):
+        digest.update(pdf_path.name.encode("utf-8"))
+        with open(pdf_path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+class QueryLog:
+    """会話履歴に依存しない質問をJSONLに追記する（FAQインデックス作成時の頻出質問の抽出に使用）"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def append(self, message: str):
+        line = json.dumps({"timestamp": time.time(), "message": message}, ensure_ascii=False)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+
+def mine_frequent_questions(query_log_path: str, min_count: int = 3, max_questions: int = 100, seed_questions: list[str] = None) -> list[dict]:
+    """クエリログから頻出する質問を抽出する
+
+    正規化した質問文ごとに件数を数え、件数の多い順に {"question", "count"} のリストを返す。
+    代表の質問文には最も多く使われた表記を使用する。seed_questions は件数に関わらず含める。
+    """
+    counts = Counter()
+    spellings = {}
+    if query_log_path and os.path.exists(query_log_path):
+        with open(query_log_path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                message = json.loads(line).get("message", "")
+                key = normalize_query(message)
+                if key:
+                    counts[key] += 1
+                    spellings.setdefault(key, Counter())[message.strip()] += 1
+
+    questions = {}
+    for question in seed_questions or []:
+        questions[normalize_query(question)] = {"question": question, "count": counts.get(normalize_query(question), 0)}
+    for key, count in counts.most_common():
+        if count < min_count or len(questions) >= max_questions:
+            break
+        if key not in questions:
+            questions[key] = {"question": spellings[key].most_common(1)[0][0], "count": count}
+
+    return sorted(questions.values(), key=lambda item: -item["count"])[:max_questions]
+
+
+def differs_only_in_function_words(a: str, b: str) -> bool:
+    """2つの正規化済みの質問文の違いがひらがな（助詞・語尾など）のみかを返す
+
+    文字n-gramの類似度は「給与」と「賞与」、「本社」と「支社」のような内容語の1文字の違いでも高くなるため、
+    漢字・カタカナ・英数字が異なる場合は別の質問とみなす。
+    """
+    for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, a, b, autojunk=False).get_opcodes():
+        if tag != "equal" and not all("\u3041" <= ch <= "\u309f" for ch in a[i1:i2] + b[j1:j2]):
+            return False
+    return True
+
+
+class FAQIndex:
+    """事前に生成したFAQの回答を、正規化した質問文の完全一致で引くインデックス
+
+    similarity_threshold を指定した場合は、文字n-gramの類似度が閾値以上で、違いがひらがなのみの質問にも一致させる。
+    """
+
+    def __init__(self, entries: list[dict], similarity_threshold: float | None = None, metadata: dict = None):
+        self.entries = entries
+        self.similarity_threshold = similarity_threshold
+        self.metadata = metadata or {}
+        self._by_key = {entry["normalized"]: i for i, entry in enumerate(entries)}
+        self._embeddings = hashing_embedding([entry["normalized"] for entry in entries])
+        self._counters = {"hits": 0, "similar_hits": 0, "misses": 0}
+
+    def __len__(self):
+        return len(self.entries)
+
+    @classmethod
+    def load(cls, path: str, similarity_threshold: float | None = None):
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") != FAQ_INDEX_VERSION or data.get("embedding") != EMBEDDING_NAME:
+            raise ValueError(f"FAQインデックスの形式が一致しません: {path}")
+        metadata = {key: value for key, value in data.items() if key != "entries"}
+        return cls(data["entries"], similarity_threshold, metadata)
+
+    @staticmethod
+    def write(path: str, entries: list[dict], documents_fingerprint: str, questions: list[str] = None):
+        """FAQインデックスを書き込む（一時ファイルに書き込んでから置き換える）
+
+        questions には作成時の対象の質問（正規化済み）を記録し、次回の作成時に変更の有無を判定する。
+        """
+        data = {
+            "version": FAQ_INDEX_VERSION,
+            "embedding": EMBEDDING_NAME,
+            "documents_fingerprint": documents_fingerprint,
+            "built_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "questions": questions or [entry["normalized"] for entry in entries],
+            "entries": entries,
+        }
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+
+    def lookup(self, query: str):
+        """一致するFAQの {"response", "related_documents"} を返す（信頼度の高い一致がない場合はNone）"""
+        key = normalize_query(query)
+        index = self._by_key.get(key)
+        if index is not None:
+            self._counters["hits"] += 1
+            return self._answer(index)
+
+        if self.similarity_threshold is not None and len(self.entries) and key:
+            scores = self._embeddings @ hashing_embedding([key])[0]
+            best = int(np.argmax(scores))
+            if scores[best] >= self.similarity_threshold and differs_only_in_function_words(
+                key, self.entries[best]["normalized"]
+            ):
+                self._counters["similar_hits"] += 1
+                return self._answer(best)
+
+        self._counters["misses"] += 1
+        return None
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self.entries),
+            "built_at": self.metadata.get("built_at"),
+            "documents_fingerprint": self.metadata.get("documents_fingerprint"),
+            **self._counters,
+        }
+
+    def _answer(self, index: int) -> dict:
+        entry = self.entries[index]
+        return {"response": entry["response"], "related_documents": entry["related_documents"]}
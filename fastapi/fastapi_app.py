@@ -1,14 +1,33 @@
 # fastapi/fastapi_app.py
+import time
+
+# モジュールの読み込み開始時刻（起動時間の内訳の計測用）
+_import_started_at = time.perf_counter()
+
 from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 import json
-import boto3
 import asyncio
-from langchain_aws import ChatBedrock
-from langchain_core.messages import HumanMessage
+from contextlib import asynccontextmanager, nullcontext
 import logging
 import os
+import uuid
 from dotenv import load_dotenv
+from starlette.routing import Match
+from admission_control import AdmissionController, AdmissionRejected, is_throttling_error
+from aws_io import IOExecutor, aws_client_config
+from answer_cache import AnswerCache, has_conversation_context, normalize_query
+from prompt_builder import PromptBuilder, estimate_tokens
+from context_packing import ContextPacker
+from conversation_store import InMemoryConversationStore, SQLiteConversationStore
+from faq_index import FAQIndex, QueryLog, documents_fingerprint
+from model_router import ModelRouter, is_declined, may_become_declined
+from retrieval_backends import (
+    BedrockKnowledgeBaseBackend, InMemoryRetrievalBackend, LambdaRetrievalBackend, LocalIndexRetrievalBackend, select_documents
+)
+from resilient_retrieval import CircuitBreaker, ResilientRetrievalBackend
+from request_metrics import current_timer, render_metrics, request_duration, stage, start_request_timer
+from single_flight import SingleFlight
 
 # .envファイルから環境変数を読み込む
 load_dotenv()
@@ -17,21 +36,379 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """起動時にAWSクライアントを作成してFAQインデックスの読み込みとウォームアップを開始し、終了時にスレッドプールを停止する
+
+    FAQインデックスの読み込みとウォームアップはバックグラウンドで実行し、両方が完了するまで /ready は503を返す。
+    """
+    init_started_at = time.perf_counter()
+    initialize_clients()
+    startup_status["timings_ms"]["initialize"] = round((time.perf_counter() - init_started_at) * 1000, 1)
+    startup_task = asyncio.create_task(prepare())
+    try:
+        yield
+    finally:
+        if not startup_task.done():
+            startup_task.cancel()
+        io_executor.shutdown(wait=False, cancel_futures=True)
+        llm_executor.shutdown(wait=False, cancel_futures=True)
+
+
+app = FastAPI(lifespan=lifespan)
 
 # 環境変数の初期化
 AWS_REGION = os.environ.get("AWS_REGION")
 BEDROCK_KB_SEARCH_LAMBDA_FUNCTION_NAME = os.environ.get("BEDROCK_KB_SEARCH_LAMBDA_FUNCTION_NAME")
+BEDROCK_KB_ID = os.environ.get("BEDROCK_KB_ID")
+# ナレッジ検索バックエンド: lambda（検索Lambda経由）/ bedrock（Knowledge Base直接）/ memory（ローカル）
+#                         / local_index（ローカルベクトルインデックス）
+RETRIEVAL_BACKEND = os.environ.get("RETRIEVAL_BACKEND", "lambda")
+LOCAL_RETRIEVAL_DOCUMENTS_PATH = os.environ.get("LOCAL_RETRIEVAL_DOCUMENTS_PATH")
+LOCAL_INDEX_DIR = os.environ.get("LOCAL_INDEX_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "local_index"))
+# 関連度スコアによる検索結果の絞り込み
+# 最大 RETRIEVAL_MAX_RESULTS 件を検索し、スコアが RETRIEVAL_SCORE_THRESHOLD 未満、または
+# 最上位のスコア × RETRIEVAL_RELATIVE_SCORE_CUTOFF 未満のチャンクはLLMに渡さない（上位 RETRIEVAL_MIN_RESULTS 件は常に残す）
+RETRIEVAL_MAX_RESULTS = int(os.environ.get("RETRIEVAL_MAX_RESULTS", "5"))
+RETRIEVAL_SCORE_THRESHOLD = float(os.environ.get("RETRIEVAL_SCORE_THRESHOLD", "0"))
+RETRIEVAL_RELATIVE_SCORE_CUTOFF = float(os.environ.get("RETRIEVAL_RELATIVE_SCORE_CUTOFF", "0"))
+RETRIEVAL_MIN_RESULTS = int(os.environ.get("RETRIEVAL_MIN_RESULTS", "1"))
+# ナレッジ検索の期限・ヘッジ・サーキットブレーカーの設定
+# 検索が期限内に完了しない・失敗が続く場合は、同じ質問の前回の検索結果（なければ関連ドキュメントなし）で回答する
+RETRIEVAL_DEADLINE_SECONDS = float(os.environ.get("RETRIEVAL_DEADLINE_SECONDS", "5"))
+RETRIEVAL_HEDGING_ENABLED = os.environ.get("RETRIEVAL_HEDGING_ENABLED", "true").lower() == "true"
+RETRIEVAL_HEDGE_MIN_SAMPLES = int(os.environ.get("RETRIEVAL_HEDGE_MIN_SAMPLES", "20"))
+RETRIEVAL_BREAKER_FAILURE_THRESHOLD = int(os.environ.get("RETRIEVAL_BREAKER_FAILURE_THRESHOLD", "5"))
+RETRIEVAL_BREAKER_RESET_SECONDS = float(os.environ.get("RETRIEVAL_BREAKER_RESET_SECONDS", "30"))
+# 同時に実行するヘッジの上限（停止した検索へのヘッジでAWS呼び出し用スレッドプールを使い切らないため）
+RETRIEVAL_MAX_HEDGES_IN_FLIGHT = int(os.environ.get("RETRIEVAL_MAX_HEDGES_IN_FLIGHT", "4"))
+# 検索のAWS呼び出し（Lambda・Knowledge Base）の接続・応答の待ち時間（秒）
+# 期限切れ・ヘッジで使用しなくなった呼び出しもスレッドを占有し続けるため、検索の期限に近い値とし、タイムアウト時は再試行しない
+RETRIEVAL_AWS_TIMEOUT_SECONDS = float(os.environ.get("RETRIEVAL_AWS_TIMEOUT_SECONDS", str(RETRIEVAL_DEADLINE_SECONDS + 1)))
+
+# AWS呼び出し用スレッドプールと接続プールの設定
+# ブロッキングするAWS呼び出し（Lambda・Knowledge Base・埋め込み）は既定のスレッドプールではなく専用のプールで実行する
+# 各クライアントの接続プールはスレッド数以上にして、接続の使い捨て（毎回のTLSハンドシェイク）を防ぐ
+AWS_IO_MAX_WORKERS = int(os.environ.get("AWS_IO_MAX_WORKERS", "32"))
+AWS_MAX_POOL_CONNECTIONS = int(os.environ.get("AWS_MAX_POOL_CONNECTIONS", str(AWS_IO_MAX_WORKERS)))
+io_executor = IOExecutor(max_workers=AWS_IO_MAX_WORKERS, name="aws-io")
+
+# AWSクライアント・LLM・ナレッジ検索バックエンド（initialize_clients() で作成する）
+# boto3・langchain_aws の読み込みとクライアントの作成は時間がかかるため、import時ではなく起動時（lifespan）に行う
+aws_config = None
+retrieval_aws_config = None
+lambda_client = None
+bedrock_llm = None
+bedrock_fast_llm = None
+cache_embeddings = None
+retrieval_backend = None
+
+# モデルルーティングの設定
+# BEDROCK_FAST_ID を設定した場合、単純な質問は小さく高速なモデル（fast）、それ以外は BEDROCK_ID のモデル（strong）で回答する
+BEDROCK_FAST_ID = os.environ.get("BEDROCK_FAST_ID")
+model_router = ModelRouter(
+    max_query_chars=int(os.environ.get("MODEL_ROUTING_MAX_QUERY_CHARS", "40")),
+    min_top_score=float(os.environ.get("MODEL_ROUTING_MIN_TOP_SCORE", "0.6")),
+    max_documents=int(os.environ.get("MODEL_ROUTING_MAX_DOCUMENTS", "2")),
+    max_history_messages=int(os.environ.get("MODEL_ROUTING_MAX_HISTORY_MESSAGES", "0"))
+)
+
+
+# 起動時のウォームアップの設定
+# Lambda・Bedrockへの接続を事前に確立し、最初のリクエストで接続の確立を待たないようにする
+# WARMUP_LLM_ENABLED=true の場合は短いプロンプトでLLMも呼び出す（わずかなトークンを消費する）
+WARMUP_ENABLED = os.environ.get("WARMUP_ENABLED", "true").lower() == "true"
+WARMUP_LLM_ENABLED = os.environ.get("WARMUP_LLM_ENABLED", "true").lower() == "true"
+WARMUP_TIMEOUT_SECONDS = float(os.environ.get("WARMUP_TIMEOUT_SECONDS", "30"))
+WARMUP_PROMPT = "「OK」とだけ返答してください。"
+# 起動の状態（/ready で返す）
+startup_status = {"ready": False, "timings_ms": {}, "warmup": {}}
+
+
+def initialize_clients():
+    """AWSクライアント・LLM・ナレッジ検索バックエンドを作成する
+
+    作成済み（テスト・ベンチマークで差し替えたものを含む）は作り直さない。
+    lifespanを経由しない場合（TestClientやオフラインジョブ）は最初のリクエスト・呼び出し時に実行される。
+    """
+    global aws_config, retrieval_aws_config, lambda_client, bedrock_llm, bedrock_fast_llm, cache_embeddings, retrieval_backend
+    if aws_config is None:
+        aws_config = aws_client_config(AWS_MAX_POOL_CONNECTIONS)
+    if retrieval_aws_config is None:
+        retrieval_aws_config = aws_client_config(
+            AWS_MAX_POOL_CONNECTIONS,
+            connect_timeout=RETRIEVAL_AWS_TIMEOUT_SECONDS,
+            read_timeout=RETRIEVAL_AWS_TIMEOUT_SECONDS,
+            max_attempts=1
+        )
+
+    # AWS Lambdaクライアントの初期化（検索Lambdaの呼び出しのみに使用するため、検索用の設定とする）
+    if lambda_client is None:
+        import boto3
+        lambda_client = boto3.client("lambda", region_name=AWS_REGION, config=retrieval_aws_config)
+
+    # LangChain Bedrock LLMの初期化
+    if bedrock_llm is None or (BEDROCK_FAST_ID and bedrock_fast_llm is None) or (
+        cache_embeddings is None and answer_cache is not None and ANSWER_CACHE_EMBEDDING_MODEL_ID
+    ):
+        from langchain_aws import BedrockEmbeddings, ChatBedrock
+        if bedrock_llm is None:
+            bedrock_llm = ChatBedrock(
+                model_id=os.environ.get("BEDROCK_ID"),
+                region_name=AWS_REGION,
+                provider=os.environ.get("BEDROCK_PROVIDER"),
+                config=aws_config
+            )
+        if BEDROCK_FAST_ID and bedrock_fast_llm is None:
+            bedrock_fast_llm = ChatBedrock(
+                model_id=BEDROCK_FAST_ID,
+                region_name=AWS_REGION,
+                provider=os.environ.get("BEDROCK_FAST_PROVIDER", os.environ.get("BEDROCK_PROVIDER")),
+                config=aws_config
+            )
+        if cache_embeddings is None and answer_cache is not None and ANSWER_CACHE_EMBEDDING_MODEL_ID:
+            cache_embeddings = BedrockEmbeddings(
+                model_id=ANSWER_CACHE_EMBEDDING_MODEL_ID,
+                region_name=AWS_REGION,
+                config=aws_config
+            )
+
+    # ナレッジ検索バックエンドの初期化
+    if retrieval_backend is None:
+        retrieval_backend = ResilientRetrievalBackend(
+            create_retrieval_backend(RETRIEVAL_BACKEND),
+            deadline_seconds=RETRIEVAL_DEADLINE_SECONDS,
+            hedging=RETRIEVAL_HEDGING_ENABLED,
+            hedge_min_samples=RETRIEVAL_HEDGE_MIN_SAMPLES,
+            breaker=CircuitBreaker(RETRIEVAL_BREAKER_FAILURE_THRESHOLD, RETRIEVAL_BREAKER_RESET_SECONDS),
+            max_hedges_in_flight=RETRIEVAL_MAX_HEDGES_IN_FLIGHT
+        )
+
 
-# AWS Lambdaクライアントの初期化
-lambda_client = boto3.client("lambda", region_name=AWS_REGION)
+async def prepare():
+    """FAQインデックスの読み込みとウォームアップを並行して実行し、両方が完了したら準備完了とする"""
 
-# LangChain Bedrock LLMの初期化
-bedrock_llm = ChatBedrock(
-    model_id=os.environ.get("BEDROCK_ID"),
-    region_name=AWS_REGION,
-    provider=os.environ.get("BEDROCK_PROVIDER")
+    async def load_faq():
+        start = time.perf_counter()
+        await reload_faq_index()
+        startup_status["timings_ms"]["faq_index"] = round((time.perf_counter() - start) * 1000, 1)
+
+    await asyncio.gather(load_faq(), *([warm_up()] if WARMUP_ENABLED else []))
+    mark_ready()
+
+
+async def warm_up():
+    """Lambda・Bedrockへの接続を事前に確立する
+
+    失敗したステップは /ready に記録するが、準備完了は妨げない（依存先の障害は検索のサーキットブレーカー等で扱う）。
+    """
+    steps = []
+    if RETRIEVAL_BACKEND == "lambda":
+        # 検索Lambdaは warmup を指定すると検索を行わずに応答する（Lambdaの実行環境も起動しておく）
+        steps.append(("lambda", lambda: call_lambda_function(BEDROCK_KB_SEARCH_LAMBDA_FUNCTION_NAME, {"warmup": True})))
+    elif RETRIEVAL_BACKEND == "bedrock":
+        steps.append(("knowledge_base", lambda: retrieval_backend.backend.retrieve(WARMUP_PROMPT)))
+    if WARMUP_LLM_ENABLED:
+        steps.append(("llm", lambda: generate_llm_response(create_llm_messages(WARMUP_PROMPT))))
+        if bedrock_fast_llm is not None:
+            steps.append(("llm_fast", lambda: generate_llm_response(create_llm_messages(WARMUP_PROMPT), bedrock_fast_llm)))
+    if cache_embeddings is not None:
+        steps.append(("embeddings", lambda: asyncio.get_running_loop().run_in_executor(
+            io_executor, cache_embeddings.embed_query, WARMUP_PROMPT
+        )))
+
+    async def run_step(name, func):
+        start = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(func(), WARMUP_TIMEOUT_SECONDS)
+            if isinstance(result, dict) and "error" in result:
+                raise RuntimeError(result.get("details") or result["error"])
+            status = "ok"
+        except Exception as e:
+            logger.warning(f"ウォームアップ（{name}）に失敗しました: {e}")
+            status = f"error: {e}"
+        startup_status["warmup"][name] = {"status": status, "elapsed_ms": round((time.perf_counter() - start) * 1000, 1)}
+
+    start = time.perf_counter()
+    await asyncio.gather(*(run_step(name, func) for name, func in steps))
+    startup_status["timings_ms"]["warmup"] = round((time.perf_counter() - start) * 1000, 1)
+
+
+def mark_ready():
+    startup_status["ready"] = True
+    logger.info(f"起動が完了しました: {startup_status['timings_ms']}")
+
+
+def create_retrieval_backend(backend_name: str):
+    """設定に応じたナレッジ検索バックエンドを作成する"""
+    if backend_name == "lambda":
+        # call_lambda_functionは呼び出し時に参照する（差し替え可能にするため）
+        # 検索Lambda側でも同じ条件で絞り込み、不要なチャンクをレスポンスに含めない
+        return LambdaRetrievalBackend(
+            lambda payload: call_lambda_function(BEDROCK_KB_SEARCH_LAMBDA_FUNCTION_NAME, payload),
+            options={
+                "number_of_results": RETRIEVAL_MAX_RESULTS,
+                "score_threshold": RETRIEVAL_SCORE_THRESHOLD,
+                "relative_score_cutoff": RETRIEVAL_RELATIVE_SCORE_CUTOFF,
+                "min_results": RETRIEVAL_MIN_RESULTS
+            }
+        )
+    if backend_name == "bedrock":
+        import boto3
+        return BedrockKnowledgeBaseBackend(
+            boto3.client("bedrock-agent-runtime", region_name=AWS_REGION, config=retrieval_aws_config),
+            BEDROCK_KB_ID,
+            RETRIEVAL_MAX_RESULTS,
+            executor=io_executor
+        )
+    if backend_name == "memory":
+        return InMemoryRetrievalBackend.from_json_file(LOCAL_RETRIEVAL_DOCUMENTS_PATH, RETRIEVAL_MAX_RESULTS)
+    if backend_name == "local_index":
+        from local_vector_index import LocalVectorIndex
+        return LocalIndexRetrievalBackend(LocalVectorIndex.load(LOCAL_INDEX_DIR), RETRIEVAL_MAX_RESULTS)
+    raise ValueError(f"未対応のナレッジ検索バックエンドです: {backend_name}")
+
+
+# LLM推論プールの初期化
+# Bedrockの回答生成は同期APIのため、専用スレッドプールで実行してイベントループのブロックを防ぐ
+# 同時実行数の上限を超えたリクエストはセマフォで待機させる
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", "8"))
+llm_executor = IOExecutor(max_workers=LLM_MAX_CONCURRENCY, name="llm-inference")
+llm_semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+
+# 流量制御の設定
+# 回答生成（ナレッジ検索 → LLM）の同時実行数と待機キューを制限し、混雑時は429とRetry-Afterをすぐに返す
+# 同時実行数の上限はBedrockのスロットリングを検知すると自動的に下げ、成功が続くと元に戻す
+ADMISSION_CONTROL_ENABLED = os.environ.get("ADMISSION_CONTROL_ENABLED", "true").lower() == "true"
+admission_controller = AdmissionController(
+    max_concurrency=int(os.environ.get("ADMISSION_MAX_CONCURRENCY", str(LLM_MAX_CONCURRENCY))),
+    min_concurrency=int(os.environ.get("ADMISSION_MIN_CONCURRENCY", "1")),
+    max_queue=int(os.environ.get("ADMISSION_MAX_QUEUE", str(LLM_MAX_CONCURRENCY * 4))),
+    queue_timeout_seconds=float(os.environ.get("ADMISSION_QUEUE_TIMEOUT_SECONDS", "10"))
+) if ADMISSION_CONTROL_ENABLED else None
+
+# 回答キャッシュの初期化
+# 会話履歴に依存しない質問の回答を正規化した質問文で保存し、検索と回答生成を省略する
+# ANSWER_CACHE_EMBEDDING_MODEL_ID を設定した場合は埋め込みの類似度で言い換えにも一致させる
+ANSWER_CACHE_ENABLED = os.environ.get("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+ANSWER_CACHE_EMBEDDING_MODEL_ID = os.environ.get("ANSWER_CACHE_EMBEDDING_MODEL_ID")
+answer_cache = AnswerCache(
+    ttl_seconds=float(os.environ.get("ANSWER_CACHE_TTL_SECONDS", "3600")),
+    max_entries=int(os.environ.get("ANSWER_CACHE_MAX_ENTRIES", "1000")),
+    similarity_threshold=float(os.environ.get("ANSWER_CACHE_SIMILARITY_THRESHOLD", "0.95")) if ANSWER_CACHE_EMBEDDING_MODEL_ID else None
+) if ANSWER_CACHE_ENABLED else None
+
+# 会話履歴ストアの初期化
+# クライアントは新しいメッセージのみを送信し、会話履歴はsession_idをキーにサーバー側で保持する
+CONVERSATION_STORE = os.environ.get("CONVERSATION_STORE", "memory")
+SESSION_IDLE_TIMEOUT_SECONDS = float(os.environ.get("SESSION_IDLE_TIMEOUT_SECONDS", "1800"))
+CONVERSATION_MAX_MESSAGES = int(os.environ.get("CONVERSATION_MAX_MESSAGES", "60"))
+if CONVERSATION_STORE == "sqlite":
+    conversation_store = SQLiteConversationStore(
+        os.environ.get("CONVERSATION_DB_PATH", "conversations.db"),
+        idle_timeout_seconds=SESSION_IDLE_TIMEOUT_SECONDS,
+        max_messages=CONVERSATION_MAX_MESSAGES
+    )
+else:
+    conversation_store = InMemoryConversationStore(
+        idle_timeout_seconds=SESSION_IDLE_TIMEOUT_SECONDS,
+        max_bytes=int(os.environ.get("CONVERSATION_STORE_MAX_BYTES", str(64 * 1024 * 1024))),
+        max_messages=CONVERSATION_MAX_MESSAGES
+    )
+
+# プロンプトビルダーの初期化
+# プロンプト全体のトークン予算をルール・関連ドキュメント・会話履歴に配分する
+prompt_builder = PromptBuilder(
+    max_prompt_tokens=int(os.environ.get("PROMPT_MAX_TOKENS", "4000")),
+    max_history_tokens=int(os.environ.get("PROMPT_HISTORY_MAX_TOKENS", "1000")),
+    recent_messages=int(os.environ.get("PROMPT_RECENT_MESSAGES", "6"))
+)
+
+# コンテキスト整理の初期化
+# 検索結果から重複チャンクの除外・隣接チャンクの結合・質問に関連する文の抽出を行う
+CONTEXT_PACKING_ENABLED = os.environ.get("CONTEXT_PACKING_ENABLED", "true").lower() == "true"
+context_packer = ContextPacker(
+    duplicate_threshold=float(os.environ.get("CONTEXT_DUPLICATE_THRESHOLD", "0.8")),
+    trim_min_chars=int(os.environ.get("CONTEXT_TRIM_MIN_CHARS", "120"))
+) if CONTEXT_PACKING_ENABLED else None
+
+# 同一質問の集約の設定
+# 会話履歴に依存しない同じ質問が同時に届いた場合、ナレッジ検索と回答生成を1回だけ実行して結果を共有する
+REQUEST_COALESCING_ENABLED = os.environ.get("REQUEST_COALESCING_ENABLED", "true").lower() == "true"
+request_coalescer = SingleFlight() if REQUEST_COALESCING_ENABLED else None
+
+# FAQインデックスの設定
+# build_faq_index.py で事前に生成した頻出質問の回答を、信頼度の高い一致があればナレッジ検索・回答生成なしで返す
+FAQ_INDEX_PATH = os.environ.get("FAQ_INDEX_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "faq_index.json"))
+# 既定では正規化した質問文の完全一致のみを使用する
+# 設定した場合は、文字n-gramの類似度がこの値以上で、違いがひらがな（助詞・語尾など）のみの質問にも一致させる
+FAQ_SIMILARITY_THRESHOLD = float(os.environ["FAQ_SIMILARITY_THRESHOLD"]) if os.environ.get("FAQ_SIMILARITY_THRESHOLD") else None
+# FAQインデックス作成後にこのディレクトリのドキュメントが変更されていればFAQインデックスを使用しない（空文字列の場合は確認しない）
+FAQ_DOCUMENTS_DIR = os.environ.get(
+    "FAQ_DOCUMENTS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "documents")
 )
+# 会話履歴に依存しない質問を記録するクエリログ（未設定の場合は記録しない）
+QUERY_LOG_PATH = os.environ.get("QUERY_LOG_PATH")
+query_log = QueryLog(QUERY_LOG_PATH) if QUERY_LOG_PATH else None
+
+
+def load_faq_index(require_documents_check: bool = False):
+    """FAQインデックスを読み込む（存在しない場合・ドキュメントが変更されている場合はNone）
+
+    require_documents_check=True の場合、ドキュメントのディレクトリがなく変更を確認できない場合もNoneを返す。
+    """
+    if not os.path.exists(FAQ_INDEX_PATH):
+        return None
+    try:
+        index = FAQIndex.load(FAQ_INDEX_PATH, FAQ_SIMILARITY_THRESHOLD)
+    except Exception as e:
+        logger.warning(f"FAQインデックスの読み込みに失敗しました: {e}")
+        return None
+    if FAQ_DOCUMENTS_DIR and os.path.isdir(FAQ_DOCUMENTS_DIR):
+        if index.metadata.get("documents_fingerprint") != documents_fingerprint(FAQ_DOCUMENTS_DIR):
+            logger.warning("FAQインデックスの作成後にドキュメントが変更されているため、FAQインデックスを使用しません")
+            return None
+    elif require_documents_check:
+        logger.warning("ドキュメントの変更を確認できないため、FAQインデックスを使用しません")
+        return None
+    logger.info(f"FAQインデックスを読み込みました: {len(index)}件")
+    return index
+
+
+async def reload_faq_index(require_documents_check: bool = False):
+    """FAQインデックスを読み込み直す（ドキュメントの指紋の計算でファイルを読み込むため、スレッドプールで実行する）"""
+    global faq_index
+    faq_index = await asyncio.get_running_loop().run_in_executor(io_executor, load_faq_index, require_documents_check)
+
+
+# FAQインデックス（起動時に読み込む。ドキュメントの指紋の計算に時間がかかるため、import時には読み込まない）
+faq_index = None
+
+# バッチ処理の設定
+BATCH_MAX_PARALLELISM = int(os.environ.get("BATCH_MAX_PARALLELISM", "4"))
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", "100"))
+
+
+@app.middleware("http")
+async def stage_timing_middleware(request: Request, call_next):
+    """リクエストのステージごとの処理時間を計測し、Server-Timingヘッダー・ログ・メトリクスに出力する"""
+    path = route_path(request)
+    timer = start_request_timer(path)
+    # lifespanを経由せずに起動した場合（TestClient等）は最初のリクエストでクライアントの作成とFAQインデックスの読み込みを行う
+    if retrieval_backend is None:
+        initialize_clients()
+        await reload_faq_index()
+    response = await call_next(request)
+
+    # ストリーミングの場合はヘッダー送信までの時間（回答生成は含まない）
+    response.headers["Server-Timing"] = timer.server_timing()
+    request_duration.observe(timer.elapsed(), path=path, method=request.method, status=response.status_code)
+    if path not in ("/metrics", "/ready"):
+        log_stage_timings(timer, status=response.status_code)
+    return response
+
 
 @app.post("/chat")
 async def chat_endpoint(request: Request):
@@ -40,90 +417,666 @@ async def chat_endpoint(request: Request):
         
         request_body = await request.json()
         user_message = request_body.get("message")
-        session_id = request_body.get("session_id")
-        messages_history = request_body.get("messages_history", [])
 
         if not user_message:
             return JSONResponse({"error": "メッセージが送信されていません"}, status_code=400)
-        
-        logger.info("LLMの回答生成を開始します")
 
-        # AWS Lambda (ナレッジ検索)
-        lambda_response_bedrock_kb = await call_lambda_function(BEDROCK_KB_SEARCH_LAMBDA_FUNCTION_NAME, {"query_text": user_message})
-        related_documents = lambda_response_bedrock_kb.get("related_documents", [])
-        
-        # 関連ドキュメントの情報を抽出
-        document_info = []
-        context_texts = []
-        unique_titles = set()
-
-        # 関連ドキュメントが存在する場合、各ドキュメントからタイトルを抽出し、
-        # RAG用のコンテキストとして内容を保存
-        if related_documents:
-            for doc in related_documents:
-                content = doc.get("content", "")
-                metadata = doc.get("metadata", {})
-                
-                # メタデータから必要な情報を抽出
-                title = metadata.get("title", "不明なドキュメント")
-                                
-                # 一意のドキュメントタイトルのみをUI表示用に追加
-                if title not in unique_titles:
-                    unique_titles.add(title)
-                    # ドキュメント情報を保存
-                    document_info.append({
-                        "title": title,
-                        "content": content
-                    })              
-                # RAG用にコンテキストを追加
-                context_texts.append(content)
-            
-        # 会話履歴を含むRAGプロンプトを作成
-        rag_prompt = create_rag_prompt(user_message, context_texts, messages_history)
-        
-        # LangChain Bedrock LLMで回答生成
-        messages = [HumanMessage(content=rag_prompt)]
-        ai_response = bedrock_llm.invoke(messages)
-        response_text = ai_response.content
-        logger.info("LLMからの回答生成が完了しました")
-
-        # 生成した回答と関連ドキュメント情報を返却
-        final_response = {
-            "response": response_text,
-            "related_documents": document_info
-        }
-        return JSONResponse(final_response)
+        with stage("load_history"):
+            session_id, messages_history = await load_conversation(request_body)
+        record_query(user_message, messages_history)
+
+        # 回答生成（ナレッジ検索 → RAGプロンプト作成 → LLM）
+        final_response = await answer_question(user_message, messages_history, session_id)
+        with stage("save_history"):
+            await save_conversation_turn(session_id, user_message, final_response["response"])
+        with stage("serialize"):
+            return JSONResponse({**final_response, "session_id": session_id})
 
     except json.JSONDecodeError:
         logger.error("無効なJSON形式です")
         return JSONResponse({"error": "無効なJSON形式です"}, status_code=400)
     except Exception as e:
-        logger.error(f"エラーが発生しました: {e}")
+        return error_response(e)
+
+
+@app.post("/chat/stream")
+async def chat_stream_endpoint(request: Request):
+    """回答をトークン単位でストリーミング返却するエンドポイント (Server-Sent Events)"""
+    try:
+        request_body = await request.json()
+        user_message = request_body.get("message")
+
+        if not user_message:
+            return JSONResponse({"error": "メッセージが送信されていません"}, status_code=400)
+
+        with stage("load_history"):
+            session_id, messages_history = await load_conversation(request_body)
+        record_query(user_message, messages_history)
+
+        # 会話履歴に依存しない質問はFAQインデックス・回答キャッシュを参照
+        use_cache = answer_cache is not None and not has_conversation_context(messages_history)
+        # 回答の生成中にキャッシュが破棄された場合は保存しないよう、参照時の世代を記録する
+        cache_generation = answer_cache.generation if use_cache else None
+        cached_response, query_embedding = lookup_faq_index(user_message, messages_history), None
+        if cached_response is None and use_cache:
+            with stage("cache_lookup"):
+                cached_response, query_embedding = await lookup_answer_cache(user_message)
+
+        if cached_response is not None:
+            logger.info("FAQインデックスまたは回答キャッシュにヒットしました")
+        else:
+            logger.info("LLMの回答ストリーミングを開始します")
+
+            # 回答生成の実行枠はストリーミングの完了まで保持する（混雑時はここで429を返す）
+            # ストリーミングが始まらずに破棄された場合も、ガードの破棄時に実行枠を返却する
+            admission_slot = None
+            if admission_controller is not None:
+                with stage("admission"):
+                    admission_slot = await admission_controller.acquire_slot()
+            try:
+                # ナレッジ検索とRAGプロンプトの作成は /chat と同じ処理を使用
+                document_info, context_texts, top_score = await retrieve_related_documents(user_message)
+                with stage("prompt"):
+                    rag_prompt = create_rag_prompt(user_message, context_texts, messages_history, session_id)
+                messages = create_llm_messages(rag_prompt)
+                route = choose_model_route(user_message, document_info, top_score, messages_history)
+            except Exception as e:
+                if admission_slot is not None:
+                    admission_slot.release(e)
+                raise
+
+    except json.JSONDecodeError:
+        logger.error("無効なJSON形式です")
+        return JSONResponse({"error": "無効なJSON形式です"}, status_code=400)
+    except Exception as e:
+        return error_response(e)
+
+    async def cached_event_stream():
+        # キャッシュ済みの回答は1チャンクで送信する
+        yield format_sse_event("related_documents", {
+            "related_documents": cached_response["related_documents"], "session_id": session_id
+        })
+        yield format_sse_event("token", {"text": cached_response["response"]})
+        await save_conversation_turn(session_id, user_message, cached_response["response"])
+        yield format_sse_event("done", {"session_id": session_id})
+
+    async def event_stream():
+        # 関連ドキュメントを先に送信し、続けて回答のチャンクを順次送信する
+        stream_error = None
+        try:
+            # session_idも最初のイベントで送信し、回答の途中でエラー・切断となってもクライアントが会話を継続できるようにする
+            yield format_sse_event("related_documents", {"related_documents": document_info, "session_id": session_id})
+            response_chunks = []
+            async for chunk_text in stream_routed_response(messages, route):
+                response_chunks.append(chunk_text)
+                yield format_sse_event("token", {"text": chunk_text})
+            logger.info("LLMからの回答ストリーミングが完了しました")
+            response_text = "".join(response_chunks)
+            if use_cache and document_info:
+                answer_cache.put(user_message, {
+                    "response": response_text,
+                    "related_documents": document_info
+                }, query_embedding, cache_generation)
+            with stage("save_history"):
+                await save_conversation_turn(session_id, user_message, response_text)
+            yield format_sse_event("done", {"session_id": session_id})
+        except Exception as e:
+            stream_error = e
+            logger.error(f"ストリーミング中にエラーが発生しました: {e}")
+            yield format_sse_event("error", {"error": "サーバーエラーが発生しました"})
+        finally:
+            if admission_slot is not None:
+                admission_slot.release(stream_error)
+            # Server-Timingヘッダーには回答生成が含まれないため、ストリーミング完了時の内訳をログに出力する
+            timer = current_timer()
+            if timer is not None:
+                log_stage_timings(timer, streaming=True)
+
+    return StreamingResponse(
+        cached_event_stream() if cached_response is not None else event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.post("/chat/batch")
+async def chat_batch_endpoint(request: Request):
+    """独立した複数の質問を並列に処理し、入力順に結果を返すエンドポイント"""
+    try:
+        request_body = await request.json()
+    except json.JSONDecodeError:
+        logger.error("無効なJSON形式です")
+        return JSONResponse({"error": "無効なJSON形式です"}, status_code=400)
+    if not isinstance(request_body, dict):
+        return JSONResponse({"error": "リクエストボディはJSONオブジェクトで送信してください"}, status_code=400)
+
+    questions = request_body.get("questions")
+    if not isinstance(questions, list) or not questions:
+        return JSONResponse({"error": "質問のリストが送信されていません"}, status_code=400)
+    if len(questions) > BATCH_MAX_ITEMS:
+        return JSONResponse({"error": f"質問は{BATCH_MAX_ITEMS}件以内で送信してください"}, status_code=400)
+
+    # 並列数はリクエストで指定できるが、サーバー側の上限を超えない
+    try:
+        parallelism = max(1, min(int(request_body.get("max_parallelism", BATCH_MAX_PARALLELISM)), BATCH_MAX_PARALLELISM))
+    except (TypeError, ValueError):
+        return JSONResponse({"error": "max_parallelismは整数で指定してください"}, status_code=400)
+    semaphore = asyncio.Semaphore(parallelism)
+    # 各質問を並行して処理するため、ステージの処理時間は全質問の合計となる
+    timer = current_timer()
+    if timer is not None:
+        timer.summed = True
+
+    async def run_item(index: int, question):
+        # 文字列、または {"message": ...} 形式の質問を受け付ける
+        user_message = question.get("message") if isinstance(question, dict) else question
+        async with semaphore:
+            start = time.perf_counter()
+            if not isinstance(user_message, str) or not user_message:
+                return {"index": index, "status": "error", "error": "メッセージが送信されていません", "elapsed_ms": 0.0}
+            try:
+                result = await answer_question(user_message)
+                return {
+                    "index": index,
+                    "status": "ok",
+                    "message": user_message,
+                    **result,
+                    "elapsed_ms": (time.perf_counter() - start) * 1000
+                }
+            except AdmissionRejected as e:
+                return {
+                    "index": index,
+                    "status": "error",
+                    "message": user_message,
+                    "error": "混雑しているため処理できませんでした",
+                    "retry_after": e.retry_after,
+                    "elapsed_ms": (time.perf_counter() - start) * 1000
+                }
+            except Exception as e:
+                logger.error(f"バッチ処理中にエラーが発生しました（{index}件目）: {e}")
+                return {
+                    "index": index,
+                    "status": "error",
+                    "message": user_message,
+                    "error": "サーバーエラーが発生しました",
+                    "elapsed_ms": (time.perf_counter() - start) * 1000
+                }
+
+    logger.info(f"バッチ処理を開始します: {len(questions)}件（並列数: {parallelism}）")
+    start = time.perf_counter()
+    results = await asyncio.gather(*(run_item(i, question) for i, question in enumerate(questions)))
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    logger.info(f"バッチ処理が完了しました: {elapsed_ms:.0f}ms")
+
+    return JSONResponse({
+        "results": results,
+        "succeeded": sum(1 for result in results if result["status"] == "ok"),
+        "failed": sum(1 for result in results if result["status"] != "ok"),
+        "elapsed_ms": elapsed_ms
+    })
+
+
+@app.get("/sessions/stats")
+async def session_stats_endpoint():
+    """会話履歴ストアのセッション数などの統計情報を返す"""
+    return JSONResponse(await call_conversation_store(conversation_store.stats))
+
+
+@app.delete("/sessions/{session_id}")
+async def delete_session_endpoint(session_id: str):
+    """セッションの会話履歴を削除する"""
+    await call_conversation_store(conversation_store.delete, session_id)
+    return JSONResponse({"deleted": session_id})
+
+
+async def call_conversation_store(method, *args):
+    """会話履歴ストアのメソッドを呼び出す（SQLiteなどディスクI/Oを伴うストアはスレッドプールで実行する）"""
+    if not conversation_store.blocking_io:
+        return method(*args)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(io_executor, method, *args)
+
+
+async def load_conversation(request_body: dict) -> tuple[str, list[dict]]:
+    """リクエストからsession_idと会話履歴を取得する
+
+    session_idがない場合は新規に発行する。messages_historyを送信する従来のクライアントの場合は
+    送信された履歴を優先し、それ以外はサーバー側で保持している履歴を使用する。
+    """
+    session_id = request_body.get("session_id") or str(uuid.uuid4())
+    messages_history = request_body.get("messages_history")
+    if messages_history is None:
+        messages_history = await call_conversation_store(conversation_store.get_history, session_id)
+    return session_id, messages_history
+
+
+async def save_conversation_turn(session_id: str, user_message: str, response_text: str):
+    """質問と回答をセッションの会話履歴に保存する"""
+    try:
+        await call_conversation_store(conversation_store.append, session_id, [
+            {"role": "user", "content": user_message},
+            {"role": "assistant", "content": response_text}
+        ])
+    except Exception as e:
+        logger.error(f"会話履歴の保存に失敗しました: {e}")
+
+
+@app.get("/ready")
+async def ready_endpoint():
+    """起動とウォームアップが完了していれば200、完了していなければ503を返す（起動時間の内訳を含む）"""
+    return JSONResponse(startup_status, status_code=200 if startup_status["ready"] else 503)
+
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """リクエスト全体とステージごとの処理時間のヒストグラムをPrometheus形式で返す"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
+def route_path(request: Request) -> str:
+    """メトリクスのラベル用に、リクエストに一致するルートのパス（/sessions/{session_id} など）を返す"""
+    for route in app.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            return route.path
+    return "unmatched"
+
+
+def log_stage_timings(timer, **fields):
+    """ステージごとの処理時間を構造化ログとして出力する"""
+    timings = {
+        "path": timer.path,
+        **fields,
+        "stages_ms": timer.durations_ms(),
+        "stages_summed": timer.summed,
+        "total_ms": round(timer.elapsed() * 1000, 1),
+    }
+    logger.info(f"処理時間の内訳: {json.dumps(timings, ensure_ascii=False)}", extra={"timings": timings})
+
+
+@app.get("/retrieval/stats")
+async def retrieval_stats_endpoint():
+    """ナレッジ検索バックエンドの検索時間の統計情報を返す"""
+    return JSONResponse(retrieval_backend.stats())
+
+
+@app.get("/cache/stats")
+async def cache_stats_endpoint():
+    """回答キャッシュのヒット・ミス数などの統計情報を返す"""
+    if answer_cache is None:
+        return JSONResponse({"enabled": False})
+    return JSONResponse({"enabled": True, **answer_cache.stats()})
+
+
+@app.get("/coalescing/stats")
+async def coalescing_stats_endpoint():
+    """同一質問の集約で省略したナレッジ検索・回答生成の回数などの統計情報を返す"""
+    if request_coalescer is None:
+        return JSONResponse({"enabled": False})
+    return JSONResponse({"enabled": True, **request_coalescer.stats()})
+
+
+@app.get("/admission/stats")
+async def admission_stats_endpoint():
+    """流量制御の同時実行数の上限・待機中の件数・拒否件数を返す"""
+    if admission_controller is None:
+        return JSONResponse({"enabled": False})
+    return JSONResponse({"enabled": True, **admission_controller.stats()})
+
+
+@app.get("/io/stats")
+async def io_stats_endpoint():
+    """AWS呼び出し用・LLM推論用スレッドプールのサイズと実行待ちのタスク数を返す"""
+    return JSONResponse({
+        "pools": [io_executor.stats(), llm_executor.stats()],
+        "max_pool_connections": AWS_MAX_POOL_CONNECTIONS
+    })
+
+
+@app.get("/routing/stats")
+async def routing_stats_endpoint():
+    """モデルルーティングのルートごとの件数・回答生成時間・strongへの切り替え回数を返す"""
+    return JSONResponse({"enabled": bedrock_fast_llm is not None, **model_router.stats()})
+
+
+@app.get("/faq/stats")
+async def faq_stats_endpoint():
+    """FAQインデックスの件数・ヒット数などの統計情報を返す"""
+    if faq_index is None:
+        return JSONResponse({"enabled": False})
+    return JSONResponse({"enabled": True, **faq_index.stats()})
+
+
+@app.post("/faq/reload")
+async def faq_reload_endpoint():
+    """再作成したFAQインデックスを読み込み直す（build_faq_index.py の実行後に呼び出す）"""
+    await reload_faq_index()
+    return JSONResponse({"loaded": faq_index is not None, "entries": len(faq_index) if faq_index is not None else 0})
+
+
+@app.post("/cache/invalidate")
+async def cache_invalidate_endpoint(request: Request):
+    """回答キャッシュを破棄し、FAQインデックスを読み込み直す（ナレッジベースの再同期完了時に呼び出す）
+
+    FAQインデックスは作成後にドキュメントが変更されている場合、または変更を確認できない場合は使用しなくなる。
+    """
+    try:
+        request_body = await request.json()
+    except json.JSONDecodeError:
+        request_body = {}
+    if not isinstance(request_body, dict):
+        return JSONResponse({"error": "リクエストボディはJSONオブジェクトで送信してください"}, status_code=400)
+
+    if answer_cache is not None:
+        answer_cache.invalidate(request_body.get("knowledge_base_version"))
+        logger.info("回答キャッシュを破棄しました")
+    if faq_index is not None:
+        await reload_faq_index(require_documents_check=True)
+    return JSONResponse({"invalidated": answer_cache is not None, "faq_index_loaded": faq_index is not None})
+
+
+async def lookup_answer_cache(user_message: str):
+    """回答キャッシュを参照し、(キャッシュ済みの回答, 質問の埋め込み) を返す"""
+    query_embedding = None
+    # 完全一致しない場合のみ埋め込みを計算し、類似した質問を探す
+    if cache_embeddings is not None and not answer_cache.contains(user_message):
+        try:
+            loop = asyncio.get_running_loop()
+            query_embedding = await loop.run_in_executor(io_executor, cache_embeddings.embed_query, user_message)
+        except Exception as e:
+            logger.warning(f"回答キャッシュ用の埋め込み生成に失敗しました: {e}")
+    return answer_cache.get(user_message, query_embedding), query_embedding
+
+
+def lookup_faq_index(user_message: str, messages_history=None):
+    """会話履歴に依存しない質問であればFAQインデックスを参照し、一致した回答を返す（一致しない場合はNone）"""
+    if faq_index is None or has_conversation_context(messages_history):
+        return None
+    with stage("faq_lookup"):
+        faq_response = faq_index.lookup(user_message)
+    if faq_response is not None:
+        logger.info("FAQインデックスにヒットしました")
+    return faq_response
+
+
+def record_query(user_message: str, messages_history=None):
+    """会話履歴に依存しない質問をクエリログに記録する（FAQインデックスの作成に使用）
+
+    ファイルへの追記はスレッドプールで実行し、完了を待たない。
+    """
+    if query_log is None or has_conversation_context(messages_history):
+        return
+
+    def on_done(future):
+        if not future.cancelled() and future.exception() is not None:
+            logger.warning(f"クエリログの記録に失敗しました: {future.exception()}")
+
+    asyncio.get_running_loop().run_in_executor(io_executor, query_log.append, user_message).add_done_callback(on_done)
+
+
+def error_response(error: Exception) -> JSONResponse:
+    """例外をレスポンスに変換する（混雑・スロットリングは429とRetry-After、それ以外は500）"""
+    if isinstance(error, AdmissionRejected):
+        logger.warning(f"混雑のためリクエストを拒否しました: {error.reason}（Retry-After: {error.retry_after}秒）")
+        retry_after = error.retry_after
+    elif is_throttling_error(error):
+        logger.warning(f"Bedrockのスロットリングが発生しました: {error}")
+        retry_after = admission_controller.retry_after() if admission_controller is not None else 1
+    else:
+        logger.error(f"エラーが発生しました: {error}")
         return JSONResponse({"error": "サーバーエラーが発生しました"}, status_code=500)
+    return JSONResponse(
+        {"error": "混雑しているため処理できませんでした。しばらくしてから再度お試しください", "retry_after": retry_after},
+        status_code=429,
+        headers={"Retry-After": str(retry_after)}
+    )
+
+
+def format_sse_event(event: str, data: dict) -> str:
+    """Server-Sent Events形式のイベント文字列を作成する"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def answer_question(user_message: str, messages_history=None, session_id=None) -> dict:
+    """1件の質問に対してRAGで回答を生成し、回答と関連ドキュメント情報を返す"""
+    # 頻出質問は事前に生成したFAQインデックスから回答
+    faq_response = lookup_faq_index(user_message, messages_history)
+    if faq_response is not None:
+        return faq_response
+
+    # 会話履歴に依存しない質問は回答キャッシュを参照
+    use_cache = answer_cache is not None and not has_conversation_context(messages_history)
+    if use_cache:
+        # 回答の生成中にキャッシュが破棄された場合は保存しないよう、参照時の世代を記録する
+        cache_generation = answer_cache.generation
+        with stage("cache_lookup"):
+            cached_response, query_embedding = await lookup_answer_cache(user_message)
+        if cached_response is not None:
+            logger.info("回答キャッシュにヒットしました")
+            return cached_response
+
+    # 会話履歴に依存しない同じ質問が処理中の場合は、その結果を共有する
+    if request_coalescer is not None and not has_conversation_context(messages_history):
+        coalescing_key = normalize_query(user_message)
+        # 処理中の結果を待つ時間のみを計測する（自ら実行する場合の処理時間は各ステージで計測する）
+        with stage("coalescing") if request_coalescer.is_in_flight(coalescing_key) else nullcontext():
+            final_response, shared = await request_coalescer.do(
+                coalescing_key,
+                lambda: generate_admitted_answer(user_message, messages_history, session_id)
+            )
+        if shared:
+            logger.info("処理中の同じ質問の回答を共有しました")
+            return dict(final_response)
+    else:
+        final_response = await generate_admitted_answer(user_message, messages_history, session_id)
+
+    # 検索に失敗した回答はキャッシュしない
+    if use_cache and final_response["related_documents"]:
+        answer_cache.put(user_message, final_response, query_embedding, cache_generation)
+    return final_response
+
+
+async def generate_admitted_answer(user_message: str, messages_history=None, session_id=None) -> dict:
+    """流量制御の実行枠を取得してから回答を生成する（混雑時は AdmissionRejected）
+
+    同じ質問の集約で結果を共有するリクエストは実行枠を消費しない。
+    """
+    if admission_controller is None:
+        return await generate_answer(user_message, messages_history, session_id)
+    with stage("admission"):
+        admitted_at = await admission_controller.acquire()
+    error = None
+    try:
+        return await generate_answer(user_message, messages_history, session_id)
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        admission_controller.release(admitted_at, error)
+
+
+async def generate_answer(user_message: str, messages_history=None, session_id=None) -> dict:
+    """ナレッジ検索 → RAGプロンプト作成 → LLMの順に回答を生成する"""
+    logger.info("LLMの回答生成を開始します")
+
+    # ナレッジ検索
+    document_info, context_texts, top_score = await retrieve_related_documents(user_message)
+
+    # 会話履歴を含むRAGプロンプトを作成
+    with stage("prompt"):
+        rag_prompt = create_rag_prompt(user_message, context_texts, messages_history, session_id)
+    
+    # 質問の複雑さに応じて選択したモデルで回答生成
+    messages = create_llm_messages(rag_prompt)
+    route = choose_model_route(user_message, document_info, top_score, messages_history)
+    response_text = await generate_routed_response(messages, route)
+    logger.info("LLMからの回答生成が完了しました")
+
+    # 生成した回答と関連ドキュメント情報を返却
+    return {
+        "response": response_text,
+        "related_documents": document_info
+    }
+
+
+async def retrieve_related_documents(user_message: str) -> tuple[list[dict], list[str], float]:
+    """ナレッジ検索を行い、UI表示用のドキュメント情報・RAG用のコンテキスト・最上位の関連度スコアを返す
+
+    スコアを持たないバックエンドの場合、関連度スコアはNoneとなる。
+    """
+    # 設定されたバックエンドでナレッジ検索
+    with stage("retrieval"):
+        related_documents = await retrieval_backend.retrieve(user_message)
+
+    # 関連度スコアで回答に必要なチャンクのみに絞り込む（検索Lambdaで絞り込み済みの場合は変わらない）
+    selected_documents = select_documents(
+        related_documents or [], RETRIEVAL_SCORE_THRESHOLD, RETRIEVAL_RELATIVE_SCORE_CUTOFF, RETRIEVAL_MIN_RESULTS
+    )
+    if related_documents and len(selected_documents) < len(related_documents):
+        logger.info(f"スコアによる絞り込み: {len(related_documents)}件 → {len(selected_documents)}件")
+    related_documents = selected_documents
+    top_score = related_documents[0].get("metadata", {}).get("score") if related_documents else None
+    
+    # 関連ドキュメントの情報を抽出
+    document_info = []
+    context_texts = []
+    unique_titles = set()
+
+    # 関連ドキュメントが存在する場合、各ドキュメントからタイトルを抽出し、
+    # RAG用のコンテキストとして内容を保存
+    if related_documents:
+        for doc in related_documents:
+            content = doc.get("content", "")
+            metadata = doc.get("metadata", {})
+            
+            # メタデータから必要な情報を抽出
+            title = metadata.get("title", "不明なドキュメント")
+                            
+            # 一意のドキュメントタイトルのみをUI表示用に追加
+            if title not in unique_titles:
+                unique_titles.add(title)
+                # ドキュメント情報を保存
+                document_info.append({
+                    "title": title,
+                    "content": content
+                })              
+            # RAG用にコンテキストを追加
+            context_texts.append(content)
+
+        # 重複・隣接チャンクを整理し、質問に関連する文に絞り込んで入力トークンを削減
+        if context_packer is not None:
+            with stage("context_packing"):
+                packed_texts = context_packer.pack(user_message, related_documents)
+            logger.info(
+                f"コンテキスト整理: {len(context_texts)}件 → {len(packed_texts)}件、"
+                f"推定トークン数 {sum(map(estimate_tokens, context_texts))} → {sum(map(estimate_tokens, packed_texts))}"
+            )
+            context_texts = packed_texts
+
+    return document_info, context_texts, top_score
+
+
+def choose_model_route(user_message: str, document_info: list[dict], top_score=None, messages_history=None) -> str:
+    """回答生成に使用するモデルのルート（fast / strong）を選択する（fastのモデル未設定の場合は常にstrong）"""
+    if bedrock_fast_llm is None:
+        return "strong"
+    route, reasons = model_router.choose(user_message, len(document_info), top_score, len(messages_history or []))
+    logger.info(f"モデルルーティング: {route}" + (f"（{', '.join(reasons)}）" if reasons else ""))
+    return route
+
+
+def llm_for_route(route: str):
+    """ルートに対応するLLMを返す（差し替え可能にするため呼び出し時に参照する）"""
+    return bedrock_fast_llm if route == "fast" else bedrock_llm
+
+
+async def generate_routed_response(messages: list, route: str) -> str:
+    """選択したルートのモデルで回答を生成し、fastのモデルが回答できなかった場合はstrongのモデルで回答し直す"""
+    if route == "fast":
+        start = time.perf_counter()
+        try:
+            response_text = await generate_llm_response(messages, llm_for_route("fast"))
+            model_router.record("fast", time.perf_counter() - start)
+            if not is_declined(response_text):
+                return response_text
+            logger.info("fastのモデルが回答できなかったため、strongのモデルで回答し直します")
+        except Exception as e:
+            # スロットリングの場合は呼び出しを増やさないよう切り替えず、流量制御に伝える
+            if is_throttling_error(e):
+                raise
+            logger.warning(f"fastのモデルでの回答生成に失敗したため、strongのモデルで回答し直します: {e}")
+        model_router.record_fallback()
+
+    start = time.perf_counter()
+    response_text = await generate_llm_response(messages, llm_for_route("strong"))
+    model_router.record("strong", time.perf_counter() - start)
+    return response_text
+
+
+async def stream_routed_response(messages: list, route: str):
+    """選択したルートのモデルで回答をストリーミング生成する
+
+    fastのモデルの回答は、根拠が見つからない旨の回答かを判定できるまで（最初の文が終わるまで）チャンクを保留し、
+    そうだった場合は破棄してstrongのモデルの回答をストリーミングする（/chat と同じ判定にするため）。
+    """
+    if route == "fast":
+        start = time.perf_counter()
+        pending = []
+        flushed = False
+        fast_stream = stream_llm_response(messages, llm_for_route("fast"))
+        try:
+            async for chunk_text in fast_stream:
+                if flushed:
+                    yield chunk_text
+                    continue
+                pending.append(chunk_text)
+                if not may_become_declined("".join(pending)):
+                    if is_declined("".join(pending)):
+                        break
+                    flushed = True
+                    yield "".join(pending)
+            if not flushed and pending and not is_declined("".join(pending)):
+                # 保留中のまま回答が終わった場合（一文だけの短い回答等）はそのまま返す
+                flushed = True
+                yield "".join(pending)
+        except Exception as e:
+            # 送信済みのチャンクがある場合は切り替えられないため、そのままエラーとする
+            # スロットリングの場合は呼び出しを増やさないよう切り替えず、流量制御に伝える
+            if flushed or is_throttling_error(e):
+                raise
+            logger.warning(f"fastのモデルでの回答生成に失敗したため、strongのモデルで回答し直します: {e}")
+        finally:
+            # 途中で打ち切った場合も推論プールの枠をすぐに解放する
+            await fast_stream.aclose()
+        model_router.record("fast", time.perf_counter() - start)
+        if flushed:
+            return
+        logger.info("fastのモデルが回答できなかったため、strongのモデルで回答し直します")
+        model_router.record_fallback()
+
+    start = time.perf_counter()
+    async for chunk_text in stream_llm_response(messages, llm_for_route("strong")):
+        yield chunk_text
+    model_router.record("strong", time.perf_counter() - start)
 
 
 async def call_lambda_function(function_name: str, payload: dict):
     """AWS Lambda関数を非同期で呼び出す"""
     try:
         # 現在のイベントループを取得
-        loop = asyncio.get_event_loop()
-        
-        # boto3は同期APIのため、非同期コンテキストで実行するために別スレッドで実行
-        # これによりFastAPIのイベントループがブロックされるのを防ぐ
-        response = await loop.run_in_executor(
-            None,
-            lambda: lambda_client.invoke(
+        loop = asyncio.get_running_loop()
+
+        def invoke():
+            response = lambda_client.invoke(
                 FunctionName=function_name,
                 InvocationType="RequestResponse",
                 Payload=json.dumps(payload)
             )
-        )
+            # レスポンスのペイロードも同じスレッドで読み込む（スレッドプールの往復を1回にする）
+            return response, response["Payload"].read()
 
-        # レスポンスのペイロードをバイトに変換
-        payload_bytes = await loop.run_in_executor(
-            None,
-            lambda: response["Payload"].read()
-        )
+        # boto3は同期APIのため、AWS呼び出し用スレッドプールで実行してFastAPIのイベントループのブロックを防ぐ
+        response, payload_bytes = await loop.run_in_executor(io_executor, invoke)
         
         # バイトを文字列に変換
         payload_str = payload_bytes.decode("utf-8")    
@@ -142,31 +1095,44 @@ async def call_lambda_function(function_name: str, payload: dict):
         return {"error": "Lambda関数の呼び出しに失敗しました", "details": str(e)}
 
 
-def format_conversation_history(messages_history=None, max_messages=60) -> str:
-    """会話履歴を整形して文字列として返す"""
-    
-    if not messages_history:
-        return ""
-        
-    conversation_text = ""
-    # 最新の数件の会話のみを使用（トークン制限を考慮）
-    recent_messages = messages_history[-max_messages:]
-    for message in recent_messages:
-        if message["role"] == "user":
-            conversation_text += f"ユーザー: {message['content']}\n"
-        elif message["role"] == "assistant":
-            conversation_text += f"アシスタント: {message['content']}\n"
-    
-    return f"過去の会話:\n{conversation_text}" if conversation_text else ""
+async def generate_llm_response(messages: list, llm=None) -> str:
+    """LLM推論プールで回答を非同期に生成する（llm未指定の場合は bedrock_llm）"""
+    llm = llm or bedrock_llm
+    # 推論プールの空き待ちと回答生成を別のステージとして計測する
+    with stage("llm_queue"):
+        await llm_semaphore.acquire()
+    try:
+        with stage("llm"):
+            loop = asyncio.get_running_loop()
+            ai_response = await loop.run_in_executor(llm_executor, llm.invoke, messages)
+    finally:
+        llm_semaphore.release()
+    return ai_response.content
 
-def create_rag_prompt(query: str, documents: list[str], messages_history=None) -> str:
-    """社内FAQチャットボット用のRAGプロンプトを作成する"""
-    # 関連ドキュメントをコンテキストとして結合
-    context = "\n".join(documents)
-    # 会話履歴の呼び出し
-    past_conversation = format_conversation_history(messages_history)
-    
-    prompt = f"""
+
+async def stream_llm_response(messages: list, llm=None):
+    """LLM推論プールで回答をストリーミング生成し、チャンクのテキストを順次返す（llm未指定の場合は bedrock_llm）"""
+    llm = llm or bedrock_llm
+    with stage("llm_queue"):
+        await llm_semaphore.acquire()
+    try:
+        # 回答生成のステージにはクライアントへの送信待ちの時間も含まれる
+        with stage("llm"):
+            loop = asyncio.get_running_loop()
+            # 同期イテレータの各チャンク取得を推論プールで実行し、イベントループをブロックしない
+            chunk_iterator = iter(llm.stream(messages))
+            while True:
+                chunk = await loop.run_in_executor(llm_executor, next, chunk_iterator, None)
+                if chunk is None:
+                    break
+                if chunk.content:
+                    yield chunk.content
+    finally:
+        llm_semaphore.release()
+
+
+# RAGプロンプトのテンプレート
+RAG_PROMPT_TEMPLATE = """
     あなたは株式会社架空ソリューションズの社内FAQチャットボットです。
     以下のルールに厳密に従って、ユーザーの質問に回答してください。
 
@@ -191,4 +1157,25 @@ def create_rag_prompt(query: str, documents: list[str], messages_history=None) -
 
     # 回答：
     """
-    return prompt
\ No newline at end of file
+RAG_PROMPT_RULES = RAG_PROMPT_TEMPLATE.format(context="", past_conversation="", query="")
+
+
+def create_llm_messages(prompt: str) -> list:
+    """LLMに渡すメッセージのリストを作成する（langchain_core は初回の呼び出し時に読み込む）"""
+    from langchain_core.messages import HumanMessage
+    return [HumanMessage(content=prompt)]
+
+
+def create_rag_prompt(query: str, documents: list[str], messages_history=None, session_id=None) -> str:
+    """社内FAQチャットボット用のRAGプロンプトを作成する"""
+    # トークン予算内で関連ドキュメントと会話履歴（古い発言は要約）を配分
+    context, past_conversation, section_tokens = prompt_builder.build_sections(
+        RAG_PROMPT_RULES, query, documents, messages_history, session_id
+    )
+    logger.info(f"プロンプトのトークン数（推定）: {section_tokens}")
+
+    return RAG_PROMPT_TEMPLATE.format(context=context, past_conversation=past_conversation, query=query)
+
+
+# モジュールの読み込みにかかった時間（/ready の起動時間の内訳に含める）
+startup_status["timings_ms"]["import"] = round((time.perf_counter() - _import_started_at) * 1000, 1)
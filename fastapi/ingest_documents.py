@@ -0,0 +1,165 @@
+# fastapi/ingest_documents.py
+"""ローカルベクトルインデックスの差分取り込みCLI
+
+PDFのテキスト抽出・チャンク分割・埋め込みをプロセスプールで並列実行する。
+ファイルとチャンクの内容ハッシュをインデックスに記録し、変更があったチャンクのみを再埋め込みする。
+- ファイルのハッシュが一致する場合: テキスト抽出も行わず、既存の行をそのまま再利用
+- チャンクのハッシュが一致する場合: 既存の埋め込みを再利用
+差分で処理するのはテキスト抽出と埋め込みの計算のみで、インデックスのファイル（embeddings.f32・metadata.json）は
+毎回全体を書き直す。
+
+実行例:
+    python ingest_documents.py --documents-dir ../documents --index-dir ../local_index --workers 4
+"""
+import argparse
+import hashlib
+import time
+import unicodedata
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from local_vector_index import (
+    EMBEDDING_DIM,
+    EMBEDDING_NAME,
+    LocalVectorIndex,
+    chunk_text,
+    extract_pdf_pages,
+    hashing_embedding,
+    load_embeddings,
+    load_index_metadata,
+)
+
+# 1回の埋め込みタスクで処理するチャンク数
+EMBEDDING_BATCH_SIZE = 64
+
+
+def file_sha256(path: Path) -> str:
+    """ファイル内容のSHA-256ハッシュを返す"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def chunk_sha256(title: str, content: str) -> str:
+    """チャンクの内容ハッシュを返す（埋め込み方式が変わった場合も再埋め込みされるよう含める）"""
+    return hashlib.sha256(f"{EMBEDDING_NAME}\0{title}\0{content}".encode("utf-8")).hexdigest()
+
+
+def extract_and_chunk(pdf_path: str) -> tuple[int, list[str]]:
+    """PDFからテキストを抽出してチャンク分割し、(ページ数, チャンクのリスト) を返す（ワーカープロセスで実行）"""
+    pages = extract_pdf_pages(pdf_path)
+    chunks = [chunk for page_text in pages for chunk in chunk_text(page_text)]
+    return len(pages), chunks
+
+
+def embed_batch(texts: list[str]) -> np.ndarray:
+    """チャンクのバッチを埋め込む（ワーカープロセスで実行）"""
+    return hashing_embedding(texts)
+
+
+def ingest_documents(documents_dir: str, index_dir: str, workers: int = None) -> dict:
+    """ドキュメントを差分取り込みしてインデックスを更新し、処理結果の統計を返す"""
+    start = time.perf_counter()
+
+    # 既存インデックスの読み込み（ハッシュ -> 行番号）
+    previous = load_index_metadata(index_dir)
+    if previous is not None and previous.get("embedding") == EMBEDDING_NAME and "chunk_hashes" in previous:
+        previous_embeddings = load_embeddings(index_dir, previous["count"], previous["dim"])
+        previous_row_by_hash = {chunk_hash: row for row, chunk_hash in enumerate(previous["chunk_hashes"])}
+        previous_files = previous.get("files", {})
+    else:
+        previous = None
+        previous_embeddings = np.zeros((0, EMBEDDING_DIM), dtype=np.float32)
+        previous_row_by_hash = {}
+        previous_files = {}
+
+    pdf_paths = sorted(Path(documents_dir).glob("*.pdf"))
+    files = {}
+    changed_paths = []
+    for pdf_path in pdf_paths:
+        file_hash = file_sha256(pdf_path)
+        files[pdf_path.name] = {"sha256": file_hash}
+        if previous_files.get(pdf_path.name, {}).get("sha256") != file_hash:
+            changed_paths.append(pdf_path)
+
+    chunk_titles, contents, chunk_hashes, chunk_files = [], [], [], []
+    pages_processed = 0
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # 1. 変更されたファイルのみテキスト抽出・チャンク分割を並列実行
+        extracted = dict(zip(changed_paths, executor.map(extract_and_chunk, [str(p) for p in changed_paths])))
+
+        for pdf_path in pdf_paths:
+            # Bedrock Knowledge Baseと同様に、ファイル名をドキュメントのタイトルとする
+            title = unicodedata.normalize("NFC", pdf_path.stem)
+            if pdf_path in extracted:
+                page_count, chunks = extracted[pdf_path]
+                pages_processed += page_count
+            else:
+                # 未変更のファイルは既存インデックスのチャンクをそのまま使用
+                page_count = previous_files[pdf_path.name].get("pages", 0)
+                chunks = [
+                    previous["contents"][row]
+                    for row, chunk_file in enumerate(previous["chunk_files"])
+                    if chunk_file == pdf_path.name
+                ]
+            files[pdf_path.name]["pages"] = page_count
+            for chunk in chunks:
+                chunk_titles.append(title)
+                contents.append(chunk)
+                chunk_hashes.append(chunk_sha256(title, chunk))
+                chunk_files.append(pdf_path.name)
+
+        # 2. 既存インデックスにないチャンクのみ埋め込みを並列実行
+        new_rows = [row for row, chunk_hash in enumerate(chunk_hashes) if chunk_hash not in previous_row_by_hash]
+        batches = [new_rows[i:i + EMBEDDING_BATCH_SIZE] for i in range(0, len(new_rows), EMBEDDING_BATCH_SIZE)]
+        embedded_batches = executor.map(embed_batch, [[contents[row] for row in batch] for batch in batches])
+
+        embeddings = np.zeros((len(contents), previous["dim"] if previous else EMBEDDING_DIM), dtype=np.float32)
+        for batch, batch_embeddings in zip(batches, embedded_batches):
+            embeddings[batch] = batch_embeddings
+
+    # 3. 変更のないチャンクは既存の埋め込みを再利用
+    reused_rows = [row for row, chunk_hash in enumerate(chunk_hashes) if chunk_hash in previous_row_by_hash]
+    if reused_rows:
+        embeddings[reused_rows] = previous_embeddings[[previous_row_by_hash[chunk_hashes[row]] for row in reused_rows]]
+
+    # インデックスは全体を書き直す（再利用した埋め込みも含めて新しいファイルに書き込む）
+    LocalVectorIndex.write(index_dir, embeddings, chunk_titles, contents, extra_metadata={
+        "chunk_hashes": chunk_hashes,
+        "chunk_files": chunk_files,
+        "files": files,
+    })
+
+    elapsed = time.perf_counter() - start
+    removed = len(set(previous_row_by_hash) - set(chunk_hashes))
+    return {
+        "files": len(pdf_paths),
+        "changed_files": len(changed_paths),
+        "pages_processed": pages_processed,
+        "total_chunks": len(contents),
+        "embedded_chunks": len(new_rows),
+        "reused_chunks": len(reused_rows),
+        "removed_chunks": removed,
+        "elapsed": elapsed,
+        "pages_per_second": pages_processed / elapsed if elapsed else 0.0,
+        "chunks_per_second": len(new_rows) / elapsed if elapsed else 0.0,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ドキュメントをローカルベクトルインデックスへ差分取り込みする")
+    parser.add_argument("--documents-dir", default=str(Path(__file__).resolve().parent.parent / "documents"))
+    parser.add_argument("--index-dir", default=str(Path(__file__).resolve().parent.parent / "local_index"))
+    parser.add_argument("--workers", type=int, default=None, help="ワーカープロセス数（既定: CPU数）")
+    args = parser.parse_args()
+
+    result = ingest_documents(args.documents_dir, args.index_dir, args.workers)
+    print(f"ファイル数: {result['files']}（変更あり: {result['changed_files']}）")
+    print(f"チャンク数: {result['total_chunks']}（埋め込み: {result['embedded_chunks']}、再利用: {result['reused_chunks']}、削除: {result['removed_chunks']}）")
+    print(f"所要時間: {result['elapsed']:.2f}秒")
+    print(f"スループット: {result['pages_per_second']:.1f} pages/s, {result['chunks_per_second']:.1f} chunks/s")
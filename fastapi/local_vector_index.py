@@ -0,0 +1,213 @@
+# fastapi/local_vector_index.py
+"""documents/*.pdf のローカルベクトルインデックス
+
+ネットワーク接続なしで動作するオフライン検索用のインデックス。
+- 埋め込み: 文字n-gramの特徴量ハッシュによる決定的な埋め込み（同じ入力には常に同じベクトル）
+- 保存形式: float32行列のメモリマップファイル (embeddings.f32) と メタデータ (metadata.json)
+- 検索: 正規化済みベクトルの内積によるコサイン類似度のtop-k
+
+実行例:
+    python local_vector_index.py build --documents-dir ../documents --index-dir ../local_index
+    python local_vector_index.py query --index-dir ../local_index "給与の支給日はいつですか？"
+"""
+import argparse
+import hashlib
+import json
+import math
+import os
+import unicodedata
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+
+EMBEDDING_NAME = "char-ngram-hash-v1"
+EMBEDDING_DIM = 1024
+NGRAM_SIZES = (2, 3)
+# Bedrock Knowledge Baseのチャンキング設定（チャンクサイズ：200、オーバーラップ：10%）に合わせる
+CHUNK_SIZE = 200
+CHUNK_OVERLAP = 20
+
+EMBEDDINGS_FILE = "embeddings.f32"
+METADATA_FILE = "metadata.json"
+
+
+def extract_pdf_pages(pdf_path: str) -> list[str]:
+    """PDFからページごとのテキストを抽出する"""
+    from pypdf import PdfReader
+
+    reader = PdfReader(pdf_path)
+    return [page.extract_text() or "" for page in reader.pages]
+
+
+def chunk_text(text: str, chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> list[str]:
+    """テキストを固定長（文字数）でオーバーラップさせながらチャンク分割する"""
+    text = text.strip()
+    if not text:
+        return []
+
+    step = max(1, chunk_size - overlap)
+    chunks = []
+    for start in range(0, len(text), step):
+        chunk = text[start:start + chunk_size].strip()
+        if chunk:
+            chunks.append(chunk)
+        if start + chunk_size >= len(text):
+            break
+    return chunks
+
+
+def hashing_embedding(texts: list[str], dim: int = EMBEDDING_DIM) -> np.ndarray:
+    """文字n-gramの特徴量ハッシュでテキストを埋め込み、L2正規化したfloat32行列を返す"""
+    matrix = np.zeros((len(texts), dim), dtype=np.float32)
+    for row, text in enumerate(texts):
+        normalized = "".join(unicodedata.normalize("NFKC", text).lower().split())
+        ngram_counts = Counter(
+            normalized[i:i + n]
+            for n in NGRAM_SIZES
+            for i in range(len(normalized) - n + 1)
+        )
+        for ngram, count in ngram_counts.items():
+            digest = hashlib.blake2b(ngram.encode("utf-8"), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], "little") % dim
+            sign = 1.0 if digest[4] & 1 else -1.0
+            # 出現回数は対数で抑える
+            matrix[row, bucket] += sign * (1.0 + math.log(count))
+
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def load_index_metadata(index_dir: str):
+    """インデックスのメタデータを読み込む。インデックスが存在しない場合はNoneを返す"""
+    metadata_path = Path(index_dir) / METADATA_FILE
+    if not metadata_path.exists():
+        return None
+    with open(metadata_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def load_embeddings(index_dir: str, count: int, dim: int) -> np.ndarray:
+    """埋め込み行列をメモリマップで読み込む"""
+    if not count:
+        return np.zeros((0, dim), dtype=np.float32)
+    return np.memmap(Path(index_dir) / EMBEDDINGS_FILE, dtype=np.float32, mode="r", shape=(count, dim))
+
+
+class LocalVectorIndex:
+    """メモリマップしたfloat32行列とメタデータからなるローカルベクトルインデックス"""
+
+    def __init__(self, embeddings: np.ndarray, titles: list[str], title_ids: list[int], contents: list[str], dim: int = EMBEDDING_DIM):
+        self.embeddings = embeddings
+        # タイトルは重複が多いため、タイトル表とその番号で保持する
+        self.titles = titles
+        self.title_ids = np.asarray(title_ids, dtype=np.int32)
+        self.contents = contents
+        self.dim = dim
+
+    def __len__(self):
+        return len(self.contents)
+
+    @classmethod
+    def load(cls, index_dir: str):
+        """インデックスディレクトリから読み込む（埋め込み行列はメモリマップで参照する）"""
+        metadata = load_index_metadata(index_dir)
+        if metadata is None:
+            raise FileNotFoundError(f"インデックスが見つかりません: {index_dir}")
+        if metadata["embedding"] != EMBEDDING_NAME:
+            raise ValueError(f"埋め込み方式が一致しません: {metadata['embedding']}")
+
+        embeddings = load_embeddings(index_dir, metadata["count"], metadata["dim"])
+        return cls(embeddings, metadata["titles"], metadata["title_ids"], metadata["contents"], metadata["dim"])
+
+    @staticmethod
+    def write(index_dir: str, embeddings: np.ndarray, chunk_titles: list[str], contents: list[str], extra_metadata: dict = None):
+        """埋め込み行列とメタデータをインデックスディレクトリに書き込む"""
+        index_path = Path(index_dir)
+        index_path.mkdir(parents=True, exist_ok=True)
+
+        titles = sorted(set(chunk_titles))
+        title_to_id = {title: i for i, title in enumerate(titles)}
+        metadata = {
+            "embedding": EMBEDDING_NAME,
+            "dim": int(embeddings.shape[1]) if embeddings.ndim == 2 else EMBEDDING_DIM,
+            "count": len(contents),
+            "titles": titles,
+            "title_ids": [title_to_id[title] for title in chunk_titles],
+            "contents": contents,
+            **(extra_metadata or {})
+        }
+
+        # 一時ファイルに書き込んでから置き換え、読み込み中のプロセスが壊れたファイルを参照しないようにする
+        embeddings_tmp = index_path / f"{EMBEDDINGS_FILE}.tmp"
+        np.ascontiguousarray(embeddings, dtype=np.float32).tofile(embeddings_tmp)
+        metadata_tmp = index_path / f"{METADATA_FILE}.tmp"
+        with open(metadata_tmp, "w", encoding="utf-8") as f:
+            json.dump(metadata, f, ensure_ascii=False)
+        os.replace(embeddings_tmp, index_path / EMBEDDINGS_FILE)
+        os.replace(metadata_tmp, index_path / METADATA_FILE)
+
+    def search(self, query_text: str, top_k: int = 5) -> list[dict]:
+        """コサイン類似度の上位k件を、検索Lambdaと同じ形式で返す"""
+        if not len(self) or top_k <= 0:
+            return []
+
+        query_vector = hashing_embedding([query_text], self.dim)[0]
+        scores = self.embeddings @ query_vector
+
+        # 全件ソートを避け、上位k件のみを部分ソートで取り出す
+        top_k = min(top_k, len(scores))
+        candidates = np.argpartition(-scores, top_k - 1)[:top_k]
+        ranked = candidates[np.argsort(-scores[candidates])]
+
+        return [
+            {
+                "content": self.contents[i],
+                "metadata": {
+                    "title": self.titles[self.title_ids[i]],
+                    "score": float(scores[i])
+                }
+            }
+            for i in ranked
+        ]
+
+
+def build_local_index(documents_dir: str, index_dir: str) -> int:
+    """documents_dir 内のPDFをチャンク分割・埋め込みしてインデックスを作成し、チャンク数を返す"""
+    chunk_titles = []
+    contents = []
+    for pdf_path in sorted(Path(documents_dir).glob("*.pdf")):
+        # Bedrock Knowledge Baseと同様に、ファイル名をドキュメントのタイトルとする
+        title = unicodedata.normalize("NFC", pdf_path.stem)
+        for page_text in extract_pdf_pages(str(pdf_path)):
+            for chunk in chunk_text(page_text):
+                chunk_titles.append(title)
+                contents.append(chunk)
+
+    embeddings = hashing_embedding(contents) if contents else np.zeros((0, EMBEDDING_DIM), dtype=np.float32)
+    LocalVectorIndex.write(index_dir, embeddings, chunk_titles, contents)
+    return len(contents)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ローカルベクトルインデックスの作成・検索")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser("build", help="PDFからインデックスを作成する")
+    build_parser.add_argument("--documents-dir", default=str(Path(__file__).resolve().parent.parent / "documents"))
+    build_parser.add_argument("--index-dir", default=str(Path(__file__).resolve().parent.parent / "local_index"))
+
+    query_parser = subparsers.add_parser("query", help="インデックスを検索する")
+    query_parser.add_argument("--index-dir", default=str(Path(__file__).resolve().parent.parent / "local_index"))
+    query_parser.add_argument("--top-k", type=int, default=5)
+    query_parser.add_argument("query_text")
+
+    args = parser.parse_args()
+    if args.command == "build":
+        chunk_count = build_local_index(args.documents_dir, args.index_dir)
+        print(f"インデックスを作成しました: {chunk_count}チャンク -> {args.index_dir}")
+    else:
+        index = LocalVectorIndex.load(args.index_dir)
+        for rank, doc in enumerate(index.search(args.query_text, args.top_k), start=1):
+            print(f"{rank}. [{doc['metadata']['title']}] {doc['content'][:80]}")
@@ -0,0 +1,93 @@
+# fastapi/model_router.py
+import threading
+from collections import deque
+
+# 根拠となる情報が見つからない場合の回答（RAGプロンプトのルールで指定している文言）に含まれる語
+DECLINE_MARKER = "関連ドキュメントにはその情報がありません"
+# 複数の情報の比較・理由の説明など、小さいモデルでは回答の質が落ちやすい質問の語
+COMPLEX_QUERY_KEYWORDS = ("違い", "比較", "なぜ", "理由", "すべて", "全て", "一覧", "手順", "場合", "どちら")
+
+ROUTES = ("fast", "strong")
+# 根拠が見つからない旨の回答かを判定するまで保留する範囲（最初の文の区切りと、保留する最大文字数）
+SENTENCE_ENDINGS = "。！？!?\n"
+MAX_PENDING_CHARS = 120
+# 回答の先頭で読み飛ばす引用符・括弧・空白
+LEADING_DECORATIONS = "「『\"'“‘（( 　\n"
+
+
+def is_declined(text: str) -> bool:
+    """LLMが根拠となる情報が見つからないと回答したかを返す"""
+    return DECLINE_MARKER in text
+
+
+def may_become_declined(text: str) -> bool:
+    """ストリーミング途中の回答が、根拠が見つからない旨の回答になる可能性があるかを返す
+
+    引用符で囲まれている場合や前置きがある場合も判定できるよう、先頭の引用符・空白を除いた
+    最初の文が終わるまで（最大 MAX_PENDING_CHARS 文字まで）は可能性があるとみなす。
+    """
+    body = text.lstrip(LEADING_DECORATIONS)
+    if len(body) >= MAX_PENDING_CHARS:
+        return False
+    return not any(ending in body for ending in SENTENCE_ENDINGS)
+
+
+class ModelRouter:
+    """質問の複雑さの簡易的な指標から、回答生成に使用するモデル（fast / strong）を選択する
+
+    質問文の長さ・検索結果の最上位スコア・関連ドキュメント数・会話履歴の長さのいずれかが
+    しきい値を超える場合は strong、それ以外は fast を選択する。
+    fast の回答が「関連ドキュメントにはその情報がありません」の場合は strong で回答し直す（呼び出し側で実施）。
+    """
+
+    def __init__(self, max_query_chars: int = 40, min_top_score: float = 0.6, max_documents: int = 2,
+                 max_history_messages: int = 0, latency_window: int = 1000):
+        self.max_query_chars = max_query_chars
+        self.min_top_score = min_top_score
+        self.max_documents = max_documents
+        self.max_history_messages = max_history_messages
+        # ルートごとの直近の回答生成時間（秒）
+        self._latencies = {route: deque(maxlen=latency_window) for route in ROUTES}
+        self._counters = {route: 0 for route in ROUTES}
+        self._fallbacks = 0
+        self._lock = threading.Lock()
+
+    def choose(self, query: str, document_count: int, top_score: float = None, history_messages: int = 0) -> tuple[str, list[str]]:
+        """使用するルートと、strong を選択した理由のリストを返す（スコアのないバックエンドではスコアを考慮しない）"""
+        reasons = []
+        if len(query.strip()) > self.max_query_chars:
+            reasons.append("long_query")
+        if any(keyword in query for keyword in COMPLEX_QUERY_KEYWORDS):
+            reasons.append("complex_query")
+        if top_score is not None and top_score < self.min_top_score:
+            reasons.append("low_retrieval_score")
+        if document_count > self.max_documents:
+            reasons.append("many_documents")
+        if history_messages > self.max_history_messages:
+            reasons.append("conversation_history")
+        return ("strong" if reasons else "fast"), reasons
+
+    def record(self, route: str, seconds: float):
+        """ルートの回答生成時間を記録する"""
+        with self._lock:
+            self._counters[route] += 1
+            self._latencies[route].append(seconds)
+
+    def record_fallback(self):
+        with self._lock:
+            self._fallbacks += 1
+
+    def stats(self) -> dict:
+        """ルートごとの件数・回答生成時間と、strong への切り替え回数を返す"""
+        with self._lock:
+            routes = {}
+            for route in ROUTES:
+                latencies = sorted(self._latencies[route])
+                routes[route] = {"count": self._counters[route]}
+                if latencies:
+                    routes[route].update({
+                        "avg_ms": sum(latencies) / len(latencies) * 1000,
+                        "p50_ms": latencies[len(latencies) // 2] * 1000,
+                        "p95_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000,
+                    })
+            return {"routes": routes, "fallbacks": self._fallbacks}
@@ -0,0 +1,178 @@
+# fastapi/prompt_builder.py
+import hashlib
+import re
+from collections import OrderedDict
+
+# CJK文字（ひらがな・カタカナ・漢字・全角記号）は1文字≒1トークン、それ以外は4文字≒1トークンとして概算する
+_CJK_PATTERN = re.compile(r"[　-ヿ㐀-䶿一-鿿豈-﫿＀-￯]")
+# 要約時に1発言から残す最大文字数
+_SUMMARY_USER_CHARS = 60
+_SUMMARY_ASSISTANT_CHARS = 80
+
+
+def estimate_tokens(text: str) -> int:
+    """テキストのトークン数を概算する（ローカルでトークナイザーを使わずに高速に見積もるため）"""
+    if not text:
+        return 0
+    cjk_count = len(_CJK_PATTERN.findall(text))
+    return cjk_count + (len(text) - cjk_count + 3) // 4
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """推定トークン数が上限に収まるよう、テキストの先頭から切り詰める"""
+    if max_tokens <= 0:
+        return ""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    # 二分探索で上限に収まる最大の文字数を求める
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if estimate_tokens(text[:middle]) <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    return text[:low]
+
+
+def format_message(message: dict) -> str:
+    """会話履歴の1件を「ユーザー: ...」形式の行に整形する"""
+    if message.get("role") == "user":
+        return f"ユーザー: {message['content']}"
+    if message.get("role") == "assistant":
+        return f"アシスタント: {message['content']}"
+    return ""
+
+
+def compress_message(message: dict) -> str:
+    """要約用に1件の発言を短く圧縮する（質問は先頭、回答は最初の文のみを残す）"""
+    content = " ".join(message.get("content", "").split())
+    if message.get("role") == "user":
+        return f"ユーザー: {content[:_SUMMARY_USER_CHARS]}"
+    if message.get("role") == "assistant":
+        first_sentence = content.split("。")[0]
+        return f"アシスタント: {first_sentence[:_SUMMARY_ASSISTANT_CHARS]}"
+    return ""
+
+
+class RollingSummary:
+    """セッションごとに古い会話の要約をキャッシュし、新たに古くなった発言のみを追加で圧縮する"""
+
+    def __init__(self, max_sessions: int = 1000):
+        self.max_sessions = max_sessions
+        # session_id -> (要約済みの発言数, 最後に要約した発言のハッシュ, 要約の行リスト)
+        self._summaries = OrderedDict()
+
+    def summarize(self, session_id, old_messages: list[dict]) -> str:
+        """古い発言の要約を返す"""
+        if not old_messages:
+            return ""
+
+        cached = self._summaries.get(session_id) if session_id else None
+        lines = []
+        start = 0
+        if cached is not None:
+            summarized_count, last_hash, cached_lines = cached
+            # 前回要約した範囲が変わっていない場合のみ差分を追加する（履歴の先頭が削除された場合は作り直す）
+            if summarized_count <= len(old_messages) and _message_hash(old_messages[summarized_count - 1]) == last_hash:
+                lines = list(cached_lines)
+                start = summarized_count
+
+        lines.extend(line for line in (compress_message(message) for message in old_messages[start:]) if line)
+
+        if session_id:
+            self._summaries[session_id] = (len(old_messages), _message_hash(old_messages[-1]), lines)
+            self._summaries.move_to_end(session_id)
+            while len(self._summaries) > self.max_sessions:
+                self._summaries.popitem(last=False)
+        return "\n".join(lines)
+
+
+class PromptBuilder:
+    """固定のトークン予算をルール・関連ドキュメント・会話履歴に配分してプロンプトの各セクションを作成する"""
+
+    def __init__(self, max_prompt_tokens: int = 4000, max_history_tokens: int = 1000, recent_messages: int = 6):
+        self.max_prompt_tokens = max_prompt_tokens
+        self.max_history_tokens = max_history_tokens
+        # 要約せずにそのまま残す直近の発言数
+        self.recent_messages = recent_messages
+        self.rolling_summary = RollingSummary()
+
+    def build_sections(self, rules_text: str, query: str, documents: list[str], messages_history=None, session_id=None):
+        """(関連ドキュメント, 過去の会話, セクションごとの推定トークン数) を返す"""
+        rules_tokens = estimate_tokens(rules_text)
+        query_tokens = estimate_tokens(query)
+        available = max(0, self.max_prompt_tokens - rules_tokens - query_tokens)
+
+        # 会話履歴は上限内で確保し、残りを関連ドキュメントに割り当てる
+        past_conversation, summary_tokens, recent_tokens = self._build_history(
+            messages_history, session_id, min(self.max_history_tokens, available)
+        )
+        history_tokens = estimate_tokens(past_conversation)
+        context = self._build_context(documents, available - history_tokens)
+        context_tokens = estimate_tokens(context)
+
+        section_tokens = {
+            "rules": rules_tokens,
+            "context": context_tokens,
+            "history_summary": summary_tokens,
+            "history_recent": recent_tokens,
+            "query": query_tokens,
+            "total": rules_tokens + context_tokens + history_tokens + query_tokens,
+        }
+        return context, past_conversation, section_tokens
+
+    def _build_context(self, documents: list[str], budget: int) -> str:
+        """検索順位の高いドキュメントから予算内で結合する（予算を超える場合は末尾を切り詰める）"""
+        selected = []
+        remaining = budget
+        for document in documents:
+            document_tokens = estimate_tokens(document) + 1
+            if document_tokens <= remaining:
+                selected.append(document)
+                remaining -= document_tokens
+                continue
+            # 途中で切れた短すぎる断片は根拠として役に立たないため含めない
+            if remaining >= 50:
+                selected.append(truncate_to_tokens(document, remaining - 1))
+            break
+        return "\n".join(selected)
+
+    def _build_history(self, messages_history, session_id, budget: int) -> tuple[str, int, int]:
+        """直近の発言はそのまま、それより古い発言は要約して予算内の会話履歴を作成する"""
+        messages = [message for message in (messages_history or []) if message.get("role") in ("user", "assistant")]
+        if not messages or budget <= 0:
+            return "", 0, 0
+
+        # 直近の発言を新しい順に予算内で採用する
+        recent_lines = []
+        remaining = budget
+        split_index = len(messages)
+        for index in range(len(messages) - 1, max(-1, len(messages) - 1 - self.recent_messages), -1):
+            line = format_message(messages[index])
+            line_tokens = estimate_tokens(line) + 1
+            if line_tokens > remaining:
+                break
+            recent_lines.insert(0, line)
+            remaining -= line_tokens
+            split_index = index
+
+        # 残りの古い発言は要約し、予算に収まるよう新しい側を残して切り詰める
+        summary = self.rolling_summary.summarize(session_id, messages[:split_index])
+        if summary and estimate_tokens(summary) > remaining:
+            summary_lines = summary.split("\n")
+            while summary_lines and estimate_tokens("\n".join(summary_lines)) > remaining:
+                summary_lines.pop(0)
+            summary = "\n".join(summary_lines)
+
+        recent_text = "\n".join(recent_lines)
+        parts = []
+        if summary:
+            parts.append(f"これまでの会話の要約:\n{summary}")
+        if recent_text:
+            parts.append(f"過去の会話:\n{recent_text}")
+        return "\n\n".join(parts), estimate_tokens(summary), estimate_tokens(recent_text)
+
+
+def _message_hash(message: dict) -> str:
+    return hashlib.sha1(f"{message.get('role')}\0{message.get('content')}".encode("utf-8")).hexdigest()
@@ -0,0 +1,133 @@
+# fastapi/request_metrics.py
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+# レイテンシのヒストグラムのバケット境界（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# 処理中のリクエストのステージタイマー（ヘルパー関数の引数を変えずに計測するため、コンテキスト変数で受け渡す）
+_current_timer = contextvars.ContextVar("stage_timer", default=None)
+
+
+class Histogram:
+    """Prometheus形式のヒストグラム（ラベルの組み合わせごとにバケットの件数・合計・件数を保持）"""
+
+    def __init__(self, name: str, description: str, label_names: tuple, buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self.buckets = tuple(sorted(buckets))
+        # ラベル値のタプル -> {"counts": バケットごとの件数, "sum": 合計, "count": 件数}
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        with self._lock:
+            series = self._series.setdefault(key, {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0})
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series["counts"][index] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def render(self) -> list[str]:
+        """Prometheusのテキスト形式の行を返す（バケットは累積件数）"""
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                labels = ",".join(f'{name}="{_escape_label(value)}"' for name, value in zip(self.label_names, key))
+                cumulative = 0
+                for bound, count in zip(self.buckets, series["counts"]):
+                    cumulative += count
+                    lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {series["count"]}')
+                lines.append(f"{self.name}_sum{{{labels}}} {series['sum']}")
+                lines.append(f"{self.name}_count{{{labels}}} {series['count']}")
+        return lines
+
+
+# リクエスト全体とステージごとの処理時間
+request_duration = Histogram(
+    "chat_request_duration_seconds", "リクエスト全体の処理時間（レスポンスヘッダー送信まで）", ("path", "method", "status")
+)
+stage_duration = Histogram(
+    "chat_stage_duration_seconds", "リクエスト内のステージごとの処理時間", ("path", "stage")
+)
+# AWS呼び出し用スレッドプールの実行待ち時間
+io_pool_wait = Histogram(
+    "aws_io_pool_wait_seconds", "AWS呼び出し用スレッドプールでタスクの実行開始までに待機した時間", ("pool",)
+)
+
+
+class StageTimer:
+    """1件のリクエスト内のステージごとの処理時間を記録する（同じステージを複数回計測した場合は合算）"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.started_at = time.perf_counter()
+        # ステージ名 -> 処理時間（秒）（記録順）
+        self.durations = {}
+        # 複数の処理を並行して計測する場合（/chat/batch）はTrue
+        # ステージの処理時間は各処理の合計となり、リクエスト全体の処理時間を超えることがある
+        self.summed = False
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, seconds: float):
+        with self._lock:
+            self.durations[stage] = self.durations.get(stage, 0.0) + seconds
+        stage_duration.observe(seconds, path=self.path, stage=stage)
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started_at
+
+    def durations_ms(self) -> dict:
+        with self._lock:
+            return {stage: round(seconds * 1000, 1) for stage, seconds in self.durations.items()}
+
+    def server_timing(self) -> str:
+        """Server-Timingヘッダーの値を返す（例: retrieval;dur=120.5, llm;dur=830.2, total;dur=960.0）
+
+        並行した処理の合計の場合は、ステージに desc="sum" を付ける。
+        """
+        desc = ';desc="sum"' if self.summed else ""
+        entries = [f"{stage}{desc};dur={duration_ms}" for stage, duration_ms in self.durations_ms().items()]
+        entries.append(f"total;dur={round(self.elapsed() * 1000, 1)}")
+        return ", ".join(entries)
+
+
+def start_request_timer(path: str) -> StageTimer:
+    """リクエストのステージタイマーを作成し、現在のコンテキストに設定する"""
+    timer = StageTimer(path)
+    _current_timer.set(timer)
+    return timer
+
+
+def current_timer():
+    """処理中のリクエストのステージタイマーを返す（リクエスト外の場合はNone）"""
+    return _current_timer.get()
+
+
+@contextmanager
+def stage(name: str):
+    """with文のブロックの処理時間を、処理中のリクエストのステージとして記録する"""
+    timer = _current_timer.get()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timer is not None:
+            timer.record(name, time.perf_counter() - start)
+
+
+def render_metrics() -> str:
+    """全ヒストグラムをPrometheusのテキスト形式で返す"""
+    lines = request_duration.render() + stage_duration.render() + io_pool_wait.render()
+    return "\n".join(lines) + "\n"
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
@@ -0,0 +1,204 @@
+# fastapi/resilient_retrieval.py
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+from answer_cache import normalize_query
+from retrieval_backends import RetrievalBackend
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitBreaker:
+    """連続した失敗が続くバックエンドへの呼び出しを一定時間止めるサーキットブレーカー
+
+    closed: 通常どおり呼び出す / open: 呼び出さない / half_open: 試行の1件のみ呼び出し、結果で closed・open に戻す
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_seconds: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        # half_open の試行の開始時刻（試行が戻らない場合も reset_seconds 後には次の試行を許可する）
+        self._trial_started_at = None
+        self._counters = {"opened": 0}
+
+    def allow(self) -> bool:
+        """バックエンドを呼び出してよいかを返す"""
+        now = time.monotonic()
+        if self.state == "open":
+            if now - self._opened_at < self.reset_seconds:
+                return False
+            self.state = "half_open"
+            self._trial_started_at = None
+        if self.state == "half_open":
+            if self._trial_started_at is not None and now - self._trial_started_at < self.reset_seconds:
+                return False
+            self._trial_started_at = now
+        return True
+
+    def record_success(self):
+        self.state = "closed"
+        self._failures = 0
+        self._trial_started_at = None
+
+    def record_failure(self):
+        self._failures += 1
+        if self.state == "half_open" or self._failures >= self.failure_threshold:
+            if self.state != "open":
+                self._counters["opened"] += 1
+                logger.warning(f"ナレッジ検索のサーキットブレーカーを開きました（連続失敗: {self._failures}回）")
+            self.state = "open"
+            self._opened_at = time.monotonic()
+            self._trial_started_at = None
+
+    def stats(self) -> dict:
+        return {"state": self.state, "consecutive_failures": self._failures, **self._counters}
+
+
+class ResilientRetrievalBackend(RetrievalBackend):
+    """検索バックエンドを期限付き・ヘッジ付きで呼び出し、失敗時は質問ごとの前回の検索結果で代替するラッパー
+
+    - 検索は deadline_seconds で打ち切る
+    - 検索時間が直近のp95を超えた場合は、同じ検索をもう1件並行して実行し、先に返った結果を使用する
+      （実行中のヘッジが max_hedges_in_flight 件に達している場合は追加しない）
+    - 失敗・期限超過が続く場合はサーキットブレーカーでバックエンドの呼び出しを止める
+    - 失敗・期限超過・ブレーカーが開いている場合は、同じ質問の前回成功時の検索結果（なければ空）を返す
+    """
+
+    def __init__(self, backend: RetrievalBackend, deadline_seconds: float = 5.0, hedging: bool = True,
+                 hedge_percentile: float = 0.95, hedge_min_samples: int = 20, breaker: CircuitBreaker = None,
+                 last_good_max_entries: int = 1000, max_hedges_in_flight: int = 4):
+        super().__init__()
+        self.backend = backend
+        self.name = backend.name
+        self.deadline_seconds = deadline_seconds
+        self.hedging = hedging
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.breaker = breaker or CircuitBreaker()
+        self.last_good_max_entries = last_good_max_entries
+        self.max_hedges_in_flight = max_hedges_in_flight
+        # 実行中のヘッジの件数（使用しなかったヘッジも、バックエンドの呼び出しが完了するまで数える）
+        self._hedges_in_flight = 0
+        # 正規化した質問文 -> 前回成功時の検索結果（LRU）
+        self._last_good = OrderedDict()
+        self._counters = {
+            "hedged": 0, "hedge_wins": 0, "hedges_skipped": 0, "deadline_exceeded": 0, "failures": 0,
+            "short_circuited": 0, "fallbacks": 0, "fallback_misses": 0
+        }
+
+    async def _retrieve(self, query_text: str) -> list[dict]:
+        key = normalize_query(query_text)
+        if not self.breaker.allow():
+            self._counters["short_circuited"] += 1
+            return self._fallback(key, "サーキットブレーカーが開いています")
+
+        try:
+            documents = await self._retrieve_within_deadline(query_text)
+        except asyncio.TimeoutError:
+            self._counters["deadline_exceeded"] += 1
+            self.breaker.record_failure()
+            return self._fallback(key, f"検索が{self.deadline_seconds}秒以内に完了しませんでした")
+        except Exception as e:
+            self._counters["failures"] += 1
+            self.breaker.record_failure()
+            return self._fallback(key, f"検索に失敗しました: {e}")
+
+        self.breaker.record_success()
+        if documents:
+            self._last_good[key] = documents
+            self._last_good.move_to_end(key)
+            while len(self._last_good) > self.last_good_max_entries:
+                self._last_good.popitem(last=False)
+        return documents
+
+    def hedge_delay(self):
+        """2件目の検索を開始するまでの待ち時間（秒）を返す（ヘッジしない場合はNone）"""
+        if not self.hedging:
+            return None
+        delay = self.backend.latency_percentile(self.hedge_percentile, self.hedge_min_samples)
+        if delay is None or delay >= self.deadline_seconds:
+            return None
+        return delay
+
+    async def _retrieve_within_deadline(self, query_text: str) -> list[dict]:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.deadline_seconds
+        tasks = [asyncio.create_task(self.backend.retrieve(query_text))]
+        try:
+            hedge_delay = self.hedge_delay()
+            if hedge_delay is not None:
+                done, _ = await asyncio.wait(tasks, timeout=hedge_delay)
+                if not done and self._hedges_in_flight >= self.max_hedges_in_flight:
+                    # 停止したバックエンドへのヘッジでスレッドプールを使い切らないよう、上限を超えて追加しない
+                    self._counters["hedges_skipped"] += 1
+                elif not done:
+                    self._counters["hedged"] += 1
+                    logger.info(f"検索がp95（{hedge_delay * 1000:.0f}ms）を超えたため、2件目の検索を開始します")
+                    tasks.append(self._start_hedge(query_text))
+
+            # 先に成功した検索結果を使用する（一方が失敗した場合はもう一方を待つ）
+            pending = set(tasks)
+            last_error = None
+            while pending:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not tasks[0]:
+                            self._counters["hedge_wins"] += 1
+                        return task.result()
+                    last_error = task.exception()
+            if pending:
+                raise asyncio.TimeoutError()
+            raise last_error
+        finally:
+            # 不要になった検索はキャンセルする（スレッドで実行中のAWS呼び出しは完了まで続く）
+            # ヘッジは実行中の件数を正しく数えるため、キャンセルせずにバックエンドの呼び出しの完了を待たせる
+            primary = tasks[0]
+            if not primary.done():
+                primary.cancel()
+            elif not primary.cancelled():
+                # 使用しなかった検索の例外を取得済みにする（未取得の例外の警告を防ぐ）
+                primary.exception()
+
+    def _start_hedge(self, query_text: str) -> asyncio.Task:
+        """2件目の検索を開始し、完了するまで実行中のヘッジとして数える"""
+        self._hedges_in_flight += 1
+        task = asyncio.create_task(self.backend.retrieve(query_text))
+
+        def on_done(task):
+            self._hedges_in_flight -= 1
+            if not task.cancelled():
+                # 使用しなかったヘッジの例外を取得済みにする（未取得の例外の警告を防ぐ）
+                task.exception()
+
+        task.add_done_callback(on_done)
+        return task
+
+    def _fallback(self, key: str, reason: str) -> list[dict]:
+        documents = self._last_good.get(key)
+        if documents is None:
+            self._counters["fallback_misses"] += 1
+            logger.warning(f"{reason}（前回の検索結果がないため、関連ドキュメントなしで回答します）")
+            return []
+        self._counters["fallbacks"] += 1
+        logger.warning(f"{reason}（前回の検索結果を使用します）")
+        return list(documents)
+
+    def stats(self) -> dict:
+        """ラッパー全体の検索時間に加え、バックエンドの呼び出しごとの検索時間・ブレーカーの状態を返す"""
+        return {
+            **super().stats(),
+            "attempts": self.backend.stats(),
+            "breaker": self.breaker.stats(),
+            "last_good_entries": len(self._last_good),
+            "hedges_in_flight": self._hedges_in_flight,
+            **self._counters,
+        }
@@ -0,0 +1,206 @@
+# fastapi/retrieval_backends.py
+import asyncio
+import json
+import logging
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class RetrievalError(Exception):
+    """ナレッジ検索バックエンドが検索結果を返せなかったことを表す例外"""
+
+
+class RetrievalBackend:
+    """ナレッジ検索バックエンドの基底クラス
+
+    retrieve() は Lambda関数 (bedrock_kb_search_function.lambda_handler) と同じ
+    {"content": ..., "metadata": {"title": ..., "score": ...}} 形式の関連ドキュメントのリストを
+    スコアの高い順に返す（スコアを持たないバックエンドでは score を省略する）。
+    """
+
+    name = "base"
+
+    def __init__(self, latency_window: int = 1000):
+        # 直近の検索時間（秒）を保持し、バックエンドごとのレイテンシを計測する
+        self._latencies = deque(maxlen=latency_window)
+        self._errors = 0
+
+    async def retrieve(self, query_text: str) -> list[dict]:
+        """関連ドキュメントを検索し、検索時間を記録する"""
+        start = time.perf_counter()
+        try:
+            return await self._retrieve(query_text)
+        except Exception:
+            self._errors += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            self._latencies.append(elapsed)
+            logger.info(f"ナレッジ検索 ({self.name}) の所要時間: {elapsed * 1000:.1f}ms")
+
+    async def _retrieve(self, query_text: str) -> list[dict]:
+        raise NotImplementedError
+
+    def latency_percentile(self, percentile: float, min_samples: int = 1):
+        """直近の検索時間のパーセンタイル（秒）を返す（件数が min_samples 未満の場合はNone）"""
+        latencies = sorted(self._latencies)
+        if len(latencies) < max(1, min_samples):
+            return None
+        return latencies[min(len(latencies) - 1, int(len(latencies) * percentile))]
+
+    def stats(self) -> dict:
+        """検索時間の統計情報を返す"""
+        latencies = sorted(self._latencies)
+        if not latencies:
+            return {"backend": self.name, "count": 0, "errors": self._errors}
+        return {
+            "backend": self.name,
+            "count": len(latencies),
+            "errors": self._errors,
+            "avg_ms": sum(latencies) / len(latencies) * 1000,
+            "p50_ms": latencies[len(latencies) // 2] * 1000,
+            "p95_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000,
+        }
+
+
+class LambdaRetrievalBackend(RetrievalBackend):
+    """検索Lambda関数を経由するバックエンド（従来の構成）"""
+
+    name = "lambda"
+
+    def __init__(self, invoke_function, options: dict = None):
+        super().__init__()
+        # payloadを受け取り、Lambda関数のbodyをデコードした辞書を返すコルーチン関数
+        self.invoke_function = invoke_function
+        # 検索件数・スコアによる絞り込みの設定（number_of_results, score_threshold など。payloadにそのまま含める）
+        self.options = options or {}
+
+    async def _retrieve(self, query_text: str) -> list[dict]:
+        response = await self.invoke_function({"query_text": query_text, **self.options})
+        if "error" in response:
+            logger.error(f"Lambda関数による検索に失敗しました: {response}")
+            raise RetrievalError(response.get("error"))
+        related_documents = response.get("related_documents", [])
+        if "retrieved_count" in response:
+            logger.info(f"Lambda関数の検索結果件数: {len(related_documents)}/{response['retrieved_count']}件")
+        return related_documents
+
+
+class BedrockKnowledgeBaseBackend(RetrievalBackend):
+    """Lambda関数を経由せず、Bedrock Knowledge Base の retrieve APIを直接呼び出すバックエンド"""
+
+    name = "bedrock"
+
+    def __init__(self, client, knowledge_base_id: str, number_of_results: int = 5, executor=None):
+        super().__init__()
+        self.client = client
+        self.knowledge_base_id = knowledge_base_id
+        self.number_of_results = number_of_results
+        # boto3は同期APIのため、指定したスレッドプール（Noneの場合は既定のプール）で実行する
+        self.executor = executor
+
+    async def _retrieve(self, query_text: str) -> list[dict]:
+        loop = asyncio.get_running_loop()
+        response = await loop.run_in_executor(
+            self.executor,
+            lambda: self.client.retrieve(
+                knowledgeBaseId=self.knowledge_base_id,
+                retrievalQuery={
+                    "text": query_text
+                },
+                retrievalConfiguration={
+                    "vectorSearchConfiguration": {
+                        "numberOfResults": self.number_of_results
+                    }
+                }
+            )
+        )
+
+        # Lambda関数と同じ形式に整形
+        document_contents = []
+        for result in response.get("retrievalResults", []):
+            document_contents.append({
+                "content": result.get("content", {}).get("text", ""),
+                "metadata": {
+                    "title": result.get("metadata", {}).get("title", "不明なドキュメント"),
+                    "score": result.get("score")
+                }
+            })
+        return document_contents
+
+
+class InMemoryRetrievalBackend(RetrievalBackend):
+    """メモリ上のドキュメントから文字バイグラムの一致度で検索するバックエンド（ローカル開発・テスト用）"""
+
+    name = "memory"
+
+    def __init__(self, documents: list[dict], number_of_results: int = 5):
+        super().__init__()
+        self.documents = documents
+        self.number_of_results = number_of_results
+        self._document_bigrams = [_bigrams(doc.get("content", "")) for doc in documents]
+
+    async def _retrieve(self, query_text: str) -> list[dict]:
+        query_bigrams = _bigrams(query_text)
+        if not query_bigrams:
+            return []
+
+        scored = []
+        for doc, doc_bigrams in zip(self.documents, self._document_bigrams):
+            score = len(query_bigrams & doc_bigrams) / len(query_bigrams)
+            if score > 0:
+                scored.append((score, doc))
+        scored.sort(key=lambda item: item[0], reverse=True)
+        return [
+            {**doc, "metadata": {**doc.get("metadata", {}), "score": score}}
+            for score, doc in scored[:self.number_of_results]
+        ]
+
+    @classmethod
+    def from_json_file(cls, path: str, number_of_results: int = 5):
+        """関連ドキュメント形式のリストを格納したJSONファイルから作成する"""
+        with open(path, "r", encoding="utf-8") as f:
+            documents = json.load(f)
+        return cls(documents, number_of_results)
+
+
+class LocalIndexRetrievalBackend(RetrievalBackend):
+    """ローカルベクトルインデックス (local_vector_index.LocalVectorIndex) で検索するバックエンド"""
+
+    name = "local_index"
+
+    def __init__(self, index, number_of_results: int = 5):
+        super().__init__()
+        self.index = index
+        self.number_of_results = number_of_results
+
+    async def _retrieve(self, query_text: str) -> list[dict]:
+        # 数百〜数千チャンク程度の行列演算は十分に高速なため、イベントループ上で実行する
+        return self.index.search(query_text, self.number_of_results)
+
+
+def select_documents(documents: list[dict], score_threshold: float = 0.0, relative_score_cutoff: float = 0.0,
+                     min_results: int = 1) -> list[dict]:
+    """スコアの高い順に並んだ関連ドキュメントから、回答に必要な上位のチャンクのみを返す
+
+    上位 min_results 件は常に残し、それ以降はスコアが score_threshold 未満、または
+    最上位のスコア × relative_score_cutoff 未満になった時点で打ち切る（検索Lambdaの select_documents と同じ規則）。
+    スコアのないドキュメントは絞り込まない。
+    """
+    top_score = documents[0].get("metadata", {}).get("score") if documents else None
+    selected = []
+    for document in documents:
+        score = document.get("metadata", {}).get("score")
+        if len(selected) >= min_results and score is not None and top_score is not None:
+            if score < score_threshold or score < top_score * relative_score_cutoff:
+                break
+        selected.append(document)
+    return selected
+
+
+def _bigrams(text: str) -> set:
+    """空白を除いた文字バイグラムの集合を返す（日本語は単語区切りがないため）"""
+    compact = "".join(text.split())
+    return {compact[i:i + 2] for i in range(len(compact) - 1)}
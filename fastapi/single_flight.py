@@ -0,0 +1,46 @@
+# fastapi/single_flight.py
+import asyncio
+
+
+class SingleFlight:
+    """同じキーの処理が実行中の場合は新たに実行せず、実行中の処理の結果を共有する
+
+    処理は独立したタスクとして実行するため、最初に呼び出したリクエストが切断されても
+    待機中の他のリクエストには結果が返る。
+    """
+
+    def __init__(self):
+        # キー -> 実行中のタスク
+        self._in_flight = {}
+        self._counters = {"executions": 0, "saved_calls": 0, "errors": 0}
+
+    async def do(self, key, func):
+        """key の処理が実行中であればその結果を待ち、なければ func() を実行して結果を返す
+
+        戻り値は (結果, 他のリクエストの結果を共有したか) のタプル。
+        """
+        task = self._in_flight.get(key)
+        shared = task is not None
+        if shared:
+            self._counters["saved_calls"] += 1
+        else:
+            self._counters["executions"] += 1
+            task = asyncio.create_task(func())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+        # 呼び出し元のキャンセルで共有中のタスクがキャンセルされないよう保護する
+        return await asyncio.shield(task), shared
+
+    def is_in_flight(self, key) -> bool:
+        """key の処理が実行中か（do() を呼び出すと結果を共有するか）を返す"""
+        return key in self._in_flight
+
+    def _finish(self, key, task: asyncio.Task):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        if task.cancelled() or task.exception() is not None:
+            self._counters["errors"] += 1
+
+    def stats(self) -> dict:
+        """実行回数・共有により省略した回数などの統計情報を返す"""
+        return {**self._counters, "in_flight": len(self._in_flight)}
@@ -1,8 +1,14 @@
 # lambda_functions/document_search/bedrock_kb_search_function.py
 import json
 import os
+import time
+import random
+import hashlib
+from collections import OrderedDict
+from contextlib import contextmanager
 from aws_lambda_powertools import Logger
 import boto3
+from botocore.config import Config
 
 # ロガーの初期化
 logger = Logger()
@@ -10,11 +16,248 @@ logger = Logger()
 # 環境変数から設定を取得
 AWS_REGION = os.environ.get("AWS_REGION")
 BEDROCK_KB_ID = os.environ.get("BEDROCK_KB_ID")
+BEDROCK_KB_DATA_SOURCE_ID = os.environ.get("BEDROCK_KB_DATA_SOURCE_ID")
+# 検索件数（イベントの number_of_results で上書き可能、上限は MAX_NUMBER_OF_RESULTS）
+NUMBER_OF_RESULTS = int(os.environ.get("NUMBER_OF_RESULTS", "5"))
+MAX_NUMBER_OF_RESULTS = int(os.environ.get("MAX_NUMBER_OF_RESULTS", "10"))
+# 関連度スコアによる絞り込み（イベントの同名のキーで上書き可能）
+# score_threshold: このスコア未満のチャンクは返さない
+# relative_score_cutoff: 最上位のスコアに対するこの割合未満のチャンクは返さない（0の場合は無効）
+# min_results: スコアに関わらず返す上位の件数
+SCORE_THRESHOLD = float(os.environ.get("RETRIEVAL_SCORE_THRESHOLD", "0"))
+RELATIVE_SCORE_CUTOFF = float(os.environ.get("RETRIEVAL_RELATIVE_SCORE_CUTOFF", "0"))
+MIN_RESULTS = int(os.environ.get("RETRIEVAL_MIN_RESULTS", "1"))
+# 受信イベントをログ出力する割合（0.0〜1.0）
+EVENT_LOG_SAMPLE_RATE = float(os.environ.get("EVENT_LOG_SAMPLE_RATE", "0.01"))
 
-@logger.inject_lambda_context(log_event=True)
+# AWSクライアントの設定
+# ウォーム起動間で接続を再利用するため、キープアライブを有効化
+boto3_config = Config(
+    tcp_keepalive=True,
+    connect_timeout=int(os.environ.get("BEDROCK_CONNECT_TIMEOUT", "5")),
+    read_timeout=int(os.environ.get("BEDROCK_READ_TIMEOUT", "30")),
+    retries={
+        "max_attempts": 3,
+        "mode": "standard"
+    }
+)
+
+# Bedrock Knowledge Baseクライアントの初期化
+# モジュール初期化時（コールドスタート時）に一度だけ作成し、認証情報の解決もここで済ませる
+bedrock_kb_client = boto3.client("bedrock-agent-runtime", region_name=AWS_REGION, config=boto3_config)
+# 同期マーカー取得用のクライアント（データソースIDが設定されている場合のみ作成）
+bedrock_agent_client = boto3.client("bedrock-agent", region_name=AWS_REGION, config=boto3_config) if BEDROCK_KB_DATA_SOURCE_ID else None
+
+# 検索結果キャッシュの設定
+# ウォームコンテナ内で同一クエリの検索結果を再利用し、Knowledge Base APIの呼び出しを省略する
+# ナレッジベースの同期を検知できない場合に同期前の検索結果を返さないよう、キャッシュは同期マーカーの取得元
+# （BEDROCK_KB_DATA_SOURCE_ID、またはデプロイ時に同期ごとに更新する BEDROCK_KB_SYNC_MARKER）がある場合のみ有効にする
+BEDROCK_KB_SYNC_MARKER = os.environ.get("BEDROCK_KB_SYNC_MARKER")
+RETRIEVAL_CACHE_ENABLED = os.environ.get("RETRIEVAL_CACHE_ENABLED", "true").lower() == "true" and bool(
+    BEDROCK_KB_DATA_SOURCE_ID or BEDROCK_KB_SYNC_MARKER
+)
+RETRIEVAL_CACHE_MAX_ENTRIES = int(os.environ.get("RETRIEVAL_CACHE_MAX_ENTRIES", "256"))
+RETRIEVAL_CACHE_TTL_SECONDS = float(os.environ.get("RETRIEVAL_CACHE_TTL_SECONDS", "3600"))
+# 例: /tmp/retrieval_cache（エントリごとに1ファイルで保存する。未設定の場合はメモリ上のみで保持）
+RETRIEVAL_CACHE_PERSIST_DIR = os.environ.get("RETRIEVAL_CACHE_PERSIST_DIR")
+# データソースの同期状況を確認する間隔（秒）
+# 確認結果はこの間隔の間は再利用するため、同期の完了後も最大でこの秒数は同期前の検索結果を返す可能性がある
+KB_SYNC_MARKER_CHECK_SECONDS = float(os.environ.get("KB_SYNC_MARKER_CHECK_SECONDS", "60"))
+
+
+class RetrievalCache:
+    """検索結果のLRUキャッシュ（ナレッジベースの同期マーカーでバージョン管理）
+
+    persist_dir を指定した場合はエントリごとに1ファイルで保存し、保存・削除のたびにキャッシュ全体を書き直さない。
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float, persist_dir: str = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.persist_dir = persist_dir
+        # key -> {"sync_marker", "stored_at", "documents"}
+        self._entries = OrderedDict()
+        self._load()
+
+    @staticmethod
+    def make_key(query_text: str, knowledge_base_id: str, number_of_results: int) -> str:
+        """クエリテキスト・ナレッジベースID・取得件数からキャッシュキーを作成する"""
+        raw_key = json.dumps([knowledge_base_id, number_of_results, query_text], ensure_ascii=False)
+        return hashlib.sha256(raw_key.encode("utf-8")).hexdigest()
+
+    def get(self, key: str, sync_marker: str):
+        """同期マーカーが一致し、有効期限内の検索結果を返す。該当しない場合はNoneを返す"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        # 同期後の古いチャンクや期限切れの結果は返さない
+        if entry["sync_marker"] != sync_marker or time.time() - entry["stored_at"] > self.ttl_seconds:
+            del self._entries[key]
+            self._remove(key)
+            return None
+
+        self._entries.move_to_end(key)
+        return entry["documents"]
+
+    def put(self, key: str, sync_marker: str, documents: list):
+        """検索結果を保存する"""
+        self._entries[key] = {
+            "sync_marker": sync_marker,
+            "stored_at": time.time(),
+            "documents": documents
+        }
+        self._entries.move_to_end(key)
+
+        # 上限を超えた場合は最も古く使われたエントリを削除
+        while len(self._entries) > self.max_entries:
+            evicted_key, _ = self._entries.popitem(last=False)
+            self._remove(evicted_key)
+
+        self._persist(key)
+
+    def _load(self):
+        """永続化ディレクトリからキャッシュを読み込む（保存時刻の古い順に並べる）"""
+        if not self.persist_dir or not os.path.isdir(self.persist_dir):
+            return
+        entries = []
+        for file_name in os.listdir(self.persist_dir):
+            if not file_name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.persist_dir, file_name), "r", encoding="utf-8") as f:
+                    entries.append((file_name[:-len(".json")], json.load(f)))
+            except Exception as e:
+                logger.warning(f"検索結果キャッシュの読み込みに失敗しました: {file_name}: {e}")
+        entries.sort(key=lambda item: item[1]["stored_at"])
+        self._entries = OrderedDict(entries[-self.max_entries:])
+        for key, _ in entries[:-self.max_entries]:
+            self._remove(key)
+        logger.info(f"検索結果キャッシュを読み込みました: {len(self._entries)}件")
+
+    def _persist(self, key: str):
+        """エントリを永続化ディレクトリに書き込む（一時ファイル経由で置き換え）"""
+        if not self.persist_dir:
+            return
+        try:
+            os.makedirs(self.persist_dir, exist_ok=True)
+            path = os.path.join(self.persist_dir, f"{key}.json")
+            with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+                json.dump(self._entries[key], f, ensure_ascii=False)
+            os.replace(f"{path}.tmp", path)
+        except Exception as e:
+            logger.warning(f"検索結果キャッシュの書き込みに失敗しました: {e}")
+
+    def _remove(self, key: str):
+        """永続化ディレクトリからエントリを削除する"""
+        if not self.persist_dir:
+            return
+        try:
+            os.remove(os.path.join(self.persist_dir, f"{key}.json"))
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"検索結果キャッシュの削除に失敗しました: {e}")
+
+
+retrieval_cache = RetrievalCache(
+    max_entries=RETRIEVAL_CACHE_MAX_ENTRIES,
+    ttl_seconds=RETRIEVAL_CACHE_TTL_SECONDS,
+    persist_dir=RETRIEVAL_CACHE_PERSIST_DIR
+) if RETRIEVAL_CACHE_ENABLED else None
+
+# 同期マーカーの確認結果（確認間隔内は再利用する）
+_kb_sync_marker = {"value": None, "checked_at": 0.0}
+
+
+def get_kb_sync_marker():
+    """データソースの最新の同期（取り込みジョブ）を表すマーカーを返す。取得できない場合はNoneを返す"""
+    # データソースIDが未設定の場合は、デプロイ時に設定する固定マーカーを使用
+    if not BEDROCK_KB_DATA_SOURCE_ID:
+        return BEDROCK_KB_SYNC_MARKER
+
+    now = time.monotonic()
+    if _kb_sync_marker["value"] is not None and now - _kb_sync_marker["checked_at"] < KB_SYNC_MARKER_CHECK_SECONDS:
+        return _kb_sync_marker["value"]
+
+    try:
+        response = bedrock_agent_client.list_ingestion_jobs(
+            knowledgeBaseId=BEDROCK_KB_ID,
+            dataSourceId=BEDROCK_KB_DATA_SOURCE_ID,
+            sortBy={"attribute": "STARTED_AT", "order": "DESCENDING"},
+            maxResults=10
+        )
+        # 完了済みの最新の取り込みジョブを同期マーカーとする
+        completed_jobs = [job for job in response.get("ingestionJobSummaries", []) if job.get("status") == "COMPLETE"]
+        if completed_jobs:
+            latest_job = completed_jobs[0]
+            marker = f"{latest_job['ingestionJobId']}:{latest_job['updatedAt'].isoformat()}"
+        else:
+            marker = "no-completed-ingestion"
+    except Exception as e:
+        logger.warning(f"ナレッジベースの同期状況の取得に失敗しました: {e}")
+        return None
+
+    _kb_sync_marker["value"] = marker
+    _kb_sync_marker["checked_at"] = now
+    return marker
+
+
+def select_documents(documents: list, score_threshold: float, relative_score_cutoff: float, min_results: int) -> list:
+    """スコアの高い順に並んだ検索結果から、閾値と最上位のスコアに対する割合を満たす上位のチャンクのみを返す
+
+    スコアのない検索結果（旧形式のキャッシュなど）は絞り込まない。
+    """
+    top_score = documents[0]["metadata"].get("score") if documents else None
+    selected = []
+    for document in documents:
+        score = document["metadata"].get("score")
+        if len(selected) >= min_results and score is not None and top_score is not None:
+            if score < score_threshold or score < top_score * relative_score_cutoff:
+                break
+        selected.append(document)
+    return selected
+
+
+@contextmanager
+def measure(durations: dict, stage: str):
+    """with文のブロックの処理時間（ミリ秒）を durations に記録する"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        durations[stage] = round((time.perf_counter() - start) * 1000, 1)
+
+
+def log_durations(durations: dict, handler_start: float, cache_hit: bool):
+    """処理時間の内訳を構造化ログとして出力する（FastAPI側のステージ別の処理時間と突き合わせるため）"""
+    logger.info(
+        "処理時間の内訳",
+        extra={
+            "stages_ms": durations,
+            "total_ms": round((time.perf_counter() - handler_start) * 1000, 1),
+            "cache_hit": cache_hit,
+        }
+    )
+
+
+@logger.inject_lambda_context
 def lambda_handler(event, context):
     """検索クエリを受け取り、Amazon Bedrock Knowledge Baseを使用して関連ドキュメントを検索する"""
+    handler_start = time.perf_counter()
+    durations = {}
     try:
+        # 受信イベントはサンプリングしてログ出力（毎回のシリアライズを避ける）
+        if random.random() < EVENT_LOG_SAMPLE_RATE:
+            logger.info(event)
+
+        # FastAPIの起動時のウォームアップ（実行環境の起動と接続の確立のみを行い、検索はしない）
+        if event.get("warmup"):
+            return {
+                "statusCode": 200,
+                "body": json.dumps({"warmup": True})
+            }
+
         # クエリテキストの取得
         query_text = event.get("query_text")
         
@@ -36,23 +279,50 @@ def lambda_handler(event, context):
                 }, ensure_ascii=False)
             }
             
+        # 検索件数とスコアによる絞り込みの設定（イベントで指定されていない場合は環境変数の値）
+        number_of_results = max(1, min(int(event.get("number_of_results", NUMBER_OF_RESULTS)), MAX_NUMBER_OF_RESULTS))
+        score_threshold = float(event.get("score_threshold", SCORE_THRESHOLD))
+        relative_score_cutoff = float(event.get("relative_score_cutoff", RELATIVE_SCORE_CUTOFF))
+        min_results = int(event.get("min_results", MIN_RESULTS))
+
         logger.info(f"検索クエリ: '{query_text}'、Bedrock Knowledge Base ID: {BEDROCK_KB_ID}")
-        
-        # Bedrock Knowledge Baseクライアントの初期化
-        bedrock_kb_client = boto3.client("bedrock-agent-runtime", region_name=AWS_REGION)
+
+        # 検索結果キャッシュの確認（同期マーカーが取得できない場合はキャッシュを使用しない）
+        cache_key = None
+        with measure(durations, "sync_marker"):
+            sync_marker = get_kb_sync_marker() if retrieval_cache is not None else None
+        if sync_marker is not None:
+            cache_key = RetrievalCache.make_key(query_text, BEDROCK_KB_ID, number_of_results)
+            with measure(durations, "cache_lookup"):
+                cached_documents = retrieval_cache.get(cache_key, sync_marker)
+            if cached_documents is not None:
+                # キャッシュには絞り込み前の検索結果を保存しているため、リクエストごとの条件で絞り込む
+                selected_documents = select_documents(cached_documents, score_threshold, relative_score_cutoff, min_results)
+                logger.info(f"検索結果キャッシュにヒットしました: {len(selected_documents)}/{len(cached_documents)}件")
+                with measure(durations, "serialize"):
+                    body = json.dumps({
+                        "related_documents": selected_documents,
+                        "retrieved_count": len(cached_documents)
+                    }, ensure_ascii=False)
+                log_durations(durations, handler_start, cache_hit=True)
+                return {
+                    "statusCode": 200,
+                    "body": body
+                }
         
         # Bedrock Knowledge Base APIを呼び出し
-        response = bedrock_kb_client.retrieve(
-            knowledgeBaseId=BEDROCK_KB_ID,
-            retrievalQuery={
-                "text": query_text
-            },
-            retrievalConfiguration={
-                "vectorSearchConfiguration": {
-                    "numberOfResults": 5
+        with measure(durations, "retrieve"):
+            response = bedrock_kb_client.retrieve(
+                knowledgeBaseId=BEDROCK_KB_ID,
+                retrievalQuery={
+                    "text": query_text
+                },
+                retrievalConfiguration={
+                    "vectorSearchConfiguration": {
+                        "numberOfResults": number_of_results
+                    }
                 }
-            }
-        )
+            )
         
         # レスポンスから関連ドキュメントを抽出
         retrieved_results = response.get("retrievalResults", [])
@@ -69,17 +339,31 @@ def lambda_handler(event, context):
             document_contents.append({
                 "content": content,
                 "metadata": {
-                    "title": title
+                    "title": title,
+                    # 関連度スコア（FastAPI側での絞り込みにも使用）
+                    "score": result.get("score")
                 }
             })
-        
-        logger.info(f"検索結果件数: {len(document_contents)}件")
+
+        # スコアの閾値と最上位のスコアに対する割合で、必要なチャンクのみに絞り込む
+        selected_documents = select_documents(document_contents, score_threshold, relative_score_cutoff, min_results)
+        logger.info(f"検索結果件数: {len(selected_documents)}/{len(document_contents)}件")
+
+        # 検索結果をキャッシュに保存
+        if cache_key is not None:
+            with measure(durations, "cache_store"):
+                retrieval_cache.put(cache_key, sync_marker, document_contents)
+
         # 検索結果の関連ドキュメントの内容とメタデータを返却
+        with measure(durations, "serialize"):
+            body = json.dumps({
+                "related_documents": selected_documents,
+                "retrieved_count": len(document_contents)
+            }, ensure_ascii=False)
+        log_durations(durations, handler_start, cache_hit=False)
         return {
             "statusCode": 200,
-            "body": json.dumps({
-                "related_documents": document_contents
-            }, ensure_ascii=False)
+            "body": body
         }
         
     except Exception as e:
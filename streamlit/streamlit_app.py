@@ -5,6 +5,25 @@ import json
 
 st.title("社内FAQチャットボット")
 
+
+def iter_sse_events(response):
+    """Server-Sent Events形式のレスポンスを (イベント名, データ) の組として順次返す"""
+    event = "message"
+    data_lines = []
+    for line in response.iter_lines(decode_unicode=True):
+        if line:
+            if line.startswith("event:"):
+                event = line[len("event:"):].strip()
+            elif line.startswith("data:"):
+                data_lines.append(line[len("data:"):].strip())
+            continue
+        # 空行でイベントの区切り
+        if data_lines:
+            yield event, json.loads("\n".join(data_lines))
+        event = "message"
+        data_lines = []
+
+
 # セッション状態を初期化
 if "messages" not in st.session_state:
     st.session_state.messages = []
@@ -36,48 +55,74 @@ if user_message:
     st.session_state.messages.append({"role": "user", "content": user_message})
     
     # APIリクエスト
-    api_url = "http://localhost:8000/chat"  # FastAPIアプリケーションのURL
-    headers = {"Content-Type": "application/json"}
+    api_url = "http://localhost:8000/chat/stream"  # FastAPIアプリケーションのURL（ストリーミング）
+    headers = {"Content-Type": "application/json", "Accept": "text/event-stream"}
+    # 会話履歴はサーバー側でsession_idをキーに管理するため、新しいメッセージのみを送信
     data = {
         "message": user_message,
-        "session_id": st.session_state.session_id,  
-        "messages_history": st.session_state.messages
+        "session_id": st.session_state.session_id
     }
 
     try:
-        # リクエストを送信
-        response = requests.post(api_url, headers=headers, data=json.dumps(data))
+        # リクエストを送信（ストリーミング受信）
+        response = requests.post(api_url, headers=headers, data=json.dumps(data), stream=True)
         # レスポンスのステータスコードを確認
         response.raise_for_status()
-        # レスポンスのJSONデータを取得
-        response_data = response.json()
-        bot_response = response_data.get("response", "応答がありません")
-        related_documents = response_data.get("related_documents", [])
-        
-        # セッションIDを保存（初回のみ）
-        if not st.session_state.session_id:
-            st.session_state.session_id = response_data.get("session_id")
-        
-        # 関連ドキュメント表示の処理
-        with st.chat_message("assistant", avatar="📄"):
-            if related_documents:
-                st.write("以下の関連ドキュメントが見つかりました:")
-                for doc in related_documents:
-                    # 関連ドキュメントのタイトル表示
-                    title = doc['title']
-                    st.markdown(f"* **{title}**")
-            else:
-                st.write("関連ドキュメントが見つかりませんでした")
-        
-        # ドキュメント情報をセッションに保存（既存コードを維持）
-        if related_documents:
-            st.session_state.messages.append({"role": "documents", "content": related_documents})
-        else:
-            st.session_state.messages.append({"role": "documents", "content": []})
-        
+        response.encoding = "utf-8"
+
+        bot_response = ""
+        related_documents = []
+        response_placeholder = None
+
+        for event, event_data in iter_sse_events(response):
+            if event == "related_documents":
+                # セッションIDを保存（初回のみ）
+                # 回答の途中でエラー・切断となった場合も次の質問で会話を継続できるよう、最初のイベントで保存する
+                if not st.session_state.session_id:
+                    st.session_state.session_id = event_data.get("session_id")
+                related_documents = event_data.get("related_documents", [])
+
+                # 関連ドキュメント表示の処理
+                with st.chat_message("assistant", avatar="📄"):
+                    if related_documents:
+                        st.write("以下の関連ドキュメントが見つかりました:")
+                        for doc in related_documents:
+                            # 関連ドキュメントのタイトル表示
+                            title = doc['title']
+                            st.markdown(f"* **{title}**")
+                    else:
+                        st.write("関連ドキュメントが見つかりませんでした")
+
+                # ドキュメント情報をセッションに保存（既存コードを維持）
+                st.session_state.messages.append({"role": "documents", "content": related_documents})
+
+                # ボットの回答の表示領域を用意
+                with st.chat_message("assistant"):
+                    response_placeholder = st.empty()
+
+            elif event == "token":
+                # 受信したチャンクを逐次表示
+                bot_response += event_data.get("text", "")
+                if response_placeholder is not None:
+                    response_placeholder.markdown(bot_response + "▌")
+
+            elif event == "done":
+                # セッションIDを保存（初回のみ）
+                if not st.session_state.session_id:
+                    st.session_state.session_id = event_data.get("session_id")
+
+            elif event == "error":
+                st.error(event_data.get("error", "サーバーエラーが発生しました"))
+                break
+
+        if not bot_response:
+            bot_response = "応答がありません"
         # ボットの回答を表示
-        with st.chat_message("assistant"):
-            st.write(bot_response)
+        if response_placeholder is not None:
+            response_placeholder.markdown(bot_response)
+        else:
+            with st.chat_message("assistant"):
+                st.write(bot_response)
         st.session_state.messages.append({"role": "assistant", "content": bot_response})
 
     except requests.exceptions.RequestException as e:
@@ -85,4 +130,4 @@ if user_message:
     except json.JSONDecodeError:
         st.error("API応答のJSONデコードエラー")
     except Exception as e:
-        st.error(f"予期せぬエラー: {e}")
\ No newline at end of file
+        st.error(f"予期せぬエラー: {e}")